@@ -1,26 +1,114 @@
+import json
 import sqlite3
 import re
+import time
+from contextlib import contextmanager
+
+import metrics
+import migrations
+# the results of signup_acc and change_details are shared with the stores
+from acc_store import AccountStore, ConstraintError, OK, NOT_FOUND, WRONG_PASSWORD, EMAIL_IN_USE, INVALID, ERROR
+from acc_store import ALERT_DIRECTIONS
+from db_connection import ConnectionManager
+from lru_cache import LRUCache
 
 dbpath = "./acc_database.db"
 
+# long-lived, per-thread connections shared by all helpers below
+connections = ConnectionManager()
+
+# read-through caches for find_acc and get_all_favs, keyed by email.
+# Every write below invalidates the emails it touches.
+acc_cache = LRUCache(maxsize=4096, ttl=300)
+favs_cache = LRUCache(maxsize=4096, ttl=300)
+
+def cache_stats():
+    """returns the hit/miss counters of the read caches"""
+    return {"accounts": acc_cache.stats(), "favourites": favs_cache.stats()}
+
+# timings of the helpers below, exposed on /metrics
+QUERY_SECONDS = metrics.registry.histogram(
+    "acc_db_query_duration_seconds", "Time spent running a query in execute_dml or execute_dql.", ("query",))
+QUERY_ROWS = metrics.registry.histogram(
+    "acc_db_query_rows", "Rows returned by execute_dql or changed by execute_dml.", ("query",),
+    buckets=metrics.ROW_BUCKETS)
+TRANSACTION_SECONDS = metrics.registry.histogram(
+    "acc_db_transaction_duration_seconds", "Time from BEGIN to COMMIT or ROLLBACK of a transaction.", ("name",))
+# connections are per thread, so the only wait for the database is for its write lock
+LOCK_WAIT_SECONDS = metrics.registry.histogram(
+    "acc_db_lock_wait_seconds", "Time spent waiting for the write lock at the start of a transaction.")
+
+for _field in ("hits", "misses", "evictions"):
+    metrics.registry.collected(
+        f"acc_cache_{_field}_total", "counter", f"Read cache {_field}.", ("cache",),
+        lambda field=_field: {(name,): stats[field] for name, stats in cache_stats().items()})
+metrics.registry.collected(
+    "acc_cache_entries", "gauge", "Entries held by the read cache.", ("cache",),
+    lambda: {(name,): stats["size"] for name, stats in cache_stats().items()})
+
+# query text -> metrics label, eg. "SELECT Accounts"
+_query_names = {}
+TABLE_PATTERN = re.compile(r'"(\w+)"')
+
+def _query_name(query):
+    name = _query_names.get(query)
+    if name is None:
+        table = TABLE_PATTERN.search(query)
+        verb = query.split(None, 1)[0].upper()
+        name = _query_names[query] = f"{verb} {table.group(1)}" if table else verb
+    return name
+
+def _record_query(query, start, rows):
+    elapsed = time.perf_counter() - start
+    name = _query_name(query)
+    QUERY_SECONDS.observe(elapsed, name)
+    QUERY_ROWS.observe(rows, name)
+    metrics.add_request_time("sql", elapsed)
+
+def init_db():
+    """prepares the account store, eg. brings the database schema up to the latest migration"""
+    store.init()
+
 def execute_dml(query, data):
     """helper function for manipulation of data (e.g. insert, delete)"""
-    with sqlite3.connect(dbpath) as conn:
-        c = conn.cursor()
-
-        c.execute(query, data)
-
+    conn = connections.get(dbpath)
+    start = time.perf_counter()
+
+    # commits on success, rolls back on error
+    with conn:
+        rows = conn.execute(query, data).rowcount
+    _record_query(query, start, rows)
+
+@contextmanager
+def transaction(name="transaction"):
+    """helper for running several statements on one connection, in one write transaction,
+    timed under name in the metrics
+    Yields: sqlite3.Connection"""
+    conn = connections.get(dbpath)
+    start = time.perf_counter()
+
+    # take the write lock up front, so the transaction cannot fail to upgrade later
+    conn.execute("BEGIN IMMEDIATE")
+    LOCK_WAIT_SECONDS.observe(time.perf_counter() - start)
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
         conn.commit()
+    finally:
+        elapsed = time.perf_counter() - start
+        TRANSACTION_SECONDS.observe(elapsed, name)
+        metrics.add_request_time("sql", elapsed)
 
 def execute_dql(query, data):
     """helper function for obtaining data (e.g. read/display)
     Returns: list[dict]"""
-    with sqlite3.connect(dbpath) as conn:
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-
-        c.execute(query, data)
-        result = c.fetchall()
+    conn = connections.get(dbpath)
+    start = time.perf_counter()
+    result = conn.execute(query, data).fetchall()
+    _record_query(query, start, len(result))
 
     if result:
         # Ensure result is converted to a list of dictionaries
@@ -28,7 +116,305 @@ def execute_dql(query, data):
     else:
         return None
 
-    
+
+class SQLiteStore(AccountStore):
+    """
+    Keeps accounts and favourites in the database file at dbpath, through the helpers above,
+    so every process sees the same data and each write is durable once committed.
+    """
+
+    def init(self):
+        """brings the database schema up to the latest migration"""
+        for version in migrations.migrate(connections.get(dbpath)):
+            print(f"Applied migration {version}: {migrations.describe(version)}")
+
+    def close(self):
+        connections.close_all()
+
+    def find_account(self, email):
+        result = execute_dql('''
+                SELECT * FROM "Accounts"
+
+                WHERE "Accounts"."email" = ?;
+                ''', (email,))
+        return result[0] if result else None
+
+    def insert_account(self, username, email, phone_no, password):
+        try:
+            with transaction("insert_account") as conn:
+                return conn.execute('''
+                        INSERT INTO "Accounts" (
+                        "username",
+                        "email",
+                        "phone_no",
+                        "password"
+                        ) VALUES (?, ?, ?, ?)
+                        ON CONFLICT ("email") DO NOTHING
+                        ''', (username, email, phone_no, password)).rowcount == 1
+        except sqlite3.IntegrityError as e:
+            raise ConstraintError(str(e)) from e
+
+    def update_account(self, acc_email, new_record, check=None):
+        new_email = new_record["email"]
+        try:
+            with transaction("update_account") as conn:
+                row = conn.execute('''
+                    SELECT * FROM "Accounts"
+                    WHERE "email" = ?;
+                    ''', (acc_email,)).fetchone()
+
+                if row is None:
+                    return NOT_FOUND
+                if check is not None:
+                    result = check(dict(row))
+                    if result is not None:
+                        return result
+
+                conn.execute('''
+                    UPDATE "Accounts" SET
+                    "username" = ?,
+                    "email" = ?,
+                    "phone_no" = ?,
+                    "password" = ?
+                    WHERE "email" = ?
+                ''', (
+                    new_record["username"],
+                    new_email,
+                    new_record["phone_no"],
+                    new_record["password"],
+                    acc_email
+                ))
+
+                # if email has changed, update the Favourites and AlertSubscriptions tables
+                if acc_email != new_email:
+                    self._move_favourites(conn, acc_email, new_email)
+                    self._move_alerts(conn, acc_email, new_email)
+
+        except sqlite3.IntegrityError as e:
+            if "Accounts.email" in str(e):
+                return EMAIL_IN_USE
+            raise ConstraintError(str(e)) from e
+
+        return OK
+
+    def delete_account(self, email):
+        with transaction("delete_account") as conn:
+            deleted = conn.execute('''
+                    DELETE FROM "Accounts"
+                    WHERE "email" = ?;
+                    ''', (email,)).rowcount
+
+            if deleted:
+                conn.execute('''
+                        DELETE FROM "Favourites"
+                        WHERE "user_email" = ?;
+                        ''', (email,))
+                conn.execute('''
+                        DELETE FROM "AlertSubscriptions"
+                        WHERE "user_email" = ?;
+                        ''', (email,))
+        return bool(deleted)
+
+    def favourites(self, email):
+        result = execute_dql('''
+                        SELECT "carpark_no" FROM "Favourites"
+                        WHERE "Favourites"."user_email" = ?;
+                        ''', (email,))
+        return [row["carpark_no"] for row in result or ()]
+
+    def add_favourite(self, email, carpark_no):
+        execute_dml('''
+                INSERT INTO "Favourites" (
+                "user_email",
+                "carpark_no"
+                ) VALUES (?, ?)
+                ON CONFLICT ("user_email", "carpark_no") DO NOTHING
+                ''', (email, carpark_no))
+
+    def remove_favourite(self, email, carpark_no):
+        execute_dml('''
+                    DELETE FROM "Favourites"
+                    WHERE "user_email" = ?
+                    AND "carpark_no" = ?;
+                    ''', (email, carpark_no))
+
+    def remove_favourites(self, email):
+        execute_dml('''
+                DELETE FROM "Favourites"
+                WHERE "user_email" = ?;
+                ''', (email,))
+
+    def move_favourites(self, old_email, new_email):
+        with transaction("move_favourites") as conn:
+            self._move_favourites(conn, old_email, new_email)
+
+    @staticmethod
+    def _move_favourites(conn, old_email, new_email):
+        # drop the favourites the new email already has first, rather than with UPDATE OR REPLACE,
+        # which would not run the trigger that counts favourites per carpark
+        conn.execute('''
+            DELETE FROM "Favourites"
+            WHERE "user_email" = ?
+            AND "carpark_no" IN (SELECT "carpark_no" FROM "Favourites" WHERE "user_email" = ?)
+        ''', (old_email, new_email))
+        conn.execute('''
+            UPDATE "Favourites"
+            SET "user_email" = ?
+            WHERE "user_email" = ?
+        ''', (new_email, old_email))
+
+    def apply_favourites(self, email, adds, removes):
+        with transaction("apply_fav_changes") as conn:
+            conn.executemany('''
+                INSERT INTO "Favourites" (
+                "user_email",
+                "carpark_no"
+                ) VALUES (?, ?)
+                ON CONFLICT ("user_email", "carpark_no") DO NOTHING
+                ''', [(email, carpark_no) for carpark_no in adds])
+
+            conn.executemany('''
+                DELETE FROM "Favourites"
+                WHERE "user_email" = ?
+                AND "carpark_no" = ?;
+                ''', [(email, carpark_no) for carpark_no in removes])
+
+            result = conn.execute('''
+                SELECT "carpark_no" FROM "Favourites"
+                WHERE "Favourites"."user_email" = ?;
+                ''', (email,)).fetchall()
+        return [row["carpark_no"] for row in result]
+
+    # FavouriteCounts is kept up to date by triggers on Favourites (see migrations.py)
+
+    def favourite_counts(self, carpark_nos):
+        result = execute_dql('''
+                SELECT "carpark_no", "favourites" FROM "FavouriteCounts"
+                WHERE "carpark_no" IN (SELECT "value" FROM json_each(?));
+                ''', (json.dumps(list(carpark_nos)),))
+        return {row["carpark_no"]: row["favourites"] for row in result or ()}
+
+    def most_favourited(self, n):
+        result = execute_dql('''
+                SELECT "carpark_no", "favourites" FROM "FavouriteCounts"
+                ORDER BY "favourites" DESC, "carpark_no"
+                LIMIT ?;
+                ''', (n,))
+        return [(row["carpark_no"], row["favourites"]) for row in result or ()]
+
+    def rebuild_favourite_counts(self):
+        with transaction("rebuild_favourite_counts") as conn:
+            counts = dict(conn.execute('''
+                SELECT "carpark_no", COUNT(*) FROM "Favourites"
+                GROUP BY "carpark_no";
+                ''').fetchall())
+            kept = dict(conn.execute('SELECT "carpark_no", "favourites" FROM "FavouriteCounts"').fetchall())
+
+            conn.execute('DELETE FROM "FavouriteCounts"')
+            conn.executemany('''
+                INSERT INTO "FavouriteCounts" ("carpark_no", "favourites")
+                VALUES (?, ?)
+                ''', counts.items())
+
+        return sum(1 for carpark_no in counts.keys() | kept.keys() if counts.get(carpark_no) != kept.get(carpark_no))
+
+    # AlertVersion is bumped by triggers on AlertSubscriptions (see migrations.py)
+
+    def add_alert(self, email, carpark_no, direction, lots):
+        with transaction("add_alert") as conn:
+            conn.execute('''
+                INSERT INTO "AlertSubscriptions" (
+                "user_email",
+                "carpark_no",
+                "direction",
+                "lots"
+                ) VALUES (?, ?, ?, ?)
+                ON CONFLICT ("user_email", "carpark_no", "direction", "lots") DO NOTHING
+                ''', (email, carpark_no, direction, lots))
+            return conn.execute('''
+                SELECT "id" FROM "AlertSubscriptions"
+                WHERE "user_email" = ? AND "carpark_no" = ? AND "direction" = ? AND "lots" = ?;
+                ''', (email, carpark_no, direction, lots)).fetchone()["id"]
+
+    def remove_alert(self, email, alert_id):
+        with transaction("remove_alert") as conn:
+            return conn.execute('''
+                DELETE FROM "AlertSubscriptions"
+                WHERE "id" = ?
+                AND "user_email" = ?;
+                ''', (alert_id, email)).rowcount == 1
+
+    def alerts(self, email):
+        result = execute_dql('''
+                SELECT "id", "carpark_no", "direction", "lots" FROM "AlertSubscriptions"
+                WHERE "user_email" = ?
+                ORDER BY "id";
+                ''', (email,))
+        return result or []
+
+    def all_alerts(self):
+        result = execute_dql('''
+                SELECT "id", "user_email", "carpark_no", "direction", "lots" FROM "AlertSubscriptions";
+                ''', ())
+        return [(row["id"], row["user_email"], row["carpark_no"], row["direction"], row["lots"])
+                for row in result or ()]
+
+    def alerts_version(self):
+        result = execute_dql('SELECT "version" FROM "AlertVersion"', ())
+        return result[0]["version"]
+
+    def revoke_sessions(self, email, revoked_at, expired_before):
+        with transaction("revoke_sessions") as conn:
+            conn.execute('''
+                INSERT INTO "SessionRevocations" ("email", "revoked_at") VALUES (?, ?)
+                ON CONFLICT ("email") DO UPDATE SET "revoked_at" = MAX("revoked_at", excluded."revoked_at")
+                ''', (email, revoked_at))
+            conn.execute('''
+                DELETE FROM "SessionRevocations"
+                WHERE "revoked_at" < ?
+                ''', (expired_before,))
+
+    def sessions_revoked_at(self, email):
+        result = execute_dql('''
+                SELECT "revoked_at" FROM "SessionRevocations"
+                WHERE "email" = ?;
+                ''', (email,))
+        return result[0]["revoked_at"] if result else None
+
+    @staticmethod
+    def _move_alerts(conn, old_email, new_email):
+        # an alert the new email already has is kept once: the conflicting rows are left behind, then deleted
+        conn.execute('''
+            UPDATE OR IGNORE "AlertSubscriptions"
+            SET "user_email" = ?
+            WHERE "user_email" = ?
+        ''', (new_email, old_email))
+        conn.execute('''
+            DELETE FROM "AlertSubscriptions"
+            WHERE "user_email" = ?
+        ''', (old_email,))
+
+# where accounts and favourites are kept; replaced through use_store
+store = SQLiteStore()
+
+def use_store(new_store):
+    """
+    Switches every function below to another AccountStore, eg. acc_store.MemoryStore.
+    Call it before init_db. The read caches are cleared, and only used if the store asks for them.
+
+    Parameters:
+    -new_store: AccountStore
+    """
+    global store
+    store = new_store
+    for cache in (acc_cache, favs_cache):
+        cache.clear()
+        cache.enabled = new_store.cached
+
+
+# compiled once at import, so preforked workers share it
+EMAIL_PATTERN = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,7}\b')
+
 def check_email(email):
     """
     Checks if email is in valid format.
@@ -45,9 +431,7 @@ def check_email(email):
     Returns:
     -Boolean
     """
-    regex = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,7}\b'
-
-    if(re.fullmatch(regex, email)):
+    if(EMAIL_PATTERN.fullmatch(email)):
         return True
 
     else:
@@ -116,6 +500,7 @@ def find_acc(email):
     """
     Finds account by email, and returns the account information as a dictionary. 
     Returns None if no results are found.
+    Results are served from acc_cache when possible.
     
     Parameters:
     -email: str
@@ -123,16 +508,9 @@ def find_acc(email):
     Returns:
     -dict
     """
-    find_acc = '''
-                SELECT * FROM "Accounts"
-
-                WHERE "Accounts"."email" = ?;
-                '''
-    
-    result = execute_dql(find_acc, (email,))
-    if result and isinstance(result, list) and len(result) > 0:
-        return result[0]  # Return the first (and ideally only) record from the list
-    return None
+    acc = acc_cache.get_or_load(email, lambda: store.find_account(email))
+    # copy, so callers cannot modify the cached record
+    return None if acc is None else dict(acc)
 
 def new_acc(username, email, phone_no, password):
     """
@@ -155,22 +533,11 @@ def new_acc(username, email, phone_no, password):
 
     if valid_email and valid_number and valid_pw:
         try:
-            acc_details = {"username":username,
-                        "email":email,
-                        "phone_no":phone_no,
-                        "password":password}
-
-            new_acc = '''
-                    INSERT INTO "Accounts" (
-                    "username",
-                    "email",
-                    "phone_no",
-                    "password"
-                    ) VALUES (
-                    :username, :email, :phone_no, :password)
-                    '''
-
-            execute_dml(new_acc, acc_details)
+            if not store.insert_account(username, email, phone_no, password):
+                print(f"An account with email {email} already exists")
+                return False
+
+            acc_cache.invalidate(email)
             return True
 
         except Exception as e:
@@ -180,6 +547,36 @@ def new_acc(username, email, phone_no, password):
     else:
         return False
 
+def signup_acc(username, email, phone_no, password):
+    """
+    Adds a new account into the database if no account uses the email yet,
+    checking for the existing account and inserting in a single statement.
+    Returns OK if the account is created, EMAIL_IN_USE if the email is taken,
+    INVALID if a field is invalid, else returns ERROR.
+
+    Parameters:
+    -username: str
+    -email: str
+    -phone_no: str
+    -password: str
+
+    Returns:
+    -str
+    """
+    if not (check_email(email) and check_phone_no(phone_no) and check_password(password)):
+        return INVALID
+
+    try:
+        inserted = store.insert_account(username, email, phone_no, password)
+
+        if inserted:
+            acc_cache.invalidate(email)
+        return OK if inserted else EMAIL_IN_USE
+
+    except Exception as e:
+        print(e)
+        return ERROR
+
 def login(email, password):
     """
     Checks login credentials match information in database.
@@ -203,62 +600,88 @@ def login(email, password):
         return False
 
 
+def _invalidate_acc(acc_email, new_email):
+    """drops cached reads for an account whose email may have changed"""
+    acc_cache.invalidate(acc_email, new_email)
+    favs_cache.invalidate(acc_email, new_email)
+
+def _valid_record(new_record):
+    """checks the email, phone number and password of an account record"""
+    return (check_email(new_record["email"])
+            and check_phone_no(new_record["phone_no"])
+            and check_password(new_record["password"]))
+
 def update_details(acc_email, new_record):
     """
     Updates account details in database.
     Retrieves record using the email that account is currently registered under.
     new_record requires ALL fields (ie. username, email, phone_no, password)to be passed in, regardless of whether it was updated.
+    The account and its favourites are updated in a single transaction.
     Returns True if update is successful, else returns False.
     
     Parameters:
     -email: str
     -new_record: dict 
     """
-    # check if the account exists
-    if find_acc(acc_email) is None:
-        print("Account does not exist")
+    if not _valid_record(new_record):
+        print("Invalid email/phone number/password")
         return False
 
-    new_email = new_record["email"]
-    phone_no = new_record["phone_no"]
-    password = new_record["password"]
+    try:
+        result = store.update_account(acc_email, new_record)
 
-    if check_email(new_email) and check_phone_no(phone_no) and check_password(password):
-        try:
-            # update Accounts table
-            update = '''
-                UPDATE "Accounts" SET
-                "username" = ?,
-                "email" = ?,
-                "phone_no" = ?,
-                "password" = ?
-                WHERE "email" = ?
-            '''
-
-            data = (
-                new_record["username"],
-                new_email,
-                phone_no,
-                password,
-                acc_email
-            )
-            
-            execute_dml(update, data)
-
-            # if email has changed, update the Favourites table
-            if acc_email != new_email:
-                update_fav_email(acc_email, new_email)
-
-            print(f"User with email {acc_email} updated successfully.")
-            return True
-        
-        except Exception as e:
-            print(f"Error during update: {e}")
+        if result == NOT_FOUND:
+            print("Account does not exist")
             return False
-    else:
-        print("Invalid email/phone number/password")
+        if result == EMAIL_IN_USE:
+            print(f"An account with email {new_record['email']} already exists")
+            return False
+
+        _invalidate_acc(acc_email, new_record["email"])
+        print(f"User with email {acc_email} updated successfully.")
+        return True
+
+    except Exception as e:
+        print(f"Error during update: {e}")
         return False
 
+def change_details(acc_email, current_password, new_record):
+    """
+    Updates account details after checking the current password, in a single transaction:
+    the account is looked up once, and the email change cascades to the favourites.
+    new_record requires ALL fields (ie. username, email, phone_no, password).
+    Returns OK if the update is successful, NOT_FOUND if the account does not exist,
+    WRONG_PASSWORD if current_password is incorrect, EMAIL_IN_USE if the new email belongs
+    to another account, INVALID if a field is invalid, else returns ERROR.
+
+    Parameters:
+    -acc_email: str
+    -current_password: str
+    -new_record: dict
+
+    Returns:
+    -str
+    """
+    def check(account):
+        if account["password"] != current_password:
+            return WRONG_PASSWORD
+        if not _valid_record(new_record):
+            return INVALID
+        return None
+
+    try:
+        result = store.update_account(acc_email, new_record, check)
+        if result != OK:
+            return result
+
+        _invalidate_acc(acc_email, new_record["email"])
+        print(f"User with email {acc_email} updated successfully.")
+        return OK
+
+    except Exception as e:
+        print(f"Error during update: {e}")
+        return ERROR
+
 def update_fav_email(old_email, new_email):
     """
     Updates all favourite records to reflect the new email.
@@ -272,13 +695,8 @@ def update_fav_email(old_email, new_email):
     -Boolean
     """
     try:
-        update_fav = '''
-            UPDATE "Favourites"
-            SET "user_email" = ?
-            WHERE "user_email" = ?
-        '''
-
-        execute_dml(update_fav, (new_email, old_email))
+        store.move_favourites(old_email, new_email)
+        favs_cache.invalidate(old_email, new_email)
         print(f"Favourites updated from {old_email} to {new_email}")
         return True
     
@@ -299,12 +717,8 @@ def delete_all_favs(email):
     -Boolean
     """
     try:
-        query = '''
-                DELETE FROM "Favourites"
-                WHERE "user_email" = ?;
-                '''
-        
-        execute_dml(query, (email,))
+        store.remove_favourites(email)
+        favs_cache.invalidate(email)
         return True
     
     except Exception as e:
@@ -313,8 +727,8 @@ def delete_all_favs(email):
 
 def delete_acc(email):
     """
-    Deletes user account and their favourites from the database.
-    Returns True if deletion is successful, else returns False.
+    Deletes user account and their favourites from the database, in a single transaction.
+    Returns True if deletion is successful, None if the account does not exist, else returns False.
 
     Parameters:
     -email: str
@@ -322,21 +736,13 @@ def delete_acc(email):
     Returns:
     -Boolean
     """
-    # acc does not exist
-    if find_acc(email) is None:
-        return False
-
     try:
-        # delete all their favourite carparks first
-        delete_all_favs(email)
+        # acc does not exist
+        if not store.delete_account(email):
+            return None
 
-        # then delete their account
-        query = '''
-                DELETE FROM "Accounts"
-                WHERE "email" = ?;
-                '''
-        
-        execute_dml(query, (email,))
+        acc_cache.invalidate(email)
+        favs_cache.invalidate(email)
         return True
     
     except Exception as e:
@@ -347,6 +753,7 @@ def delete_acc(email):
 def add_fav(email, carpark_no):
     """
     Adds a user's favourite carpark to the database.
+    Adding a carpark that is already a favourite is a no-op.
     Returns True if favourite carpark is successfully added, else returns False.
 
     Parameters:
@@ -357,17 +764,8 @@ def add_fav(email, carpark_no):
     -Boolean
     """
     try:
-        fav_dict = {"user_email": email, "carpark_no": carpark_no}
-
-        add_fav = '''
-                INSERT INTO "Favourites" (
-                "user_email",
-                "carpark_no"
-                ) VALUES (
-                :user_email, :carpark_no)
-                '''
-        
-        execute_dml(add_fav, fav_dict)
+        store.add_favourite(email, carpark_no)
+        favs_cache.invalidate(email)
         return True
 
     except Exception as e:
@@ -387,13 +785,8 @@ def delete_fav(email, carpark_no):
     -Boolean
     """
     try:
-        delete_fav = '''
-                    DELETE FROM "Favourites"
-                    WHERE "user_email" = ?
-                    AND "carpark_no" = ?;
-                    '''
-        
-        execute_dml(delete_fav, (email, carpark_no))
+        store.remove_favourite(email, carpark_no)
+        favs_cache.invalidate(email)
         return True
     
     except Exception as e:
@@ -405,6 +798,7 @@ def get_all_favs(email):
     Retrieves all of the user's favourite carparks.
     Returns a list of all the carpark numbers.
     Returns None if no carparks are favourited.
+    Results are served from favs_cache when possible.
 
     Parameters:
     -email: str
@@ -413,22 +807,205 @@ def get_all_favs(email):
     -fav_list: list
     """
     try:
-        get_all_favs = '''
-                        SELECT * FROM "Favourites"
-                        WHERE "Favourites"."user_email" = ?;
-                        '''
-        result = execute_dql(get_all_favs, (email,))
+        def load():
+            fav_list = store.favourites(email)
+            return tuple(fav_list) if fav_list else None
 
-        if result is None:
-            return None
-        
-        else:
-            fav_list = []
-            for fav_record in result:
-                fav_list.append(fav_record["carpark_no"])
+        favs = favs_cache.get_or_load(email, load)
+        return None if favs is None else list(favs)
+
+    except Exception as e:
+        print(e)
+        return False
+
+def apply_fav_changes(email, operations):
+    """
+    Applies a batch of favourite additions and removals for a user in a single transaction.
+    Operations are applied in order, so only the last operation on each carpark takes effect.
+    Returns the user's resulting favourite carparks if successful, else returns False.
+
+    Parameters:
+    -email: str
+    -operations: list of dict ({"op": "add" or "remove", "carpark_no": str})
+
+    Returns:
+    -fav_list: list
+    """
+    # keep the last operation on each carpark
+    final = {}
+    for operation in operations:
+        op = operation.get("op")
+        carpark_no = operation.get("carpark_no")
+        if op not in ("add", "remove") or not isinstance(carpark_no, str) or not carpark_no:
+            print(f"Invalid favourite operation: {operation}")
+            return False
+        final[carpark_no] = op
+
+    adds = [carpark_no for carpark_no, op in final.items() if op == "add"]
+    removes = [carpark_no for carpark_no, op in final.items() if op == "remove"]
+
+    try:
+        result = store.apply_favourites(email, adds, removes)
+        favs_cache.invalidate(email)
+        return result
+
+    except Exception as e:
+        print(e)
+        return False
+
+def favourite_counts(carpark_nos):
+    """
+    Retrieves how many users favourited each of the given carparks.
+    The counts are kept up to date by every favourite write, so no favourites are counted here.
+    Returns False if the counts could not be read.
+
+    Parameters:
+    -carpark_nos: list of str
+
+    Returns:
+    -dict (carpark number to count; carparks nobody favourited are left out)
+    """
+    try:
+        return store.favourite_counts(carpark_nos)
+
+    except Exception as e:
+        print(e)
+        return False
+
+def most_favourited(n):
+    """
+    Retrieves the n carparks favourited by the most users, most first.
+    Returns False if the counts could not be read.
+
+    Parameters:
+    -n: int
+
+    Returns:
+    -list of (carpark_no, count)
+    """
+    try:
+        return store.most_favourited(n)
+
+    except Exception as e:
+        print(e)
+        return False
+
+def rebuild_favourite_counts():
+    """
+    Counts every carpark's favourites again from scratch, correcting any count that drifted.
+    Returns the number of carparks whose count was wrong.
+
+    Returns:
+    -int
+    """
+    return store.rebuild_favourite_counts()
+
+
+def add_alert(email, carpark_no, direction, lots):
+    """
+    Subscribes a user to an alert for when a carpark's available lots go above or below a threshold.
+    Subscribing again to the same carpark, direction and lots returns the existing subscription.
+    Returns the subscription's id if successful, else returns False.
+
+    Parameters:
+    -email: str
+    -carpark_no: str
+    -direction: str ("above" or "below")
+    -lots: int
+
+    Returns:
+    -int
+    """
+    if direction not in ALERT_DIRECTIONS or type(lots) is not int or lots < 0:
+        print(f"Invalid alert: {direction} {lots}")
+        return False
+
+    try:
+        return store.add_alert(email, carpark_no, direction, lots)
+
+    except Exception as e:
+        print(e)
+        return False
+
+def delete_alert(email, alert_id):
+    """
+    Deletes one of a user's alert subscriptions.
+    Returns True if deletion is successful, None if the user has no such subscription, else returns False.
+
+    Parameters:
+    -email: str
+    -alert_id: int
+
+    Returns:
+    -Boolean
+    """
+    try:
+        return True if store.remove_alert(email, alert_id) else None
+
+    except Exception as e:
+        print(e)
+        return False
+
+def get_alerts(email):
+    """
+    Retrieves all of the user's alert subscriptions, oldest first.
+    Returns False if they could not be read.
+
+    Parameters:
+    -email: str
 
-            return fav_list
+    Returns:
+    -list of dict (id, carpark_no, direction, lots)
+    """
+    try:
+        return store.alerts(email)
 
     except Exception as e:
         print(e)
-        return False
\ No newline at end of file
+        return False
+
+def all_alerts():
+    """
+    Retrieves every alert subscription, for building the index they are evaluated with
+    (see availability_alerts.py), along with the version they were read at.
+
+    Returns:
+    -(int, list of (id, email, carpark_no, direction, lots))
+    """
+    # read the version first: a change in between is picked up by the next reload
+    version = store.alerts_version()
+    return version, store.all_alerts()
+
+def alerts_version():
+    """
+    Returns a number that changes whenever any alert subscription changes.
+
+    Returns:
+    -int
+    """
+    return store.alerts_version()
+
+def revoke_sessions(email, revoked_at, expired_before):
+    """
+    Records in the store that every session token issued for email up to revoked_at is revoked,
+    so every process sharing the store rejects them (see session_tokens.py).
+    Revocations made before expired_before are forgotten, since their tokens have expired.
+
+    Parameters:
+    -email: str
+    -revoked_at: float (unix time)
+    -expired_before: float (unix time)
+    """
+    store.revoke_sessions(email, revoked_at, expired_before)
+
+def sessions_revoked_at(email):
+    """
+    Returns the time the session tokens of email were last revoked, or None.
+
+    Parameters:
+    -email: str
+
+    Returns:
+    -float
+    """
+    return store.sessions_revoked_at(email)
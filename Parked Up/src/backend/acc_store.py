@@ -0,0 +1,622 @@
+"""
+Account Stores
+
+The storage behind `acc_database`. Validation, the read caches and the results
+of the public functions stay in `acc_database`; reading and writing accounts and
+favourites goes through an AccountStore, so the storage can be swapped without
+touching the routes:
+
+Alert subscriptions (see `availability_alerts`) are kept by the same store, so
+they move and go with the account.
+
+- SQLiteStore (in `acc_database`): the account database file, shared by every
+  process and durable on every commit. This is the default.
+- MemoryStore (below): dicts and sets in the process, indexed by email and phone
+  number, with no per-query overhead. It is only written to disk as a snapshot:
+  writes since the last snapshot are lost if the process dies, and every process
+  has its own copy, so it is meant for a single server process, tests and benchmarks.
+
+The server picks a store with ACC_STORE (see `server.py`). Every store must pass
+`python store_conformance.py`, which runs the same checks against each of them.
+"""
+
+import bisect
+import json
+import os
+import threading
+from collections import Counter
+
+# results of the compound account operations (signup_acc, change_details)
+OK = "ok"
+NOT_FOUND = "not_found"
+WRONG_PASSWORD = "wrong_password"
+EMAIL_IN_USE = "email_in_use"
+INVALID = "invalid"
+ERROR = "error"
+
+# an alert fires when a carpark's available lots go above or below its threshold
+ALERT_DIRECTIONS = ("above", "below")
+
+SNAPSHOT_VERSION = 1
+
+# seconds between snapshots of a MemoryStore, when snapshots are on
+SNAPSHOT_INTERVAL = 60
+
+
+class ConstraintError(Exception):
+    """A write would break a uniqueness constraint other than the account's email (eg. the phone number)."""
+
+
+class AccountStore:
+    """
+    Reads and writes accounts and favourites.
+
+    Accounts are dicts of username, email, phone_no and password, keyed by email.
+    Email and phone number are each unique across accounts. Favourites are sets of
+    carpark numbers per email, listed in carpark number order. Every write keeps a
+    count of favourites per carpark up to date, so popularity is read without
+    counting every favourite. Alert subscriptions are (id, email, carpark number,
+    direction, lots), unique on everything but the id; a version number goes up
+    with every change to them.
+    """
+
+    # whether acc_database should cache reads in front of this store
+    cached = True
+
+    # whether every process using the store sees the same data
+    shared = True
+
+    def init(self):
+        """Prepares the storage (eg. applies migrations or loads a snapshot)."""
+
+    def close(self):
+        """Releases the storage, saving anything that is not saved yet."""
+
+    def find_account(self, email):
+        """
+        Returns the account with this email as a dict, or None.
+        """
+        raise NotImplementedError
+
+    def insert_account(self, username, email, phone_no, password):
+        """
+        Adds an account, unless one already uses the email.
+        Raises ConstraintError if the phone number is in use.
+
+        Returns:
+        -Boolean, False if the email is in use
+        """
+        raise NotImplementedError
+
+    def update_account(self, acc_email, new_record, check=None):
+        """
+        Replaces every field of an account, moving its favourites and alert subscriptions
+        if the email changes, as a single operation. check(account) is called first with the current account,
+        and the update is abandoned if it returns a result.
+        Raises ConstraintError if the new phone number belongs to another account.
+
+        Parameters:
+        -acc_email: str
+        -new_record: dict (username, email, phone_no, password)
+        -check: callable returning a result or None
+
+        Returns:
+        -str, OK, NOT_FOUND, EMAIL_IN_USE if the new email belongs to another account,
+         or the result of check
+        """
+        raise NotImplementedError
+
+    def delete_account(self, email):
+        """
+        Deletes an account, its favourites and its alert subscriptions.
+
+        Returns:
+        -Boolean, False if the account does not exist
+        """
+        raise NotImplementedError
+
+    def favourites(self, email):
+        """
+        Returns the carpark numbers favourited under email, in order.
+
+        Returns:
+        -list
+        """
+        raise NotImplementedError
+
+    def add_favourite(self, email, carpark_no):
+        """Adds a favourite; adding an existing favourite is a no-op."""
+        raise NotImplementedError
+
+    def remove_favourite(self, email, carpark_no):
+        """Removes a favourite, if it exists."""
+        raise NotImplementedError
+
+    def remove_favourites(self, email):
+        """Removes every favourite of email."""
+        raise NotImplementedError
+
+    def move_favourites(self, old_email, new_email):
+        """Moves every favourite of old_email to new_email, merging with those new_email already has."""
+        raise NotImplementedError
+
+    def apply_favourites(self, email, adds, removes):
+        """
+        Adds and removes favourites of email as a single operation.
+
+        Parameters:
+        -email: str
+        -adds: list of carpark numbers
+        -removes: list of carpark numbers, disjoint from adds
+
+        Returns:
+        -list, the resulting favourites, in order
+        """
+        raise NotImplementedError
+
+    def favourite_counts(self, carpark_nos):
+        """
+        Returns how many accounts favourited each of the carparks, from the kept counts.
+
+        Parameters:
+        -carpark_nos: list of carpark numbers
+
+        Returns:
+        -dict of carpark number to count, leaving out carparks with none
+        """
+        raise NotImplementedError
+
+    def most_favourited(self, n):
+        """
+        Returns the n most favourited carparks, from the kept counts.
+
+        Returns:
+        -list of (carpark number, count), most first, ties in carpark number order
+        """
+        raise NotImplementedError
+
+    def rebuild_favourite_counts(self):
+        """
+        Counts the favourites of every carpark again from scratch, replacing the kept counts.
+
+        Returns:
+        -int, the number of carparks whose kept count was wrong
+        """
+        raise NotImplementedError
+
+    def add_alert(self, email, carpark_no, direction, lots):
+        """
+        Subscribes email to an alert; subscribing again to the same alert is a no-op.
+
+        Parameters:
+        -email: str
+        -carpark_no: str
+        -direction: "above" or "below"
+        -lots: int
+
+        Returns:
+        -int, the subscription's id
+        """
+        raise NotImplementedError
+
+    def remove_alert(self, email, alert_id):
+        """
+        Removes one of email's alert subscriptions.
+
+        Returns:
+        -Boolean, False if email has no subscription with this id
+        """
+        raise NotImplementedError
+
+    def alerts(self, email):
+        """
+        Returns email's alert subscriptions, in id order.
+
+        Returns:
+        -list of dict (id, carpark_no, direction, lots)
+        """
+        raise NotImplementedError
+
+    def all_alerts(self):
+        """
+        Returns every alert subscription.
+
+        Returns:
+        -list of (id, email, carpark number, direction, lots)
+        """
+        raise NotImplementedError
+
+    def alerts_version(self):
+        """
+        Returns a number that changes whenever an alert subscription is added, removed or moved.
+        """
+        raise NotImplementedError
+
+    def revoke_sessions(self, email, revoked_at, expired_before):
+        """
+        Records that the session tokens issued for email up to revoked_at are revoked,
+        forgetting revocations made before expired_before, whose tokens have all expired.
+        """
+        raise NotImplementedError
+
+    def sessions_revoked_at(self, email):
+        """
+        Returns the time email's session tokens were last revoked, or None.
+        """
+        raise NotImplementedError
+
+
+def stored_phone_no(phone_no):
+    """
+    Returns the phone number as the Accounts table stores it: as an integer if it is all digits,
+    since the column has integer affinity, else unchanged.
+    """
+    if isinstance(phone_no, str) and phone_no.isascii() and phone_no.isdigit():
+        return int(phone_no)
+    return phone_no
+
+
+class MemoryStore(AccountStore):
+    """
+    Keeps accounts, favourites and alert subscriptions in dicts and sets, behind one
+    lock, and snapshots them to a JSON file, if given a path. Favourite counts are kept in a dict, and
+    in a list sorted by count for the most favourited; they are not snapshotted,
+    but counted again when a snapshot is loaded.
+    """
+
+    cached = False
+    shared = False
+
+    def __init__(self, snapshot_path=None):
+        self.snapshot_path = snapshot_path
+        self._accounts = {}    # email -> account dict
+        self._phones = {}      # phone_no -> email
+        self._favourites = {}  # email -> set of carpark numbers
+        self._counts = {}      # carpark number -> favourites, if any
+        self._ranking = []     # (-favourites, carpark number), sorted
+        self._alerts = {}      # id -> (email, carpark number, direction, lots)
+        self._alert_ids = {}   # (email, carpark number, direction, lots) -> id
+        self._email_alerts = {}  # email -> set of ids
+        self._next_alert_id = 1
+        self._alerts_version = 0
+        self._revocations = {}  # email -> time its session tokens were revoked; not snapshotted
+        self._lock = threading.Lock()
+        self._changes = 0      # writes since the last snapshot
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._accounts)
+
+    def init(self):
+        """Loads the snapshot, if there is one."""
+        if self.snapshot_path and os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != SNAPSHOT_VERSION:
+                raise ValueError(f"{self.snapshot_path} is a version {data.get('version')} snapshot, "
+                                 f"expected {SNAPSHOT_VERSION}")
+            # snapshots from before alerts have none
+            self.restore(data["accounts"], data["favourites"].items(), data.get("alerts", ()))
+            print(f"Loaded {len(self._accounts)} accounts from {self.snapshot_path}")
+
+    def close(self):
+        """Stops periodic snapshots and writes a final one."""
+        self.stop_snapshots()
+        if self.snapshot_path:
+            self.snapshot()
+
+    def restore(self, accounts, favourites, alerts=()):
+        """
+        Replaces the contents of the store.
+
+        Parameters:
+        -accounts: iterable of (username, email, phone_no, password)
+        -favourites: iterable of (email, iterable of carpark numbers)
+        -alerts: iterable of (id, email, carpark number, direction, lots)
+        """
+        with self._lock:
+            self._accounts = {}
+            self._phones = {}
+            for username, email, phone_no, password in accounts:
+                phone_no = stored_phone_no(phone_no)
+                self._accounts[email] = {
+                    "username": username, "email": email, "phone_no": phone_no, "password": password,
+                }
+                self._phones[phone_no] = email
+            self._favourites = {}
+            for email, carparks in favourites:
+                carparks = set(carparks)
+                if carparks:
+                    self._favourites[email] = carparks
+            self._count_all()
+            self._alerts = {alert_id: (email, carpark_no, direction, lots)
+                            for alert_id, email, carpark_no, direction, lots in alerts}
+            self._alert_ids = {alert: alert_id for alert_id, alert in self._alerts.items()}
+            self._email_alerts = {}
+            for alert_id, alert in self._alerts.items():
+                self._email_alerts.setdefault(alert[0], set()).add(alert_id)
+            self._next_alert_id = max(self._alerts, default=0) + 1
+            self._alerts_version += 1
+            self._changes = 0
+
+    def snapshot(self, path=None):
+        """
+        Writes the store to path (default: snapshot_path), replacing the file atomically,
+        if anything changed since the last snapshot.
+
+        Returns:
+        -Boolean, True if a snapshot was written
+        """
+        path = path or self.snapshot_path
+        with self._lock:
+            if not self._changes and os.path.exists(path):
+                return False
+            # copy under the lock, serialize outside it
+            accounts = [(acc["username"], acc["email"], acc["phone_no"], acc["password"])
+                        for acc in self._accounts.values()]
+            favourites = {email: sorted(carparks) for email, carparks in self._favourites.items()}
+            alerts = [(alert_id, *alert) for alert_id, alert in self._alerts.items()]
+            changes, self._changes = self._changes, 0
+
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": SNAPSHOT_VERSION, "accounts": accounts, "favourites": favourites,
+                           "alerts": alerts}, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            with self._lock:
+                # try again next time
+                self._changes += changes
+            raise
+        return True
+
+    def start_snapshots(self, interval=SNAPSHOT_INTERVAL):
+        """
+        Snapshots the store every interval seconds from a background thread, until close().
+        """
+        if not self.snapshot_path or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._snapshot_loop, args=(interval,),
+                                        name="account-snapshots", daemon=True)
+        self._thread.start()
+
+    def stop_snapshots(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _snapshot_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.snapshot()
+            except OSError as e:
+                print(f"Error writing account snapshot: {e}")
+
+    def find_account(self, email):
+        account = self._accounts.get(email)
+        return None if account is None else dict(account)
+
+    def insert_account(self, username, email, phone_no, password):
+        phone_no = stored_phone_no(phone_no)
+        with self._lock:
+            if email in self._accounts:
+                return False
+            if phone_no in self._phones:
+                raise ConstraintError("phone number is already in use")
+            self._accounts[email] = {"username": username, "email": email, "phone_no": phone_no, "password": password}
+            self._phones[phone_no] = email
+            self._changes += 1
+        return True
+
+    def update_account(self, acc_email, new_record, check=None):
+        new_email = new_record["email"]
+        phone_no = stored_phone_no(new_record["phone_no"])
+        with self._lock:
+            account = self._accounts.get(acc_email)
+            if account is None:
+                return NOT_FOUND
+            if check is not None:
+                result = check(dict(account))
+                if result is not None:
+                    return result
+            if new_email != acc_email and new_email in self._accounts:
+                return EMAIL_IN_USE
+            if self._phones.get(phone_no, acc_email) != acc_email:
+                raise ConstraintError("phone number is already in use")
+
+            del self._phones[account["phone_no"]]
+            del self._accounts[acc_email]
+            self._accounts[new_email] = {
+                "username": new_record["username"], "email": new_email,
+                "phone_no": phone_no, "password": new_record["password"],
+            }
+            self._phones[phone_no] = new_email
+            if new_email != acc_email:
+                self._move_favourites(acc_email, new_email)
+                self._move_alerts(acc_email, new_email)
+            self._changes += 1
+        return OK
+
+    def delete_account(self, email):
+        with self._lock:
+            account = self._accounts.pop(email, None)
+            if account is None:
+                return False
+            del self._phones[account["phone_no"]]
+            for carpark_no in self._favourites.pop(email, ()):
+                self._count(carpark_no, -1)
+            self._move_alerts(email, None)
+            self._changes += 1
+        return True
+
+    def favourites(self, email):
+        with self._lock:
+            return sorted(self._favourites.get(email, ()))
+
+    def add_favourite(self, email, carpark_no):
+        with self._lock:
+            carparks = self._favourites.setdefault(email, set())
+            if carpark_no not in carparks:
+                carparks.add(carpark_no)
+                self._count(carpark_no, 1)
+                self._changes += 1
+
+    def remove_favourite(self, email, carpark_no):
+        with self._lock:
+            carparks = self._favourites.get(email)
+            if carparks is not None and carpark_no in carparks:
+                carparks.discard(carpark_no)
+                if not carparks:
+                    del self._favourites[email]
+                self._count(carpark_no, -1)
+                self._changes += 1
+
+    def remove_favourites(self, email):
+        with self._lock:
+            carparks = self._favourites.pop(email, None)
+            if carparks is not None:
+                for carpark_no in carparks:
+                    self._count(carpark_no, -1)
+                self._changes += 1
+
+    def move_favourites(self, old_email, new_email):
+        with self._lock:
+            self._move_favourites(old_email, new_email)
+            self._changes += 1
+
+    def _move_favourites(self, old_email, new_email):
+        # call with the lock held
+        carparks = self._favourites.pop(old_email, None)
+        if carparks:
+            merged = self._favourites.setdefault(new_email, set())
+            # a carpark both emails favourited is now favourited once
+            for carpark_no in carparks & merged:
+                self._count(carpark_no, -1)
+            merged.update(carparks)
+
+    def apply_favourites(self, email, adds, removes):
+        with self._lock:
+            carparks = self._favourites.setdefault(email, set())
+            added = set(adds) - carparks
+            removed = carparks.intersection(removes)
+            carparks.update(added)
+            carparks.difference_update(removed)
+            for carpark_no in added:
+                self._count(carpark_no, 1)
+            for carpark_no in removed:
+                self._count(carpark_no, -1)
+            if not carparks:
+                del self._favourites[email]
+            self._changes += 1
+            return sorted(carparks)
+
+    def favourite_counts(self, carpark_nos):
+        counts = self._counts
+        return {carpark_no: counts[carpark_no] for carpark_no in carpark_nos if carpark_no in counts}
+
+    def most_favourited(self, n):
+        with self._lock:
+            return [(carpark_no, -negative_count) for negative_count, carpark_no in self._ranking[:n]]
+
+    def rebuild_favourite_counts(self):
+        with self._lock:
+            kept = self._counts
+            self._count_all()
+            return sum(1 for carpark_no in kept.keys() | self._counts.keys()
+                       if kept.get(carpark_no) != self._counts.get(carpark_no))
+
+    def add_alert(self, email, carpark_no, direction, lots):
+        alert = (email, carpark_no, direction, lots)
+        with self._lock:
+            alert_id = self._alert_ids.get(alert)
+            if alert_id is None:
+                alert_id = self._next_alert_id
+                self._next_alert_id += 1
+                self._alerts[alert_id] = alert
+                self._alert_ids[alert] = alert_id
+                self._email_alerts.setdefault(email, set()).add(alert_id)
+                self._alerts_version += 1
+                self._changes += 1
+        return alert_id
+
+    def remove_alert(self, email, alert_id):
+        with self._lock:
+            alert = self._alerts.get(alert_id)
+            if alert is None or alert[0] != email:
+                return False
+            del self._alerts[alert_id]
+            del self._alert_ids[alert]
+            alert_ids = self._email_alerts[email]
+            alert_ids.discard(alert_id)
+            if not alert_ids:
+                del self._email_alerts[email]
+            self._alerts_version += 1
+            self._changes += 1
+        return True
+
+    def alerts(self, email):
+        with self._lock:
+            alerts = [(alert_id, self._alerts[alert_id]) for alert_id in sorted(self._email_alerts.get(email, ()))]
+        return [{"id": alert_id, "carpark_no": carpark_no, "direction": direction, "lots": lots}
+                for alert_id, (_, carpark_no, direction, lots) in alerts]
+
+    def all_alerts(self):
+        with self._lock:
+            return [(alert_id, *alert) for alert_id, alert in self._alerts.items()]
+
+    def alerts_version(self):
+        return self._alerts_version
+
+    def revoke_sessions(self, email, revoked_at, expired_before):
+        with self._lock:
+            self._revocations[email] = max(revoked_at, self._revocations.get(email, revoked_at))
+            for revoked_email in [e for e, at in self._revocations.items() if at < expired_before]:
+                del self._revocations[revoked_email]
+
+    def sessions_revoked_at(self, email):
+        return self._revocations.get(email)
+
+    def _move_alerts(self, old_email, new_email):
+        # call with the lock held; a new_email of None deletes them
+        moved = self._email_alerts.pop(old_email, None)
+        if not moved:
+            return
+        for alert_id in moved:
+            alert = self._alerts.pop(alert_id)
+            del self._alert_ids[alert]
+            if new_email is not None:
+                alert = (new_email, *alert[1:])
+                # an alert new_email already has is kept once
+                if alert not in self._alert_ids:
+                    self._alerts[alert_id] = alert
+                    self._alert_ids[alert] = alert_id
+                    self._email_alerts.setdefault(new_email, set()).add(alert_id)
+        self._alerts_version += 1
+
+    def _count(self, carpark_no, change):
+        # call with the lock held. Finding the carpark's place in the ranking is O(log n), but deleting and
+        # inserting shift the list, O(n) in the favourited carparks: at most the ~2,200 in the catalogue
+        ranking = self._ranking
+        count = self._counts.get(carpark_no, 0)
+        if count:
+            del ranking[bisect.bisect_left(ranking, (-count, carpark_no))]
+        count += change
+        if count > 0:
+            self._counts[carpark_no] = count
+            bisect.insort(ranking, (-count, carpark_no))
+        else:
+            self._counts.pop(carpark_no, None)
+
+    def _count_all(self):
+        # call with the lock held
+        counts = Counter()
+        for carparks in self._favourites.values():
+            counts.update(carparks)
+        self._counts = dict(counts)
+        self._ranking = sorted((-count, carpark_no) for carpark_no, count in counts.items())
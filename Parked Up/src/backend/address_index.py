@@ -0,0 +1,188 @@
+"""
+Address Search Index
+
+An inverted index over the carpark addresses, built once at startup, for ranked
+autocomplete while users type.
+
+Addresses are split into upper-case tokens (block numbers, street words).
+A query is tokenized the same way, and each query token is matched against:
+- exact tokens, through the inverted index (token -> carparks).
+- token prefixes, for the last (partially typed) query token, by binary search
+  over the sorted token list.
+- similar tokens, for typos, through a trigram index (trigram -> tokens), keeping
+  only tokens within a small edit distance.
+
+Carparks are ranked by how many query tokens they match, then by a score that
+favours exact over prefix over fuzzy matches, block numbers, and matches near
+the start of the address. Only the top k are ordered, with a bounded heap.
+"""
+
+import bisect
+import heapq
+import re
+
+TOKEN_PATTERN = re.compile(r"[A-Z0-9]+")
+
+# score of a query token by how it matched
+EXACT_SCORE = 3.0
+PREFIX_SCORE = 2.0
+FUZZY_SCORE = 1.0
+
+# extra score when a query token matches a block number, eg. "270" in "BLK 270/271 ..."
+BLOCK_BONUS = 1.5
+
+# query tokens shorter than this are never matched fuzzily
+MIN_FUZZY_LENGTH = 4
+
+
+def tokenize(text):
+    """
+    Splits text into upper-case alphanumeric tokens.
+
+    Parameters:
+    -text: str
+
+    Returns:
+    -list of str
+    """
+    return TOKEN_PATTERN.findall(text.upper())
+
+
+def _trigrams(token):
+    padded = f"${token}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _edit_distance(a, b, limit):
+    """Returns the levenshtein distance between a and b, or limit + 1 if it exceeds limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class AddressIndex:
+    """
+    Inverted, prefix and trigram index over a list of addresses.
+    Results refer to addresses by their position in that list.
+    """
+
+    def __init__(self, addresses):
+        # token -> list of (position, token offset in address, is block number)
+        self.postings = {}
+        for position, address in enumerate(addresses):
+            tokens = tokenize(address)
+            for offset, token in enumerate(tokens):
+                is_block = offset > 0 and tokens[0] == "BLK" and token[0].isdigit()
+                self.postings.setdefault(token, []).append((position, offset, is_block))
+
+        self.tokens = sorted(self.postings)
+
+        self.trigrams = {}
+        for token in self.tokens:
+            for trigram in _trigrams(token):
+                self.trigrams.setdefault(trigram, []).append(token)
+
+        self.lengths = [len(address) for address in addresses]
+
+    def _prefixed(self, prefix):
+        """Returns every indexed token starting with prefix."""
+        start = bisect.bisect_left(self.tokens, prefix)
+        end = bisect.bisect_left(self.tokens, prefix + "\uffff")
+        return self.tokens[start:end]
+
+    def _similar(self, token, partial):
+        """
+        Returns indexed tokens within a small edit distance of token, with that distance.
+        A partially typed token is also compared with token prefixes of the same length.
+        """
+        if len(token) < MIN_FUZZY_LENGTH:
+            return []
+
+        limit = 1 if len(token) < 8 else 2
+        query_trigrams = _trigrams(token)
+        shared = {}
+        for trigram in query_trigrams:
+            for candidate in self.trigrams.get(trigram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+
+        # each edit changes at most 3 trigrams
+        needed = len(query_trigrams) - 3 * limit
+        matches = []
+        for candidate, count in shared.items():
+            if count < needed and not partial:
+                continue
+            distance = _edit_distance(token, candidate, limit)
+            if partial:
+                distance = min(distance, _edit_distance(token, candidate[:len(token)], limit))
+            if distance <= limit:
+                matches.append((candidate, distance))
+        return matches
+
+    def _matches(self, token, partial):
+        """Returns the indexed tokens matching a query token, with the score of each."""
+        matched = {}
+        if token in self.postings:
+            matched[token] = EXACT_SCORE
+
+        if partial:
+            for candidate in self._prefixed(token):
+                matched.setdefault(candidate, PREFIX_SCORE)
+
+        if not matched:
+            for candidate, distance in self._similar(token, partial):
+                matched[candidate] = FUZZY_SCORE / (1 + distance)
+
+        return matched
+
+    def search(self, query, k=10):
+        """
+        Finds the addresses best matching a query. The last query token is treated as
+        a prefix, unless the query ends with a space.
+
+        Parameters:
+        -query: str
+        -k: int
+
+        Returns:
+        -list of (position, score), best first
+        """
+        query_tokens = tokenize(query)
+        if not query_tokens or k <= 0:
+            return []
+
+        # position -> [query tokens matched, score]
+        ranked = {}
+        for n, token in enumerate(query_tokens):
+            partial = n == len(query_tokens) - 1 and not query.endswith(" ")
+
+            # best score of this query token per address
+            best = {}
+            for candidate, score in self._matches(token, partial).items():
+                for position, offset, is_block in self.postings[candidate]:
+                    total = score + (BLOCK_BONUS if is_block else 0) + 1 / (1 + offset)
+                    if total > best.get(position, 0):
+                        best[position] = total
+
+            for position, score in best.items():
+                entry = ranked.get(position)
+                if entry is None:
+                    ranked[position] = [1, score]
+                else:
+                    entry[0] += 1
+                    entry[1] += score
+
+        lengths = self.lengths
+        top = heapq.nlargest(
+            k, ranked.items(),
+            key=lambda item: (item[1][0], item[1][1], -lengths[item[0]]),
+        )
+        return [(position, round(entry[1], 3)) for position, entry in top]
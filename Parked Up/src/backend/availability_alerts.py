@@ -0,0 +1,277 @@
+"""
+Availability Alerts
+
+Tells users when a carpark they subscribed to goes above or below a number of
+available lots, checking tens of thousands of subscriptions against each new
+availability snapshot without looping over all of them.
+
+- AlertIndex: the subscriptions grouped by carpark number and direction, with
+  each group's thresholds in a sorted list. A carpark whose lots rose from old to
+  new fires the "above" subscriptions with old <= lots < new, and one whose lots
+  fell fires the "below" subscriptions with new < lots <= old; each is one slice
+  of a sorted list, found with two bisects. Only the carparks whose lots changed
+  since the previous snapshot are looked at, taken from the snapshot's
+  `changed`, which the availability cache works out once for every listener, so
+  a snapshot costs O(changed carparks x log subscriptions) plus the alerts fired.
+  Carparks missing from a snapshot count as 0 lots, as in `availability_stream`.
+- Alerts fire when the threshold is crossed, not on every snapshot while the lots
+  stay past it. After firing, a subscription stays quiet for COOLDOWN seconds, so
+  lots going back and forth around its threshold do not send a burst of alerts.
+- DeliveryQueue: fired alerts are put on a bounded queue and sent from one
+  background thread, so the availability poller never waits on delivery. When
+  the queue is full, new alerts are dropped and counted.
+- OutboxSender: stands in for push delivery, appending each alert to a file as a
+  line of JSON. A push sender only needs the same send(alert) and close().
+- AvailabilityAlerts: the `on_snapshot` listener tying them together. The
+  subscriptions are kept by the account store (see `acc_database.add_alert`),
+  and the index is rebuilt from them when their version changes, which is
+  checked once per snapshot.
+
+Alerts are evaluated by one process only (see EVALUATE_ALERTS in `server.py`),
+so each alert is sent once however many workers `serve.py` runs.
+"""
+
+import bisect
+import json
+import queue
+import threading
+import time
+
+from carpark_availability import changed_lots
+
+# seconds a subscription stays quiet after firing
+COOLDOWN = 15 * 60
+
+# fired alerts waiting to be sent, before new ones are dropped
+MAX_QUEUED = 10000
+
+# the group of each direction in AlertIndex's lists
+_DIRECTIONS = {"above": 0, "below": 1}
+
+
+class AlertIndex:
+    """
+    Alert subscriptions by carpark number, with the thresholds of each direction sorted.
+    """
+
+    def __init__(self, cooldown=COOLDOWN):
+        self.cooldown = cooldown
+        # carpark number -> ((above thresholds, their ids), (below thresholds, their ids)), thresholds sorted
+        self._groups = {}
+        self._subscriptions = {}  # id -> (email, carpark number, direction, lots)
+        self._last_fired = {}     # id -> time it last fired
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def load(self, subscriptions):
+        """
+        Replaces every subscription. Subscriptions that are kept stay in their cooldown.
+
+        Parameters:
+        -subscriptions: iterable of (id, email, carpark number, direction, lots)
+        """
+        by_carpark = {}
+        self._subscriptions = {}
+        for alert_id, email, carpark_no, direction, lots in subscriptions:
+            self._subscriptions[alert_id] = (email, carpark_no, direction, lots)
+            group = by_carpark.setdefault(carpark_no, ([], []))
+            group[_DIRECTIONS[direction]].append((lots, alert_id))
+
+        self._groups = {
+            carpark_no: tuple(self._split(sorted(pairs)) for pairs in group)
+            for carpark_no, group in by_carpark.items()
+        }
+        self._last_fired = {alert_id: fired_at for alert_id, fired_at in self._last_fired.items()
+                            if alert_id in self._subscriptions}
+
+    @staticmethod
+    def _split(pairs):
+        return [lots for lots, _ in pairs], [alert_id for _, alert_id in pairs]
+
+    def evaluate(self, previous_lots, changed, now=None):
+        """
+        Finds the subscriptions whose threshold the lots crossed between two snapshots.
+
+        Parameters:
+        -previous_lots: dict of carpark number to available lots
+        -changed: dict of carpark number to new available lots, for the carparks whose lots changed
+         (see carpark_availability.changed_lots)
+        -now: float, the time for cooldowns (default: time.time())
+
+        Returns:
+        -list of dict (id, email, carpark_no, direction, lots, available, previous)
+        """
+        now = time.time() if now is None else now
+        groups = self._groups
+
+        fired = []
+        for carpark_no, new in changed.items():
+            group = groups.get(carpark_no)
+            if group is None:
+                continue
+            old = previous_lots.get(carpark_no, 0)
+            if old == new:
+                # a carpark that appeared or disappeared with 0 lots
+                continue
+
+            if new > old:
+                thresholds, alert_ids = group[0]
+                start, end = bisect.bisect_left(thresholds, old), bisect.bisect_left(thresholds, new)
+            else:
+                thresholds, alert_ids = group[1]
+                start, end = bisect.bisect_right(thresholds, new), bisect.bisect_right(thresholds, old)
+
+            for alert_id in alert_ids[start:end]:
+                if now - self._last_fired.get(alert_id, float("-inf")) < self.cooldown:
+                    continue
+                self._last_fired[alert_id] = now
+                email, _, direction, threshold = self._subscriptions[alert_id]
+                fired.append({
+                    "id": alert_id, "email": email, "carpark_no": carpark_no, "direction": direction,
+                    "lots": threshold, "available": new, "previous": old,
+                })
+        return fired
+
+
+class OutboxSender:
+    """
+    Appends each alert to a file as a line of JSON, in place of push delivery.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def send(self, alert):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(alert, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class DeliveryQueue:
+    """
+    Sends alerts through sender from a background thread, dropping them when max_queued are waiting.
+    """
+
+    _STOP = object()
+
+    def __init__(self, sender, max_queued=MAX_QUEUED):
+        self.sender = sender
+        self.delivered = 0
+        self.failed = 0
+        self.dropped = 0
+        self._queue = queue.Queue(max_queued)
+        self._thread = None
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def start(self):
+        """
+        Starts the sending thread, if it is not already running.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="alert-delivery", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Sends the alerts already queued, then stops the sending thread and closes the sender.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(self._STOP)
+        self._thread.join()
+        self._thread = None
+        self.sender.close()
+
+    def put(self, alert):
+        """
+        Queues an alert to be sent.
+
+        Returns:
+        -Boolean, False if the queue is full and the alert was dropped
+        """
+        try:
+            self._queue.put_nowait(alert)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        while True:
+            alert = self._queue.get()
+            if alert is self._STOP:
+                return
+            try:
+                self.sender.send(alert)
+                self.delivered += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Error sending alert {alert['id']}: {e}")
+
+
+class AvailabilityAlerts:
+    """
+    Evaluates the alert subscriptions against every new availability snapshot, queueing the alerts that fire.
+    Register record with AvailabilityCache.on_snapshot.
+    """
+
+    def __init__(self, load, version, delivery, cooldown=COOLDOWN, clock=time.time):
+        """
+        Parameters:
+        -load: callable returning (version, list of (id, email, carpark number, direction, lots))
+        -version: callable returning the current version of the subscriptions
+        -delivery: DeliveryQueue
+        """
+        self.load = load
+        self.version = version
+        self.delivery = delivery
+        self.clock = clock
+        self.index = AlertIndex(cooldown)
+        self.fired = 0
+        self._loaded_version = None
+
+    def reload(self, force=False):
+        """
+        Rebuilds the index if the subscriptions changed since it was last built.
+
+        Returns:
+        -Boolean, True if it was rebuilt
+        """
+        if not force and self._loaded_version is not None and self.version() == self._loaded_version:
+            return False
+        version, subscriptions = self.load()
+        self.index.load(subscriptions)
+        self._loaded_version = version
+        return True
+
+    def record(self, previous, snapshot):
+        """
+        Queues the alerts whose threshold the lots crossed from previous to snapshot.
+
+        Parameters:
+        -previous: Snapshot, or None for the first snapshot, which fires nothing
+        -snapshot: Snapshot
+        """
+        self.reload()
+        if previous is None:
+            return
+
+        changed = snapshot.changed
+        if changed is None:
+            changed = changed_lots(previous.lots, snapshot.lots)
+        alerts = self.index.evaluate(previous.lots, changed, self.clock())
+        for alert in alerts:
+            alert["updated_at"] = snapshot.updated_at
+            self.delivery.put(alert)
+        self.fired += len(alerts)
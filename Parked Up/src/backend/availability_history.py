@@ -0,0 +1,336 @@
+"""
+Carpark Availability History
+
+An append-only store of availability snapshots, kept in a memory-mapped file of
+fixed-width frames rather than a row per reading in SQLite.
+
+File layout (little-endian):
+- header: magic, format version, number of columns, capacity (in frames),
+  number of frames ever written, and the size of the key block.
+- key block: the carpark numbers, newline separated, which fix the column order,
+  padded with NUL bytes to leave room for the numbers of spare columns.
+- frames: one per snapshot, an int64 unix timestamp followed by one uint16 lot
+  count per column (MISSING if the carpark was not in the snapshot).
+
+A new file has SPARE_COLUMNS columns beyond its carparks. A carpark first seen in
+a later snapshot takes the next spare column, and is recorded from then on.
+Readers in other processes look the key block up again when asked for a carpark
+they do not know. Once the spare columns are used up, carparks that are not in
+the file are counted (`unrecorded`) and logged once each. To record them, stop
+the process recording history and move the file away: the next start creates
+a new file for the catalogue's carparks, without the old history. Files of
+format version 1 have no spare columns, so the same applies to them.
+
+With ~2,200 carparks and the spare columns a frame is ~5KB, so a month of
+one-minute snapshots is ~220MB on disk. The frames form a ring buffer of fixed
+capacity: once full, the oldest frame is overwritten, so the file never grows
+past its initial size and the OS pages it in and out as needed instead of it
+being held in memory.
+
+Frames are appended in timestamp order, so time ranges are found by binary search.
+
+The file is mapped shared, so several server processes can read one history while
+a single one of them appends to it; readers pick up new frames from the header.
+"""
+
+import mmap
+import os
+import struct
+import threading
+from array import array
+
+MAGIC = b"PUAH"
+FORMAT_VERSION = 2
+# versions this module reads; version 1 is the same layout without spare columns
+READ_VERSIONS = (1, 2)
+HEADER = struct.Struct("<4sIIIQI")  # magic, version, width, capacity, written, keys size
+TIMESTAMP = struct.Struct("<q")
+MISSING = 0xFFFF
+
+# default retention: about three months of one-minute snapshots
+DEFAULT_CAPACITY = 92 * 24 * 60
+
+# columns a new file reserves for carparks added to the catalogue later,
+# and the bytes of key block reserved for each of their numbers
+SPARE_COLUMNS = 256
+SPARE_KEY_BYTES = 16
+
+# Singapore time has no daylight saving, so time-of-day profiles use a fixed offset
+SGT_OFFSET = 8 * 3600
+
+WEEKDAYS = frozenset(range(5))
+WEEKENDS = frozenset((5, 6))
+
+
+class AvailabilityHistory:
+    """
+    Ring buffer of availability frames in a memory-mapped file.
+    Appends and reads are serialized by a lock; appends happen once per snapshot.
+    """
+
+    def __init__(self, path, carpark_nos, capacity=DEFAULT_CAPACITY, spare=SPARE_COLUMNS):
+        """
+        Opens the history file at path, creating it for the given carparks if it does not exist.
+        An existing file keeps its own carpark order, capacity and spare columns.
+
+        Parameters:
+        -path: str
+        -carpark_nos: list of str
+        -capacity: int (frames)
+        -spare: int, columns a new file reserves for carparks seen later
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        # carparks seen in snapshots that there was no spare column for
+        self.unrecorded = set()
+
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            self._create(path, list(carpark_nos), capacity, spare)
+
+        self._file = open(path, "r+b")
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+
+        magic, version, width, capacity, written, keys_size = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version not in READ_VERSIONS:
+            raise ValueError(f"{path} is not an availability history file")
+
+        self.version = version
+        self.width = width
+        self.capacity = capacity
+        self.written = written
+        self.keys_size = keys_size
+        self.frame_size = TIMESTAMP.size + 2 * width
+        self.frames_offset = _align(HEADER.size + keys_size)
+        self._load_keys()
+
+    @staticmethod
+    def _create(path, carpark_nos, capacity, spare):
+        keys = "\n".join(carpark_nos).encode("utf-8")
+        keys_size = len(keys) + spare * SPARE_KEY_BYTES
+        frames_offset = _align(HEADER.size + keys_size)
+        width = len(carpark_nos) + spare
+        frame_size = TIMESTAMP.size + 2 * width
+
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, width, capacity, 0, keys_size))
+            # the key block's padding is written as zeros by truncate
+            f.write(keys)
+            # sparse on most filesystems, so unused frames take no disk space
+            f.truncate(frames_offset + capacity * frame_size)
+
+    def _load_keys(self):
+        """Reads the carpark numbers of the columns in use from the key block."""
+        keys = self._mm[HEADER.size:HEADER.size + self.keys_size].rstrip(b"\0")
+        self.keys_used = len(keys)
+        self.carpark_nos = keys.decode("utf-8").split("\n") if keys else []
+        self.column = {no: i for i, no in enumerate(self.carpark_nos)}
+
+    def _keys_added(self):
+        """Checks whether the process recording history has given carparks spare columns since the keys were read."""
+        end = HEADER.size + self.keys_used
+        return self.keys_used < self.keys_size and self._mm[end] != 0
+
+    def _add_column(self, carpark_no):
+        """
+        Gives a carpark the next spare column, writing its number to the key block.
+        Returns its column, or None if there is no spare column or key block space left.
+        """
+        key = ("\n" if self.carpark_nos else "").encode("utf-8") + carpark_no.encode("utf-8")
+        if (len(self.carpark_nos) >= self.width or self.keys_used + len(key) > self.keys_size
+                or not carpark_no or "\n" in carpark_no or "\0" in carpark_no):
+            if carpark_no not in self.unrecorded:
+                self.unrecorded.add(carpark_no)
+                print(f"No room to record the history of carpark {carpark_no!r} in {self.path}; "
+                      "move the file away to create a new one with room for it")
+            return None
+
+        start = HEADER.size + self.keys_used
+        self._mm[start:start + len(key)] = key
+        self.keys_used += len(key)
+        col = len(self.carpark_nos)
+        self.carpark_nos.append(carpark_no)
+        self.column[carpark_no] = col
+        return col
+
+    def close(self):
+        with self._lock:
+            self._mm.flush()
+            self._mm.close()
+            self._file.close()
+
+    def _sync(self):
+        """Reloads the frame count from the header, which another process may have advanced."""
+        self.written = HEADER.unpack_from(self._mm, 0)[4]
+
+    def __len__(self):
+        """Returns the number of frames currently held."""
+        return min(self.written, self.capacity)
+
+    def _offset(self, n):
+        """Returns the file offset of the n-th oldest frame still held."""
+        first = self.written - len(self)
+        return self.frames_offset + ((first + n) % self.capacity) * self.frame_size
+
+    def _timestamp(self, n):
+        return TIMESTAMP.unpack_from(self._mm, self._offset(n))[0]
+
+    def append(self, timestamp, lots):
+        """
+        Appends a frame. Frames older than the latest one are ignored.
+        Returns True if the frame was written.
+
+        Parameters:
+        -timestamp: int (unix seconds)
+        -lots: dict of carpark number to available lots
+
+        Returns:
+        -Boolean
+        """
+        timestamp = int(timestamp)
+        values = array("H", [MISSING]) * self.width
+
+        with self._lock:
+            self._sync()
+            if len(self) and timestamp <= self._timestamp(len(self) - 1):
+                return False
+
+            column = self.column
+            for carpark_no, count in lots.items():
+                i = column.get(carpark_no)
+                if i is None and carpark_no not in self.unrecorded:
+                    i = self._add_column(carpark_no)
+                if i is not None:
+                    values[i] = min(max(int(count), 0), MISSING - 1)
+
+            offset = self.frames_offset + (self.written % self.capacity) * self.frame_size
+            TIMESTAMP.pack_into(self._mm, offset, timestamp)
+            self._mm[offset + TIMESTAMP.size:offset + self.frame_size] = values.tobytes()
+
+            # publish the frame only after it has been fully written
+            self.written += 1
+            HEADER.pack_into(self._mm, 0, MAGIC, self.version, self.width, self.capacity,
+                             self.written, self.keys_size)
+            return True
+
+    def record(self, previous, snapshot):
+        """
+        Snapshot listener for AvailabilityCache.on_snapshot: appends every new snapshot.
+        """
+        self.append(snapshot.fetched_at, snapshot.lots)
+
+    def _bisect(self, timestamp):
+        """Returns the index of the first frame at or after timestamp."""
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._timestamp(mid) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def series(self, carpark_no, start, end):
+        """
+        Returns the recorded lot counts of a carpark between start and end (inclusive).
+        Returns None if the carpark is not recorded.
+
+        Parameters:
+        -carpark_no: str
+        -start: int (unix seconds)
+        -end: int (unix seconds)
+
+        Returns:
+        -list of (timestamp, lots)
+        """
+        points = []
+        with self._lock:
+            col = self.column.get(carpark_no)
+            if col is None and self._keys_added():
+                self._load_keys()
+                col = self.column.get(carpark_no)
+            if col is None:
+                return None
+
+            value_offset = TIMESTAMP.size + 2 * col
+            mm = self._mm
+            self._sync()
+            for n in range(self._bisect(start), len(self)):
+                offset = self._offset(n)
+                timestamp = TIMESTAMP.unpack_from(mm, offset)[0]
+                if timestamp > end:
+                    break
+                lots = mm[offset + value_offset] | (mm[offset + value_offset + 1] << 8)
+                if lots != MISSING:
+                    points.append((timestamp, lots))
+        return points
+
+    def aggregate(self, carpark_no, start, end, bucket):
+        """
+        Returns the min, average and max lot count of a carpark per time bucket.
+        Buckets are aligned to multiples of bucket seconds since the epoch.
+        Returns None if the carpark is not recorded.
+
+        Parameters:
+        -carpark_no: str
+        -start: int (unix seconds)
+        -end: int (unix seconds)
+        -bucket: int (seconds)
+
+        Returns:
+        -list of dict (start, count, min, avg, max)
+        """
+        points = self.series(carpark_no, start, end)
+        if points is None:
+            return None
+        return _summarize(points, lambda timestamp: timestamp - timestamp % bucket)
+
+    def profile(self, carpark_no, start, end, bucket, days=None):
+        """
+        Returns the min, average and max lot count of a carpark by time of day
+        (Singapore time), eg. "how full is it at 6pm on weekdays".
+        Returns None if the carpark is not recorded.
+
+        Parameters:
+        -carpark_no: str
+        -start: int (unix seconds)
+        -end: int (unix seconds)
+        -bucket: int (seconds, within a day)
+        -days: set of int (0 = Monday), or None for every day
+
+        Returns:
+        -list of dict (start as seconds since midnight, count, min, avg, max)
+        """
+        points = self.series(carpark_no, start, end)
+        if points is None:
+            return None
+
+        if days is not None:
+            # 1 Jan 1970 was a Thursday
+            points = [p for p in points if ((p[0] + SGT_OFFSET) // 86400 + 3) % 7 in days]
+
+        return _summarize(points, lambda timestamp: (timestamp + SGT_OFFSET) % 86400 // bucket * bucket)
+
+
+def _summarize(points, bucket_of):
+    buckets = {}
+    for timestamp, lots in points:
+        key = bucket_of(timestamp)
+        stats = buckets.get(key)
+        if stats is None:
+            buckets[key] = [1, lots, lots, lots]
+        else:
+            stats[0] += 1
+            stats[1] += lots
+            if lots < stats[2]:
+                stats[2] = lots
+            if lots > stats[3]:
+                stats[3] = lots
+
+    return [
+        {"start": key, "count": count, "min": low, "avg": total / count, "max": high}
+        for key, (count, total, low, high) in sorted(buckets.items())
+    ]
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
@@ -0,0 +1,382 @@
+"""
+Availability Stream
+
+Pushes carpark availability to clients as Server-Sent Events, sending only the
+carparks whose lots changed between consecutive snapshots, instead of clients
+downloading every carpark's lots again after every refresh.
+
+- The changed `car_park_no -> lots` pairs of each new snapshot (worked out
+  once by the availability cache, as the snapshot's `changed`) are encoded once, as a `delta` event that is then
+  written as-is to every client. Carparks missing from a snapshot count as 0 lots.
+- Every event's id names the availability it brings the client up to: a hash of
+  the lots, so it is the same in every worker process. A client that reconnects
+  (EventSource sends the last id it saw as `Last-Event-ID`) is sent only the
+  deltas it missed, while they are in the log of recent deltas, or else a
+  `snapshot` event with the lots of every carpark.
+- Connections do not hold a thread each. Once the response headers are sent,
+  the production server (`serve.py`) hands the socket over to a StreamHub, which
+  writes to every connection from a single thread, with non-blocking sockets and
+  a selector. Clients that fall too far behind are disconnected, and catch up
+  when they reconnect.
+- Without a server that can hand over connections (eg. the Flask development
+  server), the response sends the missed events and ends, and EventSource
+  reconnects after RETRY_MS, like polling for deltas.
+"""
+
+import hashlib
+import json
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+from carpark_availability import changed_lots
+
+# deltas kept for clients resuming from an earlier event; at one refresh a minute, 6 hours
+DELTA_LOG_SIZE = 360
+
+# milliseconds EventSource waits before reconnecting
+RETRY_MS = 5000
+
+# seconds between comments sent to idle connections, so proxies keep them open
+HEARTBEAT_INTERVAL = 15
+
+# bytes a connection may have waiting to be sent before it is dropped as too slow
+MAX_CLIENT_BUFFER = 1 << 20
+
+# open connections per process
+MAX_CLIENTS = 10000
+
+RETRY = f"retry: {RETRY_MS}\n\n".encode()
+HEARTBEAT = b": keep-alive\n\n"
+
+
+def state_id(lots):
+    """
+    Returns an id for a set of lot counts, the same in every process.
+
+    Parameters:
+    -lots: dict of carpark number to available lots
+
+    Returns:
+    -str
+    """
+    data = json.dumps(lots, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def encode_event(event, event_id, payload):
+    """
+    Encodes one Server-Sent Event with a JSON payload.
+
+    Returns:
+    -bytes
+    """
+    data = json.dumps(payload, separators=(",", ":"))
+    return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n".encode()
+
+
+class StreamHub:
+    """
+    Writes events to many open connections from one thread.
+    Other threads add connections and broadcast events through a queue of commands,
+    which the hub's thread runs in order.
+    """
+
+    def __init__(self, heartbeat=HEARTBEAT_INTERVAL, max_buffer=MAX_CLIENT_BUFFER, max_clients=MAX_CLIENTS):
+        self.heartbeat = heartbeat
+        self.max_buffer = max_buffer
+        self.max_clients = max_clients
+        self.dropped = 0
+        self._clients = {}  # socket -> bytearray of data not sent yet
+        self._writing = set()  # sockets registered for EVENT_WRITE
+        self._commands = deque()
+        self._selector = None
+        self._wakeup = None
+        self._thread = None
+
+    def __len__(self):
+        return len(self._clients)
+
+    def full(self):
+        return len(self._clients) >= self.max_clients
+
+    def start(self):
+        """
+        Starts the hub's thread, if it is not already running.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._selector = selectors.DefaultSelector()
+        receive, send = socket.socketpair()
+        receive.setblocking(False)
+        send.setblocking(False)
+        self._selector.register(receive, selectors.EVENT_READ)
+        self._wakeup = (receive, send)
+        self._thread = threading.Thread(target=self._run, name="availability-stream", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Closes every connection and stops the hub's thread.
+        """
+        if self._thread is None:
+            return
+        self._command("stop")
+        self._thread.join()
+        self._thread = None
+        for sock in self._wakeup:
+            sock.close()
+        self._selector.close()
+
+    def add(self, sock, data=b""):
+        """
+        Takes over a connection, whose response headers have already been sent.
+
+        Parameters:
+        -sock: socket.socket
+        -data: bytes, sent before any later broadcast
+        """
+        self._command("add", sock, data)
+
+    def broadcast(self, data):
+        """
+        Sends data to every connection.
+
+        Parameters:
+        -data: bytes
+        """
+        self._command("broadcast", data)
+
+    def _command(self, *command):
+        if self._thread is None:
+            return
+        self._commands.append(command)
+        try:
+            self._wakeup[1].send(b"\0")
+        except (BlockingIOError, OSError):
+            # the hub is already due to wake up
+            pass
+
+    def _run(self):
+        wakeup = self._wakeup[0]
+        next_heartbeat = time.monotonic() + self.heartbeat
+
+        while True:
+            for key, mask in self._selector.select(max(0.0, next_heartbeat - time.monotonic())):
+                sock = key.fileobj
+                if sock is wakeup:
+                    try:
+                        while wakeup.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+
+                if mask & selectors.EVENT_READ:
+                    # clients send nothing after their request, so this is the client hanging up
+                    try:
+                        received = sock.recv(4096)
+                    except BlockingIOError:
+                        received = True
+                    except OSError:
+                        received = b""
+                    if not received:
+                        self._drop(sock)
+                        continue
+                if mask & selectors.EVENT_WRITE:
+                    self._flush(sock)
+
+            while self._commands:
+                command, *args = self._commands.popleft()
+                if command == "add":
+                    sock, data = args
+                    try:
+                        sock.setblocking(False)
+                        self._selector.register(sock, selectors.EVENT_READ)
+                    except (OSError, ValueError):
+                        # closed before the hub got to it
+                        sock.close()
+                        continue
+                    self._clients[sock] = bytearray()
+                    self._queue(sock, data)
+                elif command == "broadcast":
+                    for sock in list(self._clients):
+                        self._queue(sock, args[0])
+                elif command == "stop":
+                    for sock in list(self._clients):
+                        self._drop(sock)
+                    return
+
+            if time.monotonic() >= next_heartbeat:
+                for sock in list(self._clients):
+                    self._queue(sock, HEARTBEAT)
+                next_heartbeat = time.monotonic() + self.heartbeat
+
+    def _queue(self, sock, data):
+        buffer = self._clients.get(sock)
+        if buffer is None or not data:
+            return
+        buffer += data
+        if len(buffer) > self.max_buffer:
+            self.dropped += 1
+            self._drop(sock)
+        elif sock not in self._writing:
+            self._flush(sock)
+
+    def _flush(self, sock):
+        buffer = self._clients[sock]
+        try:
+            sent = sock.send(buffer)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._drop(sock)
+            return
+        del buffer[:sent]
+
+        if buffer and sock not in self._writing:
+            self._writing.add(sock)
+            self._selector.modify(sock, selectors.EVENT_READ | selectors.EVENT_WRITE)
+        elif not buffer and sock in self._writing:
+            self._writing.discard(sock)
+            self._selector.modify(sock, selectors.EVENT_READ)
+
+    def _drop(self, sock):
+        if self._clients.pop(sock, None) is None:
+            return
+        self._writing.discard(sock)
+        self._selector.unregister(sock)
+        sock.close()
+
+
+class AvailabilityStream:
+    """
+    Turns availability snapshots into delta events, keeps the recent ones for
+    clients that resume, and broadcasts new ones through a StreamHub.
+    """
+
+    def __init__(self, hub=None, log_size=DELTA_LOG_SIZE):
+        self.hub = StreamHub() if hub is None else hub
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._id = None
+        self._snapshot_event = None
+        self._deltas = deque(maxlen=log_size)  # (id before, id after, encoded delta event)
+
+    def record(self, previous, snapshot):
+        """
+        Availability listener: records the lots that changed since the last snapshot,
+        and sends them to every connected client.
+
+        Parameters:
+        -previous: Snapshot, or None
+        -snapshot: Snapshot
+        """
+        lots = snapshot.lots
+        new_id = state_id(lots)
+
+        with self._lock:
+            old = self._snapshot
+            if old is not None and new_id == self._id:
+                # only the capacities changed
+                self._snapshot = snapshot
+                return
+
+            self._snapshot, self._snapshot_event = snapshot, None
+            old_id, self._id = self._id, new_id
+
+            if old is None:
+                self.hub.broadcast(self._full_event())
+                return
+
+            if previous is old and snapshot.changed is not None:
+                changed = snapshot.changed
+            else:
+                changed = changed_lots(old.lots, lots)
+            event = encode_event("delta", new_id, {
+                "version": snapshot.version, "updated_at": snapshot.updated_at, "lots": changed,
+            })
+            self._deltas.append((old_id, new_id, event))
+            self.hub.broadcast(event)
+
+    def _full_event(self):
+        if self._snapshot_event is None:
+            snapshot = self._snapshot
+            self._snapshot_event = encode_event("snapshot", self._id, {
+                "version": snapshot.version, "updated_at": snapshot.updated_at, "lots": snapshot.lots,
+            })
+        return self._snapshot_event
+
+    def _catch_up(self, since):
+        # call with the lock held
+        if self._snapshot is None or since == self._id:
+            return b""
+
+        if since:
+            missed = []
+            size = 0
+            for before, after, event in reversed(self._deltas):
+                missed.append(event)
+                size += len(event)
+                if before == since:
+                    # send the full snapshot instead, if the deltas add up to more
+                    if size < len(self._full_event()):
+                        return b"".join(reversed(missed))
+                    break
+
+        return self._full_event()
+
+    def catch_up(self, since=None):
+        """
+        Returns the events that bring a client from an event id up to the current availability:
+        the deltas since that id if they are all still logged, else a full snapshot.
+
+        Parameters:
+        -since: str, the id of the last event the client received, or None
+
+        Returns:
+        -bytes
+        """
+        with self._lock:
+            return self._catch_up(since)
+
+    def attach(self, sock, since=None):
+        """
+        Hands a connection over to the hub, after sending it the events it missed.
+
+        Parameters:
+        -sock: socket.socket
+        -since: str, or None
+        """
+        with self._lock:
+            # under the lock, so no delta is recorded between the catch-up and the hub's next broadcast
+            self.hub.add(sock, self._catch_up(since))
+
+
+class EventStream:
+    """
+    The body of an availability stream response.
+
+    With detach (a callable from the server returning the connection's socket), the body
+    is only the reconnection delay; when the server closes the body, after sending it,
+    the connection is handed to the hub. Without it, the body is the missed events.
+    """
+
+    def __init__(self, stream, since, detach=None):
+        self.stream = stream
+        self.since = since
+        self.detach = detach
+
+    def __iter__(self):
+        if self.detach is None:
+            yield RETRY + self.stream.catch_up(self.since)
+        else:
+            yield RETRY
+
+    def close(self):
+        if self.detach is not None:
+            detach, self.detach = self.detach, None
+            self.stream.attach(detach(), self.since)
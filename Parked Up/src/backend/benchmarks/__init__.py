@@ -0,0 +1,6 @@
+"""
+Benchmarks for the backend.
+
+Run each benchmark as a module from the `src/backend` directory, e.g.
+    python -m benchmarks.favourites_lookup
+"""
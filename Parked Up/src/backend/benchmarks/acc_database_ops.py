@@ -0,0 +1,138 @@
+"""
+Account Database Microbenchmarks
+
+Times each `acc_database` operation on its own, for each account store (see
+`acc_store.py`), seeded with the same accounts and favourites, with the read caches
+disabled so every call reaches the store. Reports calls per second and latency
+percentiles per store and operation as JSON, in the same format as `benchmarks.load_test`,
+so the two can be read side by side.
+
+Usage (from src/backend):
+    python -m benchmarks.acc_database_ops [--accounts N] [--calls N] [--stores sqlite,memory] [--cache] [--output FILE]
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import acc_database
+import acc_store
+from benchmarks.account_cache import seed
+from benchmarks.load_test import PASSWORD, summarize
+
+
+def operations(accounts, rng):
+    """
+    Returns (name, call) pairs, where call() runs the operation once on a random seeded user.
+    Writes leave the data as they found it, so the operations can be repeated any number of times.
+    """
+    def user():
+        return f"user{rng.randrange(accounts)}@example.com"
+
+    signups = iter(range(10 ** 9))
+
+    def signup_and_delete():
+        email = f"bench{next(signups)}@example.com"
+        acc_database.signup_acc("bench", email, "91234567", PASSWORD)
+        acc_database.delete_acc(email)
+
+    def change_details():
+        email = user()
+        acc_database.change_details(email, PASSWORD, {
+            "username": f"renamed{rng.randrange(1000)}", "email": email,
+            "phone_no": str(80000000 + rng.randrange(10000000)), "password": PASSWORD,
+        })
+
+    def add_and_delete_fav():
+        email = user()
+        acc_database.add_fav(email, "BENCH")
+        acc_database.delete_fav(email, "BENCH")
+
+    def apply_fav_changes():
+        acc_database.apply_fav_changes(user(), [
+            {"op": "add", "carpark_no": f"BENCH{n}"} for n in range(5)
+        ] + [
+            {"op": "remove", "carpark_no": f"BENCH{n}"} for n in range(5)
+        ])
+
+    return [
+        ("find_acc", lambda: acc_database.find_acc(user())),
+        ("login", lambda: acc_database.login(user(), PASSWORD)),
+        ("get_all_favs", lambda: acc_database.get_all_favs(user())),
+        ("signup_acc+delete_acc", signup_and_delete),
+        ("change_details", change_details),
+        ("add_fav+delete_fav", add_and_delete_fav),
+        ("apply_fav_changes", apply_fav_changes),
+    ]
+
+
+def open_store(name, seeded_path):
+    """Returns the named store, holding the accounts and favourites of the seeded database."""
+    if name == "sqlite":
+        acc_database.dbpath = seeded_path
+        return acc_database.SQLiteStore()
+
+    conn = sqlite3.connect(seeded_path)
+    favourites = {}
+    for email, carpark_no in conn.execute('SELECT * FROM "Favourites"'):
+        favourites.setdefault(email, []).append(carpark_no)
+    store = acc_store.MemoryStore()
+    store.restore(conn.execute('SELECT * FROM "Accounts"'), favourites.items())
+    conn.close()
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=100_000)
+    parser.add_argument("--calls", type=int, default=5_000, help="calls per operation")
+    parser.add_argument("--stores", default="sqlite,memory", help="comma-separated account stores to compare")
+    parser.add_argument("--cache", action="store_true", help="leave the read caches enabled (sqlite only)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    stores = args.stores.split(",")
+    if not set(stores) <= {"sqlite", "memory"}:
+        parser.error("--stores must list sqlite and/or memory")
+    report = {"config": {"accounts": args.accounts, "calls": args.calls, "stores": stores, "cache": args.cache},
+              "stores": {}}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for store_name in stores:
+            # a fresh copy of the same data for every store, as each one's writes change it
+            path = os.path.join(tmp, f"{store_name}.db")
+            seed(path, args.accounts)
+            acc_database.use_store(open_store(store_name, path))
+            acc_database.acc_cache.enabled = acc_database.favs_cache.enabled = args.cache and store_name == "sqlite"
+
+            operations_report = report["stores"][store_name] = {}
+            # change_details reports every update on stdout
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                for name, call in operations(args.accounts, random.Random(args.seed)):
+                    timings = []
+                    started = time.perf_counter()
+                    for _ in range(args.calls):
+                        start = time.perf_counter()
+                        call()
+                        timings.append(time.perf_counter() - start)
+                    elapsed = time.perf_counter() - started
+                    operations_report[name] = summarize(timings, 0, elapsed)
+
+            acc_database.store.close()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Account Cache Benchmark
+
+Measures `acc_database.find_acc` and `get_all_favs` with the read caches on and off,
+against a throwaway database seeded with accounts and favourites.
+
+Lookups follow a skewed distribution (a few users are looked up much more often than
+the rest), like logins and map loads from active users, and a small fraction of calls
+are writes that invalidate the cache.
+
+Usage (from src/backend):
+    python -m benchmarks.account_cache [--accounts N] [--calls N] [--write-ratio F]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import acc_database
+import migrations
+
+FAVS_PER_USER = 5
+
+
+def seed(path, accounts):
+    """Creates a database at path with the given number of accounts, each with a few favourites."""
+    conn = sqlite3.connect(path)
+    migrations.migrate(conn)
+    with conn:
+        conn.executemany(
+            'INSERT INTO "Accounts" VALUES (?, ?, ?, ?)',
+            ((f"user{i}", f"user{i}@example.com", 80000000 + i, "Passw0rd!") for i in range(accounts)),
+        )
+        conn.executemany(
+            'INSERT INTO "Favourites" VALUES (?, ?)',
+            ((f"user{i}@example.com", f"CP{i * FAVS_PER_USER + j:05d}")
+             for i in range(accounts) for j in range(FAVS_PER_USER)),
+        )
+    conn.close()
+
+
+def run(accounts, calls, write_ratio, rng):
+    """Returns sorted read latencies (seconds) for a mix of reads and invalidating writes."""
+    timings = []
+    for _ in range(calls):
+        # pareto-distributed user ids: a small set of hot users
+        user = min(int(rng.paretovariate(1.2)) - 1, accounts - 1)
+        email = f"user{user}@example.com"
+
+        if rng.random() < write_ratio:
+            acc_database.add_fav(email, "CPHOT")
+            acc_database.delete_fav(email, "CPHOT")
+            continue
+
+        start = time.perf_counter()
+        acc_database.find_acc(email)
+        acc_database.get_all_favs(email)
+        timings.append(time.perf_counter() - start)
+
+    return sorted(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=100_000)
+    parser.add_argument("--calls", type=int, default=50_000)
+    parser.add_argument("--write-ratio", type=float, default=0.01)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "accounts.db")
+        seed(path, args.accounts)
+        acc_database.dbpath = path
+
+        print(f"{'cache':>6} {'reads':>8} {'mean (us)':>10} {'p50 (us)':>10} {'p99 (us)':>10} {'hit rate':>9}")
+        for enabled in (False, True):
+            for cache in (acc_database.acc_cache, acc_database.favs_cache):
+                cache.enabled = enabled
+                cache.clear()
+                cache.hits = cache.misses = cache.evictions = 0
+
+            timings = run(args.accounts, args.calls, args.write_ratio, random.Random(0))
+            stats = acc_database.cache_stats()
+            hits = stats["accounts"]["hits"] + stats["favourites"]["hits"]
+            lookups = hits + stats["accounts"]["misses"] + stats["favourites"]["misses"]
+
+            mean = sum(timings) / len(timings) * 1e6
+            p50 = timings[len(timings) // 2] * 1e6
+            p99 = timings[int(len(timings) * 0.99)] * 1e6
+            hit_rate = hits / lookups if lookups else 0.0
+            print(f"{'on' if enabled else 'off':>6} {len(timings):>8} {mean:>10.1f} {p50:>10.1f} {p99:>10.1f} {hit_rate:>9.1%}")
+
+        acc_database.connections.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Availability Alerts Benchmark
+
+Measures checking alert subscriptions against each new availability snapshot,
+for synthetic subscriptions spread over the carparks and snapshots where a
+fraction (--churn) of the carparks' lots move by up to --step between refreshes.
+
+Compares the sorted-threshold index (see `availability_alerts.py`), which only
+looks at the changed carparks and bisects their thresholds, against checking
+every subscription, and checks that both fire the same alerts. The changed
+carparks are worked out once per snapshot by the availability cache and shared
+by every listener; that diff is timed separately (`diff`). Also reports the
+time to read every subscription from the SQLite account store and build the
+index from them, which the server does whenever the subscriptions change, and
+the time for AvailabilityAlerts.record to evaluate and queue a snapshot's
+alerts. Cooldowns are turned off, so every crossing fires. Output is JSON.
+
+Usage (from src/backend):
+    python -m benchmarks.availability_alerts [--subscriptions N] [--carparks N] [--churn F] [--updates N]
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import acc_database
+import availability_alerts
+from carpark_availability import Snapshot, changed_lots
+
+MAX_LOTS = 500
+
+
+def naive_evaluate(subscriptions, previous_lots, lots):
+    """Checks every subscription against the lots of its carpark, the baseline for the index."""
+    fired = []
+    for alert_id, _, carpark_no, direction, threshold in subscriptions:
+        old = previous_lots.get(carpark_no, 0)
+        new = lots.get(carpark_no, 0)
+        if (old <= threshold < new) if direction == "above" else (new < threshold <= old):
+            fired.append(alert_id)
+    return fired
+
+
+def summary(seconds):
+    seconds = sorted(seconds)
+    return {
+        "mean_ms": statistics.fmean(seconds) * 1e3,
+        "p50_ms": seconds[len(seconds) // 2] * 1e3,
+        "max_ms": seconds[-1] * 1e3,
+    }
+
+
+class CountingSender:
+    """Counts the alerts it is sent, in place of delivering them."""
+
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, alert):
+        self.sent += 1
+
+    def close(self):
+        pass
+
+
+def load_sqlite(subscriptions, directory):
+    """Stores the subscriptions in a new account database, and returns the time to read them back."""
+    acc_database.dbpath = os.path.join(directory, "acc_database.db")
+    store = acc_database.SQLiteStore()
+    store.init()
+    with acc_database.transaction("seed") as conn:
+        conn.executemany('''
+            INSERT INTO "AlertSubscriptions" ("id", "user_email", "carpark_no", "direction", "lots")
+            VALUES (?, ?, ?, ?, ?)
+            ''', subscriptions)
+    acc_database.use_store(store)
+
+    start = time.perf_counter()
+    version, rows = acc_database.all_alerts()
+    elapsed = time.perf_counter() - start
+    assert len(rows) == len(subscriptions)
+    store.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscriptions", type=int, default=100_000)
+    parser.add_argument("--carparks", type=int, default=2200)
+    parser.add_argument("--churn", type=float, default=0.05, help="fraction of carparks changing per refresh")
+    parser.add_argument("--step", type=int, default=30, help="largest change in a carpark's lots per refresh")
+    parser.add_argument("--updates", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    names = [f"C{i:04d}" for i in range(args.carparks)]
+    lots = {name: rng.randrange(MAX_LOTS) for name in names}
+
+    # popular carparks get more subscriptions, as favourites do
+    weights = [1 / (rank + 1) ** 0.8 for rank in range(args.carparks)]
+    carparks = rng.choices(names, weights, k=args.subscriptions)
+    subscriptions = [
+        (alert_id, f"user{alert_id % (args.subscriptions // 3 + 1)}@example.com", carpark_no,
+         rng.choice(("above", "below")), rng.randrange(1, MAX_LOTS))
+        for alert_id, carpark_no in enumerate(carparks, 1)
+    ]
+
+    start = time.perf_counter()
+    index = availability_alerts.AlertIndex(cooldown=0)
+    index.load(subscriptions)
+    index_build = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        sqlite_read = load_sqlite(subscriptions, directory)
+
+    snapshots = [Snapshot(1, dict(lots), {}, "1", time.time())]
+    for version in range(2, args.updates + 2):
+        for name in rng.sample(names, int(len(names) * args.churn)):
+            lots[name] = min(MAX_LOTS, max(0, lots[name] + rng.randint(-args.step, args.step)))
+        snapshots.append(Snapshot(version, dict(lots), {}, str(version), time.time()))
+
+    diffs, indexed, naive, fired = [], [], [], []
+    now = 0.0
+    for previous, snapshot in zip(snapshots, snapshots[1:]):
+        now += 60
+        # as AvailabilityCache does when it publishes the snapshot
+        start = time.perf_counter()
+        snapshot.changed = changed_lots(previous.lots, snapshot.lots)
+        diffs.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        alerts = index.evaluate(previous.lots, snapshot.changed, now)
+        indexed.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        expected = naive_evaluate(subscriptions, previous.lots, snapshot.lots)
+        naive.append(time.perf_counter() - start)
+
+        assert sorted(alert["id"] for alert in alerts) == sorted(expected), snapshot.version
+        fired.append(len(alerts))
+
+    # the listener the server registers, with delivery to a sender that only counts
+    sender = CountingSender()
+    delivery = availability_alerts.DeliveryQueue(sender, max_queued=max(fired, default=0) * len(fired) + 1)
+    listener = availability_alerts.AvailabilityAlerts(lambda: (1, subscriptions), lambda: 1, delivery, cooldown=0)
+    listener.reload()
+    delivery.start()
+    recorded = []
+    for previous, snapshot in zip(snapshots, snapshots[1:]):
+        start = time.perf_counter()
+        listener.record(previous, snapshot)
+        recorded.append(time.perf_counter() - start)
+    delivery.stop()
+    assert sender.sent == sum(fired) and delivery.dropped == 0
+
+    report = {
+        "config": vars(args),
+        "subscribed_carparks": len({carpark_no for _, _, carpark_no, _, _ in subscriptions}),
+        "alerts_per_update": statistics.fmean(fired),
+        "load": {
+            "sqlite_read_ms": sqlite_read * 1e3,
+            "index_build_ms": index_build * 1e3,
+        },
+        "per_update": {
+            "diff": summary(diffs),
+            "indexed": summary(indexed),
+            "naive": summary(naive),
+            "record_and_queue": summary(recorded),
+        },
+        "speedup": statistics.fmean(naive) / statistics.fmean(indexed),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
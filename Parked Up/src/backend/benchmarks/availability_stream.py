@@ -0,0 +1,128 @@
+"""
+Availability Stream Benchmark
+
+Compares the cost of keeping clients' lot counts current by polling /availability
+against streaming deltas from /availability/stream, for synthetic snapshots where
+a fraction (--churn) of the carparks change between refreshes.
+
+For each refresh and client, reports the bytes sent (the full /availability body,
+plain and gzipped, against the delta event) and the CPU time spent: compressing
+the full body for pollers, and diffing the snapshot plus the hub thread writing
+the delta to every connected socket for streams. Output is JSON.
+
+Usage (from src/backend):
+    python -m benchmarks.availability_stream [--carparks N] [--churn F] [--clients N] [--updates N]
+"""
+
+import argparse
+import json
+import random
+import selectors
+import socket
+import threading
+import time
+
+import availability_stream
+import http_cache
+from carpark_availability import Snapshot
+
+
+def drain(sockets, received, stop):
+    """Reads everything sent to sockets until stop is set, counting the bytes in received[0]."""
+    selector = selectors.DefaultSelector()
+    for sock in sockets:
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+    while not stop.is_set():
+        for key, _ in selector.select(0.1):
+            try:
+                received[0] += len(key.fileobj.recv(1 << 16))
+            except BlockingIOError:
+                pass
+    selector.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--carparks", type=int, default=2200)
+    parser.add_argument("--churn", type=float, default=0.05, help="fraction of carparks changing per refresh")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    lots = {f"C{i:04d}": rng.randrange(500) for i in range(args.carparks)}
+    names = list(lots)
+
+    hub = availability_stream.StreamHub()
+    stream = availability_stream.AvailabilityStream(hub)
+    hub.start()
+    stream.record(None, Snapshot(1, dict(lots), {}, "0", time.time()))
+
+    clients = []
+    for _ in range(args.clients):
+        server_end, client_end = socket.socketpair()
+        stream.attach(server_end)
+        clients.append(client_end)
+
+    received = [0]
+    stop = threading.Event()
+    reader = threading.Thread(target=drain, args=(clients, received, stop))
+    reader.start()
+    time.sleep(0.5)
+    hub_clock = time.pthread_getcpuclockid(hub._thread.ident)
+
+    full_bytes = gzip_bytes = 0
+    poll_cpu = diff_cpu = 0.0
+    start_received = received[0]
+    hub_started = time.clock_gettime(hub_clock)
+
+    for version in range(2, args.updates + 2):
+        for name in rng.sample(names, int(len(names) * args.churn)):
+            lots[name] = rng.randrange(500)
+        snapshot = Snapshot(version, dict(lots), {}, str(version), time.time())
+
+        # a poller downloads the whole snapshot, serialized and compressed once per version
+        start = time.thread_time()
+        body = json.dumps({"success": True, "version": version, "updated_at": snapshot.updated_at,
+                           "availability": snapshot.lots}, separators=(",", ":")).encode()
+        compressed = http_cache.compress(body, "gzip")
+        poll_cpu += time.thread_time() - start
+        full_bytes += len(body)
+        gzip_bytes += len(compressed)
+
+        start = time.thread_time()
+        stream.record(None, snapshot)
+        diff_cpu += time.thread_time() - start
+
+    # wait for every client to have read every delta
+    time.sleep(1.0)
+    hub_cpu = time.clock_gettime(hub_clock) - hub_started
+    stream_bytes = received[0] - start_received
+
+    stop.set()
+    reader.join()
+    hub.stop()
+
+    updates, count = args.updates, args.clients
+    report = {
+        "config": vars(args),
+        "per_update_per_client": {
+            "poll_bytes": full_bytes / updates,
+            "poll_gzip_bytes": gzip_bytes / updates,
+            "stream_bytes": stream_bytes / updates / count,
+        },
+        "per_update": {
+            "poll_compress_ms": poll_cpu / updates * 1e3,
+            "stream_diff_ms": diff_cpu / updates * 1e3,
+            "stream_hub_cpu_ms": hub_cpu / updates * 1e3,
+            "stream_hub_cpu_per_client_us": hub_cpu / updates / count * 1e6,
+        },
+        "bandwidth_ratio_vs_gzip": gzip_bytes / max(1, stream_bytes / count),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Catalogue Load Benchmark
+
+Compares a cold start of the carpark catalogue from the CSV (parsing and
+re-projecting every row) against memory-mapping the compiled catalogue.
+
+Each run is a new interpreter that imports `carpark_catalogue` and loads the
+catalogue once, alternating between the two sources. The compiled catalogue is
+built into a temporary file first, so the one in the source tree is left alone.
+Reports the time of `load_catalogue` and the wall time of the whole process.
+
+Usage (from src/backend):
+    python -m benchmarks.catalogue_load [--runs N] [--json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import carpark_catalogue
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# loads the catalogue from the compiled file named in argv[1], or from the CSV if it is empty
+PROBE = (
+    "import sys, time, carpark_catalogue\n"
+    "start = time.perf_counter()\n"
+    "catalogue = carpark_catalogue.load_catalogue(compiled_path=sys.argv[1] or None)\n"
+    "print(time.perf_counter() - start, type(catalogue.lat).__name__)\n"
+)
+
+
+def measure_once(compiled_path):
+    """Returns (load seconds, process wall seconds, column type) of one fresh process."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (BACKEND_DIR, os.environ.get("PYTHONPATH")))))
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE, compiled_path or ""], env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    wall = time.perf_counter() - start
+    load, column_type = output.split()
+    return float(load), wall, column_type
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="print the medians as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        compiled_path = os.path.join(tmp, "carpark_catalogue.bin")
+        with open(carpark_catalogue.CSV_PATH, "rb") as f:
+            data = f.read()
+        catalogue = carpark_catalogue.load_catalogue(compiled_path=None)
+        carpark_catalogue.compile_catalogue(catalogue, carpark_catalogue.source_digest(data), compiled_path)
+
+        results = {"csv": [], "compiled": []}
+        for _ in range(args.runs):
+            for source, path in (("csv", None), ("compiled", compiled_path)):
+                load, wall, column_type = measure_once(path)
+                expected = "memoryview" if source == "compiled" else "array"
+                if column_type != expected:
+                    raise RuntimeError(f"{source} run loaded {column_type} columns, expected {expected}")
+                results[source].append((load, wall))
+
+    summary = {
+        source: {
+            "load_ms": statistics.median(load for load, _ in runs) * 1e3,
+            "process_ms": statistics.median(wall for _, wall in runs) * 1e3,
+        }
+        for source, runs in results.items()
+    }
+
+    if args.json:
+        print(json.dumps(summary))
+        return
+
+    print(f"{'source':>10} {'load min (ms)':>14} {'load median (ms)':>17} {'process median (ms)':>20}")
+    for source, runs in results.items():
+        loads = [load for load, _ in runs]
+        print(f"{source:>10} {min(loads) * 1e3:>14.1f} {summary[source]['load_ms']:>17.1f} "
+              f"{summary[source]['process_ms']:>20.1f}")
+
+
+if __name__ == "__main__":
+    main()
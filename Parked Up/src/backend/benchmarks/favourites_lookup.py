@@ -0,0 +1,104 @@
+"""
+Favourites Lookup Benchmark
+
+Measures `acc_database.get_all_favs` against a Favourites table of growing size,
+once on the original schema (migration 1, no index on user_email) and once on the
+composite-key schema (migration 2).
+
+Each table is filled with ~10 favourites per user, drawn from a pool of 2,200
+carpark numbers, in a throwaway database under the system temp directory. The
+read caches in front of `get_all_favs` are turned off, so every lookup queries
+the table (see `benchmarks.account_cache` for the caches themselves).
+
+Usage (from src/backend):
+    python -m benchmarks.favourites_lookup [--sizes 10000 100000 ...] [--lookups N]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import acc_database
+import migrations
+
+FAVS_PER_USER = 10
+CARPARK_POOL = [f"CP{i:04d}" for i in range(2200)]
+
+
+def build_db(path, version, rows):
+    """
+    Creates a database at the given schema version and fills Favourites with rows entries.
+    Returns the number of users created.
+    """
+    conn = sqlite3.connect(path)
+    migrations.migrate(conn, target=version)
+
+    users = max(1, rows // FAVS_PER_USER)
+
+    def generate():
+        for i in range(rows):
+            user = i % users
+            # carparks are spread across the pool so each user's favourites are distinct
+            yield (f"user{user}@example.com", CARPARK_POOL[(user * 7 + i // users) % len(CARPARK_POOL)])
+
+    with conn:
+        conn.executemany('INSERT OR IGNORE INTO "Favourites" VALUES (?, ?)', generate())
+    conn.close()
+
+    return users
+
+
+def time_lookups(users, lookups, budget):
+    """
+    Times get_all_favs for random users, stopping after lookups calls or budget seconds.
+    Returns a sorted list of per-call latencies in seconds.
+    """
+    rng = random.Random(0)
+    timings = []
+    deadline = time.perf_counter() + budget
+
+    while len(timings) < lookups and time.perf_counter() < deadline:
+        email = f"user{rng.randrange(users)}@example.com"
+        start = time.perf_counter()
+        acc_database.get_all_favs(email)
+        timings.append(time.perf_counter() - start)
+
+    return sorted(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000, 10_000_000])
+    parser.add_argument("--lookups", type=int, default=1000, help="maximum lookups per run")
+    parser.add_argument("--budget", type=float, default=5.0, help="maximum seconds of lookups per run")
+    args = parser.parse_args()
+
+    # every run looks up the same emails, so cached results would hide the schema being measured
+    acc_database.acc_cache.enabled = acc_database.favs_cache.enabled = False
+
+    print(f"{'rows':>12} {'schema':>8} {'build (s)':>10} {'lookups':>8} {'p50 (ms)':>10} {'p99 (ms)':>10}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.sizes:
+            for version in (1, 2):
+                path = os.path.join(tmp, f"favs_{rows}_v{version}.db")
+
+                start = time.perf_counter()
+                users = build_db(path, version, rows)
+                build = time.perf_counter() - start
+
+                acc_database.dbpath = path
+                timings = time_lookups(users, args.lookups, args.budget)
+                acc_database.connections.close_all()
+                os.remove(path)
+
+                p50 = timings[len(timings) // 2] * 1000
+                p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000
+                print(f"{rows:>12} {'v' + str(version):>8} {build:>10.2f} {len(timings):>8} {p50:>10.3f} {p99:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""
+HTTP Load Test
+
+Starts the production server (`serve.py`) against a throwaway database seeded with
+accounts and favourites, then drives a weighted mix of requests at it from a number
+of concurrent clients, and reports throughput, latency percentiles and error rates
+per route as JSON, so runs can be compared over time.
+
+The server runs in its own process, in a temporary directory, with availability
+read from the bundled fixture instead of data.gov.sg. A request counts as an error
+if it fails to connect or does not return a 2xx status.
+
+The mix is given as route=weight pairs. The default mix is mostly reads, with
+writes spread over the seeded users. Profile updates keep each user's email,
+phone number and password, signups each use a new email and phone number (the
+seeded accounts have 8xxxxxxx numbers, signups 9xxxxxxx), and accounts are only
+deleted after the same client signed them up successfully, so every request in
+the mix is expected to succeed.
+
+Usage (from src/backend):
+    python -m benchmarks.load_test [--concurrency N] [--duration S] [--workers N] [--threads N]
+                                   [--accounts N] [--mix login=20,profile=20,...] [--output FILE]
+"""
+
+import argparse
+import datetime
+import http.client
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.account_cache import seed
+import carpark_availability
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PASSWORD = "Passw0rd!"
+
+# the seeded accounts have phone numbers from 80000000 (see benchmarks.account_cache.seed)
+SEEDED_PHONE = 80000000
+SIGNUP_PHONE = 90000000
+
+DEFAULT_MIX = {
+    "login": 15,
+    "profile": 15,
+    "favourites": 20,
+    "add_favourite": 8,
+    "remove_favourite": 8,
+    "update_profile": 4,
+    "signup": 3,
+    "delete_account": 2,
+    "nearby": 10,
+    "search": 8,
+    "autocomplete": 7,
+}
+
+# points around Singapore for the carpark queries
+LAT_RANGE = (1.28, 1.44)
+LNG_RANGE = (103.70, 103.95)
+QUERIES = ["BLK 1", "ANG MO KIO", "TAMPINES ST", "JURONG", "BEDOK NTH", "CLEMENTI AVE", "YISHUN RING"]
+
+
+class Client:
+    """
+    Sends requests for one simulated user at a time, choosing each route from the mix.
+    """
+
+    def __init__(self, number, port, accounts, rng, phones):
+        self.number = number
+        self.port = port
+        self.accounts = accounts
+        self.rng = rng
+        self.phones = phones  # iterator of unused phone numbers, shared by every client
+        self.signed_up = []
+        self.counter = 0
+
+    def user(self):
+        return f"user{self.rng.randrange(self.accounts)}@example.com"
+
+    def record(self, route, body, status):
+        """Keeps the accounts this client signed up, once the server has created them."""
+        if route == "signup" and status == 200:
+            self.signed_up.append(body["email"])
+
+    def request(self, route):
+        """Returns the method, path and JSON body of a request for route."""
+        rng = self.rng
+        if route == "login":
+            return "POST", "/login", {"email": self.user(), "password": PASSWORD}
+        if route == "profile":
+            return "GET", f"/profile/{self.user()}", None
+        if route == "favourites":
+            return "GET", f"/favourites/{self.user()}", None
+        if route in ("add_favourite", "remove_favourite"):
+            path = "/add-favourite" if route == "add_favourite" else "/remove-favourite"
+            return "POST", path, {"email": self.user(), "carpark_no": f"LOAD{rng.randrange(50)}"}
+        if route == "update_profile":
+            user = rng.randrange(self.accounts)
+            email = f"user{user}@example.com"
+            # phone numbers are unique, so keep the user's own
+            return "POST", "/update-profile", {
+                "old_email": email, "email": email, "username": f"renamed{rng.randrange(1000)}",
+                "phone_no": str(SEEDED_PHONE + user), "password": PASSWORD,
+                "current_password": PASSWORD,
+            }
+        if route == "signup":
+            self.counter += 1
+            email = f"load{self.number}_{self.counter}@example.com"
+            return "POST", "/signup", {
+                "username": f"load{self.number}", "email": email, "phone_no": str(next(self.phones)),
+                "password": PASSWORD,
+            }
+        if route == "delete_account":
+            return "DELETE", f"/delete-account/{self.signed_up.pop()}", None
+        if route == "nearby":
+            return "GET", f"/carparks/nearby?lat={rng.uniform(*LAT_RANGE):.5f}&lng={rng.uniform(*LNG_RANGE):.5f}&k=10", None
+        if route == "search":
+            return "GET", (f"/carparks/search?lat={rng.uniform(*LAT_RANGE):.5f}&lng={rng.uniform(*LNG_RANGE):.5f}"
+                           f"&radius=2&min_lots={rng.randrange(50)}&page_size=20"), None
+        if route == "autocomplete":
+            return "GET", f"/carparks/autocomplete?q={rng.choice(QUERIES).replace(' ', '%20')}", None
+        raise ValueError(f"unknown route {route}")
+
+    def send(self, method, path, body):
+        """Returns the response status, or None if the request failed."""
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        try:
+            payload = None if body is None else json.dumps(body)
+            headers = {} if body is None else {"Content-Type": "application/json"}
+            conn.request(method, path, payload, headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            return None
+        finally:
+            conn.close()
+
+
+def percentile(ordered, fraction):
+    """Returns the value at fraction (0-1) of an already sorted list."""
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(timings, errors, elapsed):
+    """
+    Summarizes request latencies (seconds) as counts, rates and percentiles in milliseconds.
+
+    Returns:
+    -dict
+    """
+    ordered = sorted(timings)
+    summary = {
+        "requests": len(ordered),
+        "errors": errors,
+        "error_rate": errors / len(ordered) if ordered else 0.0,
+        "rps": len(ordered) / elapsed,
+    }
+    if ordered:
+        summary.update({
+            "mean_ms": sum(ordered) / len(ordered) * 1e3,
+            "p50_ms": percentile(ordered, 0.50) * 1e3,
+            "p95_ms": percentile(ordered, 0.95) * 1e3,
+            "p99_ms": percentile(ordered, 0.99) * 1e3,
+            "max_ms": ordered[-1] * 1e3,
+        })
+    return summary
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(directory, port, workers, threads):
+    """Starts serve.py in directory and waits until it answers requests."""
+    env = dict(
+        os.environ,
+        AVAILABILITY_URL="file://" + carpark_availability.FIXTURE_PATH,
+        HISTORY_PATH=os.path.join(directory, "availability_history.bin"),
+        # every client connects from 127.0.0.1, so the per-IP limits would refuse most of the mix
+        RATE_LIMITING="0",
+        # nor refuse writes for the cap on concurrent writes, which cannot be hit with one per thread
+        MAX_CONCURRENT_WRITES=str(threads),
+    )
+    env.pop("REQUIRE_SESSION_TOKENS", None)
+
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BACKEND_DIR, "serve.py"), "--port", str(port),
+         "--workers", str(workers), "--threads", str(threads)],
+        cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with status {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/availability")
+            conn.getresponse().read()
+            conn.close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+
+    process.terminate()
+    raise RuntimeError("server did not start")
+
+
+def run(port, accounts, mix, concurrency, warmup, duration, seed_value):
+    """
+    Sends requests from concurrency clients for warmup + duration seconds.
+    Returns {route: (latencies, errors, statuses)} for requests sent after the warmup.
+    """
+    routes, weights = zip(*mix.items())
+    results = {route: ([], [0], {}) for route in (*routes, "signup")}
+    lock = threading.Lock()
+    # next() on a count is atomic, so clients can share it
+    phones = itertools.count(SIGNUP_PHONE)
+    started = time.monotonic()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    def client_loop(number):
+        client = Client(number, port, accounts, random.Random(seed_value * 1000 + number), phones)
+        local = {route: ([], [0], {}) for route in results}
+        while True:
+            route = client.rng.choices(routes, weights)[0]
+            if route == "delete_account" and not client.signed_up:
+                # this client has no account of its own to delete yet
+                route = "signup"
+            method, path, body = client.request(route)
+            start = time.monotonic()
+            if start >= stop_at:
+                break
+            status = client.send(method, path, body)
+            end = time.monotonic()
+            client.record(route, body, status)
+            if start < measure_from:
+                continue
+
+            latencies, errors, statuses = local[route]
+            latencies.append(end - start)
+            if status is None or not 200 <= status < 300:
+                errors[0] += 1
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+        with lock:
+            for route, (latencies, errors, statuses) in local.items():
+                total = results[route]
+                total[0].extend(latencies)
+                total[1][0] += errors[0]
+                for status, count in statuses.items():
+                    total[2][status] = total[2].get(status, 0) + count
+
+    threads = [threading.Thread(target=client_loop, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def parse_mix(text):
+    mix = {}
+    for pair in text.split(","):
+        route, _, weight = pair.partition("=")
+        if route.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown route {route!r}, expected one of {', '.join(DEFAULT_MIX)}")
+        mix[route.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of measured load")
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds of unmeasured load first")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--accounts", type=int, default=10_000)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    started_at = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+    with tempfile.TemporaryDirectory() as tmp:
+        seed(os.path.join(tmp, "acc_database.db"), args.accounts)
+        port = free_port()
+        server = start_server(tmp, port, args.workers, args.threads)
+        try:
+            results = run(port, args.accounts, args.mix, args.concurrency, args.warmup, args.duration, args.seed)
+        finally:
+            server.terminate()
+            server.wait()
+
+    routes = {}
+    all_latencies, all_errors = [], 0
+    for route, (latencies, errors, statuses) in results.items():
+        routes[route] = dict(summarize(latencies, errors[0], args.duration), status=statuses)
+        all_latencies.extend(latencies)
+        all_errors += errors[0]
+
+    report = {
+        "started_at": started_at,
+        "config": {
+            "concurrency": args.concurrency, "duration": args.duration, "warmup": args.warmup,
+            "workers": args.workers, "threads": args.threads, "accounts": args.accounts,
+            "mix": args.mix, "seed": args.seed,
+        },
+        "total": summarize(all_latencies, all_errors, args.duration),
+        "routes": routes,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
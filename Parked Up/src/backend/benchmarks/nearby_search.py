@@ -0,0 +1,106 @@
+"""
+Nearby Carpark Search Benchmark
+
+Compares the grid index behind /carparks/nearby against the brute-force scan the
+frontend does today: a haversine distance to every carpark, then a full sort.
+
+Runs on the real carpark catalogue, then on synthetic catalogues of uniformly
+random points inside the same bounding box.
+
+Usage (from src/backend):
+    python -m benchmarks.nearby_search [--sizes 100000 1000000] [--queries N]
+"""
+
+import argparse
+import math
+import random
+import time
+from array import array
+
+import carpark_catalogue
+from spatial_index import GridIndex
+
+EARTH_RADIUS_KM = 6371
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Port of getDistance in DistanceCalculator.js, in km."""
+    to_rad = math.radians
+    d_lat = to_rad(lat2 - lat1)
+    d_lng = to_rad(lng2 - lng1)
+    a = (math.sin(d_lat / 2) ** 2
+         + math.cos(to_rad(lat1)) * math.cos(to_rad(lat2)) * math.sin(d_lng / 2) ** 2)
+    return EARTH_RADIUS_KM * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def brute_force(lats, lngs, lat, lng, radius, k):
+    distances = sorted((haversine(lat, lng, lats[i], lngs[i]), i) for i in range(len(lats)))
+    if radius is not None:
+        distances = [d for d in distances if d[0] <= radius]
+    return distances if k is None else distances[:k]
+
+
+def grid_search(index, x, y, radius, k):
+    radius_m = None if radius is None else radius * 1000
+    if k is None:
+        return index.within(x, y, radius_m)
+    return index.nearest(x, y, k, radius_m)
+
+
+def time_queries(run, queries, budget):
+    """Returns the mean time per call of run(query), in microseconds."""
+    calls = 0
+    deadline = time.perf_counter() + budget
+    start = time.perf_counter()
+    for query in queries:
+        run(query)
+        calls += 1
+        if time.perf_counter() > deadline:
+            break
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def synthetic(size, bounds, rng):
+    min_x, max_x, min_y, max_y = bounds
+    xs = array("d", (rng.uniform(min_x, max_x) for _ in range(size)))
+    ys = array("d", (rng.uniform(min_y, max_y) for _ in range(size)))
+    return xs, ys
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000],
+                        help="synthetic catalogue sizes, run after the real catalogue")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--budget", type=float, default=5.0, help="maximum seconds per measurement")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    catalogue = carpark_catalogue.load_catalogue()
+    bounds = (min(catalogue.x), max(catalogue.x), min(catalogue.y), max(catalogue.y))
+
+    datasets = [("catalogue", catalogue.x, catalogue.y)]
+    for size in args.sizes:
+        datasets.append(("synthetic",) + synthetic(size, bounds, rng))
+
+    query_points = []
+    for _ in range(args.queries):
+        x = rng.uniform(bounds[0], bounds[1])
+        y = rng.uniform(bounds[2], bounds[3])
+        lats, lngs = carpark_catalogue.svy21_to_wgs84([x], [y])
+        query_points.append((x, y, lats[0], lngs[0]))
+
+    print(f"{'dataset':>10} {'points':>9} {'query':>12} {'brute (us)':>12} {'grid (us)':>10} {'speedup':>8}")
+
+    for name, xs, ys in datasets:
+        lats, lngs = carpark_catalogue.svy21_to_wgs84(xs, ys)
+        index = GridIndex(xs, ys)
+
+        for label, radius, k in (("k=10", None, 10), ("r=1km", 1.0, None), ("r=2km,k=20", 2.0, 20)):
+            brute = time_queries(lambda q: brute_force(lats, lngs, q[2], q[3], radius, k), query_points, args.budget)
+            grid = time_queries(lambda q: grid_search(index, q[0], q[1], radius, k), query_points, args.budget)
+            print(f"{name:>10} {len(xs):>9} {label:>12} {brute:>12.1f} {grid:>10.1f} {brute / grid:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
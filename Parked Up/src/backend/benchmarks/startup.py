@@ -0,0 +1,66 @@
+"""
+Server Startup Benchmark
+
+Measures how long a fresh process takes to import `server` (migrations, catalogue,
+indexes, history file), to catch cold-start regressions.
+
+Each run is a new interpreter in a throwaway directory, so it starts with an
+empty database and history file, like a first deploy. Reports the time of each
+phase recorded in `server.startup_timings`, and the wall time of the whole
+process including interpreter start and imports.
+
+Usage (from src/backend):
+    python -m benchmarks.startup [--runs N] [--json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# imports the server without starting it, and prints its startup timings
+PROBE = "import json, server; print(json.dumps(server.startup_timings))"
+
+
+def measure_once():
+    """Returns the startup timings of one fresh server process, plus its wall time."""
+    with tempfile.TemporaryDirectory() as tmp:
+        pythonpath = os.pathsep.join(filter(None, (BACKEND_DIR, os.environ.get("PYTHONPATH"))))
+        env = dict(os.environ, PYTHONPATH=pythonpath, HISTORY_PATH=os.path.join(tmp, "history.bin"))
+        start = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE], cwd=tmp, env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        wall = time.perf_counter() - start
+
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings["process"] = wall
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print the median of each phase as JSON")
+    args = parser.parse_args()
+
+    runs = [measure_once() for _ in range(args.runs)]
+    phases = {name: [run[name] for run in runs] for name in runs[0]}
+
+    if args.json:
+        print(json.dumps({name: statistics.median(values) for name, values in phases.items()}))
+        return
+
+    print(f"{'phase':>12} {'min (ms)':>10} {'median (ms)':>12} {'max (ms)':>10}")
+    for name, values in phases.items():
+        print(f"{name:>12} {min(values) * 1e3:>10.1f} {statistics.median(values) * 1e3:>12.1f} {max(values) * 1e3:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+"""
+Bulk Import and Export
+
+Streams accounts and favourites into and out of the account database, eg. to
+migrate users from another system, instead of calling `new_acc` and `add_fav`
+once per row.
+
+Files are CSV (with a header row) or JSON Lines, picked by extension or --format.
+They are read and written a row at a time, so memory use does not grow with the
+file size. Imports work in batches:
+- every row of a batch is validated with the same checks as signing up,
+- accounts or emails already in the database are looked up once per batch,
+- the accepted rows are inserted with `executemany`, in one transaction per batch.
+
+The favourite counts per carpark are updated by the database's triggers as the
+favourites are inserted, like any other write (see `favourite_counts.py`).
+
+Rejected rows are written, with their line number and the reason, to a JSON Lines
+file next to the input (or --rejects). Rows that are already in the database
+exactly as given are skipped rather than rejected, so an import can be run again.
+
+After each batch, the position in the input is saved to a progress file next to
+the input. If an import is interrupted, running the same command again resumes
+after the last committed batch (use --restart to start over). The progress file
+is removed once the import finishes.
+
+Usage (from src/backend):
+    python bulk_transfer.py import accounts users.csv [--db PATH] [--batch-size N] [--rejects FILE] [--restart]
+    python bulk_transfer.py import favourites favourites.jsonl [--db PATH] ...
+    python bulk_transfer.py export accounts users.jsonl [--db PATH]
+    python bulk_transfer.py export favourites - --format csv
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import acc_database
+
+FIELDS = {
+    "accounts": ("username", "email", "phone_no", "password"),
+    "favourites": ("user_email", "carpark_no"),
+}
+
+DEFAULT_BATCH_SIZE = 5000
+
+# rows fetched from the database at a time when exporting
+EXPORT_CHUNK_SIZE = 1000
+
+
+def file_format(path, given=None):
+    """Returns "csv" or "jsonl" for a path, unless given explicitly."""
+    if given:
+        return given
+    if path.lower().endswith(".csv"):
+        return "csv"
+    if path.lower().endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    raise SystemExit(f"Cannot tell the format of {path}, use --format csv or --format jsonl")
+
+
+class RowReader:
+    """
+    Reads the rows of a CSV or JSON Lines file, keeping track of the byte offset and
+    line number just after the last row read, so reading can resume from there later.
+    Yields (line number, row dict or None, error or None).
+    """
+
+    def __init__(self, f, fmt, offset=0, line=0):
+        self.f = f
+        self.fmt = fmt
+        self.offset = 0
+        self.line = 0
+        self.header = None
+
+        if fmt == "csv":
+            header = next(csv.reader(self._lines()), None)
+            if header is None:
+                raise SystemExit("The CSV file is empty")
+            self.header = [name.strip().lstrip("﻿") for name in header]
+
+        if offset:
+            self.f.seek(offset)
+            self.offset = offset
+            self.line = line
+
+    def _lines(self):
+        while True:
+            raw = self.f.readline()
+            if not raw:
+                return
+            self.offset += len(raw)
+            self.line += 1
+            yield raw.decode("utf-8")
+
+    def __iter__(self):
+        if self.fmt == "csv":
+            for values in csv.reader(self._lines()):
+                if not values:
+                    continue
+                if len(values) != len(self.header):
+                    yield self.line, None, f"expected {len(self.header)} columns, found {len(values)}"
+                else:
+                    yield self.line, dict(zip(self.header, values)), None
+        else:
+            for text in self._lines():
+                if not text.strip():
+                    continue
+                try:
+                    row = json.loads(text)
+                except ValueError:
+                    yield self.line, None, "invalid JSON"
+                    continue
+                if isinstance(row, dict):
+                    yield self.line, row, None
+                else:
+                    yield self.line, None, "expected a JSON object"
+
+
+def _text(row, field):
+    value = row.get(field)
+    return "" if value is None else str(value)
+
+
+def import_accounts(conn, batch):
+    """
+    Validates and inserts a batch of accounts, on a connection in a transaction.
+
+    Parameters:
+    -conn: sqlite3.Connection
+    -batch: list of (line number, row dict)
+
+    Returns:
+    -(imported, skipped, rejects): counts, and a list of (line number, row, reason)
+    """
+    rejects = []
+    accepted = {}  # email -> (line, (username, email, phone_no, password))
+    phones = {}    # phone_no -> email
+    for line, row in batch:
+        username = _text(row, "username").strip()
+        email = _text(row, "email").strip()
+        phone_no = _text(row, "phone_no").replace(" ", "")
+        password = _text(row, "password")
+
+        if not username:
+            reason = "missing username"
+        elif not acc_database.check_email(email):
+            reason = "invalid email"
+        elif not acc_database.check_phone_no(phone_no):
+            reason = "invalid phone_no"
+        elif not acc_database.check_password(password):
+            reason = "password is not strong enough"
+        elif email in accepted:
+            reason = "duplicate email in input"
+        elif int(phone_no) in phones:
+            reason = "duplicate phone_no in input"
+        else:
+            accepted[email] = (line, (username, email, int(phone_no), password))
+            phones[int(phone_no)] = email
+            continue
+        rejects.append((line, row, reason))
+
+    existing = {
+        row["email"]: (row["username"], row["email"], row["phone_no"], row["password"])
+        for row in conn.execute(
+            'SELECT * FROM "Accounts" WHERE "email" IN (SELECT value FROM json_each(?))',
+            (json.dumps(list(accepted)),))
+    }
+    phone_owners = dict(conn.execute(
+        'SELECT "phone_no", "email" FROM "Accounts" WHERE "phone_no" IN (SELECT value FROM json_each(?))',
+        (json.dumps(list(phones)),)))
+
+    rows, skipped = [], 0
+    for email, (line, record) in accepted.items():
+        if email in existing:
+            if existing[email] == record:
+                skipped += 1
+            else:
+                rejects.append((line, dict(zip(FIELDS["accounts"], record)), "email already exists"))
+        elif record[2] in phone_owners:
+            rejects.append((line, dict(zip(FIELDS["accounts"], record)), "phone_no already in use"))
+        else:
+            rows.append(record)
+
+    before = conn.total_changes
+    conn.executemany('''
+        INSERT INTO "Accounts" ("username", "email", "phone_no", "password")
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT DO NOTHING
+        ''', rows)
+    imported = conn.total_changes - before
+
+    acc_database.acc_cache.invalidate(*(row[1] for row in rows))
+    return imported, skipped + len(rows) - imported, rejects
+
+
+def import_favourites(conn, batch):
+    """
+    Validates and inserts a batch of favourites, on a connection in a transaction.
+    Rows name the account as user_email (or email).
+
+    Parameters:
+    -conn: sqlite3.Connection
+    -batch: list of (line number, row dict)
+
+    Returns:
+    -(imported, skipped, rejects): counts, and a list of (line number, row, reason)
+    """
+    rejects = []
+    accepted = {}  # (user_email, carpark_no) -> line
+    skipped = 0
+    for line, row in batch:
+        email = _text(row, "user_email" if "user_email" in row else "email").strip()
+        carpark_no = _text(row, "carpark_no").strip()
+        if not email:
+            rejects.append((line, row, "missing user_email"))
+        elif not carpark_no:
+            rejects.append((line, row, "missing carpark_no"))
+        elif (email, carpark_no) in accepted:
+            skipped += 1
+        else:
+            accepted[(email, carpark_no)] = line
+
+    emails = {email for email, _ in accepted}
+    known = {row[0] for row in conn.execute(
+        'SELECT "email" FROM "Accounts" WHERE "email" IN (SELECT value FROM json_each(?))',
+        (json.dumps(list(emails)),))}
+
+    rows = []
+    for (email, carpark_no), line in accepted.items():
+        if email in known:
+            rows.append((email, carpark_no))
+        else:
+            rejects.append((line, {"user_email": email, "carpark_no": carpark_no}, "no such account"))
+
+    before = conn.total_changes
+    conn.executemany('''
+        INSERT INTO "Favourites" ("user_email", "carpark_no")
+        VALUES (?, ?)
+        ON CONFLICT ("user_email", "carpark_no") DO NOTHING
+        ''', rows)
+    imported = conn.total_changes - before
+
+    acc_database.favs_cache.invalidate(*known)
+    return imported, skipped + len(rows) - imported, rejects
+
+
+IMPORTERS = {"accounts": import_accounts, "favourites": import_favourites}
+
+
+class Progress:
+    """
+    The position reached by an import in its input file, saved after every batch.
+    It only applies to the same kind of import of the same, unchanged, input file.
+    """
+
+    def __init__(self, path, kind, input_path):
+        self.path = path
+        stat = os.stat(input_path)
+        self.identity = {"kind": kind, "input": os.path.abspath(input_path),
+                         "size": stat.st_size, "mtime": stat.st_mtime}
+        self.offset = 0
+        self.line = 0
+        self.counts = {"imported": 0, "skipped": 0, "rejected": 0}
+
+    def load(self):
+        """Loads the saved position. Returns True if there was one for this input."""
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if saved.get("identity") != self.identity:
+            return False
+        self.offset, self.line, self.counts = saved["offset"], saved["line"], saved["counts"]
+        return True
+
+    def save(self, offset, line):
+        self.offset, self.line = offset, line
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"identity": self.identity, "offset": offset, "line": line, "counts": self.counts}, f)
+        os.replace(self.path + ".tmp", self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def run_import(kind, path, fmt, batch_size, rejects_path, restart):
+    """
+    Imports every row of the file at path ("-" for stdin), in batches of batch_size rows.
+
+    Returns:
+    -dict of counts (imported, skipped, rejected)
+    """
+    importer = IMPORTERS[kind]
+    from_stdin = path == "-"
+    progress = None
+    if not from_stdin:
+        progress = Progress(path + ".progress.json", kind, path)
+        if restart:
+            progress.remove()
+        elif progress.load():
+            print(f"Resuming {path} after line {progress.line}", file=sys.stderr)
+
+    counts = progress.counts if progress else {"imported": 0, "skipped": 0, "rejected": 0}
+    source = sys.stdin.buffer if from_stdin else open(path, "rb")
+    rejects_mode = "a" if progress and progress.offset else "w"
+    started = time.perf_counter()
+
+    with source, open(rejects_path, rejects_mode) as rejects_file:
+        reader = RowReader(source, fmt, progress.offset if progress else 0, progress.line if progress else 0)
+
+        batch, bad_rows = [], []
+
+        def flush():
+            with acc_database.transaction(f"bulk_import_{kind}") as conn:
+                imported, skipped, rejects = importer(conn, batch)
+            rejects = sorted(bad_rows + rejects, key=lambda reject: reject[0])
+            for line, row, reason in rejects:
+                rejects_file.write(json.dumps({"line": line, "reason": reason, "row": row}) + "\n")
+            rejects_file.flush()
+
+            counts["imported"] += imported
+            counts["skipped"] += skipped
+            counts["rejected"] += len(rejects)
+            if progress:
+                progress.save(reader.offset, reader.line)
+            batch.clear()
+            bad_rows.clear()
+
+            rate = (counts["imported"] + counts["skipped"]) / (time.perf_counter() - started)
+            print(f"line {reader.line}: {counts['imported']} imported, {counts['skipped']} skipped, "
+                  f"{counts['rejected']} rejected ({rate:,.0f} rows/s)", file=sys.stderr)
+
+        for line, row, error in reader:
+            if error:
+                bad_rows.append((line, None, error))
+            else:
+                batch.append((line, row))
+            if len(batch) + len(bad_rows) >= batch_size:
+                flush()
+        if batch or bad_rows:
+            flush()
+
+    if progress:
+        progress.remove()
+    return counts
+
+
+def run_export(kind, path, fmt):
+    """
+    Writes every account or favourite to the file at path ("-" for stdout).
+
+    Returns:
+    -int, the number of rows written
+    """
+    fields = FIELDS[kind]
+    table = "Accounts" if kind == "accounts" else "Favourites"
+    columns = ", ".join(f'"{field}"' for field in fields)
+    conn = acc_database.connections.get(acc_database.dbpath)
+    cursor = conn.execute(f'SELECT {columns} FROM "{table}"')
+
+    out = sys.stdout if path == "-" else open(path, "w", newline="")
+    written = 0
+    try:
+        writer = csv.writer(out) if fmt == "csv" else None
+        if writer:
+            writer.writerow(fields)
+        while True:
+            rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                if writer:
+                    writer.writerow(tuple(row))
+                else:
+                    out.write(json.dumps(dict(zip(fields, row))) + "\n")
+            written += len(rows)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("action", choices=("import", "export"))
+    parser.add_argument("kind", choices=tuple(FIELDS))
+    parser.add_argument("path", help='CSV or JSON Lines file, or "-" for stdin/stdout')
+    parser.add_argument("--format", choices=("csv", "jsonl"))
+    parser.add_argument("--db", default=acc_database.dbpath)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--rejects", help="where to write rejected rows (default: next to the input)")
+    parser.add_argument("--restart", action="store_true", help="ignore saved progress and start from the beginning")
+    args = parser.parse_args()
+
+    if args.path == "-" and not args.format:
+        parser.error("--format is required when reading stdin or writing stdout")
+    fmt = file_format(args.path, args.format)
+
+    acc_database.dbpath = args.db
+    acc_database.init_db()
+
+    started = time.perf_counter()
+    if args.action == "import":
+        rejects = args.rejects or ("rejects.jsonl" if args.path == "-" else args.path + ".rejects.jsonl")
+        counts = run_import(args.kind, args.path, fmt, args.batch_size, rejects, args.restart)
+        print(f"Imported {counts['imported']}, skipped {counts['skipped']}, rejected {counts['rejected']} "
+              f"{args.kind} in {time.perf_counter() - started:.1f}s (rejected rows are in {rejects})",
+              file=sys.stderr)
+    else:
+        written = run_export(args.kind, args.path, fmt)
+        print(f"Exported {written} {args.kind} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    acc_database.connections.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Carpark Availability Cache
+
+Polls data.gov.sg's carpark availability API from the backend, so clients read a
+shared in-memory snapshot instead of each calling the upstream API themselves.
+
+- A background thread refreshes the snapshot on a fixed interval.
+- Each snapshot sums the per-lot-type counts of every carpark, keyed by
+  carpark number, and carries a version number that only increases when the
+  lot counts actually change.
+- Refreshes are single-flight: if several requests need a refresh at the same
+  time, one upstream call is made and every caller shares its result.
+- Listeners registered with `on_snapshot` are called with the previous and new
+  snapshot every time the version changes. The carparks whose lots changed are
+  worked out once, as the new snapshot's `changed`, so listeners that only need
+  those (the stream and the alerts) do not each compare every carpark.
+
+The upstream URL can point at a local file (file://...) or a stub server, e.g.
+the fixture in `fixtures/carpark_availability.json`.
+"""
+
+import json
+import os
+import threading
+import time
+import urllib.request
+
+AVAILABILITY_URL = "https://api.data.gov.sg/v1/transport/carpark-availability"
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "fixtures", "carpark_availability.json")
+
+# seconds between background refreshes; the upstream API updates every minute
+REFRESH_INTERVAL = 60
+
+# seconds to wait for the upstream API
+FETCH_TIMEOUT = 10
+
+
+def fetch_json(url=AVAILABILITY_URL, timeout=FETCH_TIMEOUT):
+    """
+    Fetches and decodes the JSON document at url.
+
+    Parameters:
+    -url: str
+    -timeout: float
+
+    Returns:
+    -dict
+    """
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.load(response)
+
+
+def aggregate(api_data):
+    """
+    Sums the available and total lots of every lot type for each carpark.
+
+    Parameters:
+    -api_data: dict (the upstream API response)
+
+    Returns:
+    -(lots, capacity, updated_at): available lots and total lots keyed by carpark number,
+     and the upstream timestamp
+    """
+    item = api_data["items"][0]
+    lots = {}
+    capacity = {}
+
+    for carpark in item["carpark_data"]:
+        available = 0
+        total = 0
+        for lot in carpark["carpark_info"]:
+            available += int(lot["lots_available"])
+            total += int(lot["total_lots"])
+
+        lots[carpark["carpark_number"]] = available
+        capacity[carpark["carpark_number"]] = total
+
+    return lots, capacity, item.get("timestamp")
+
+
+def changed_lots(previous_lots, lots):
+    """
+    Finds the carparks whose available lots differ between two snapshots.
+    Carparks missing from lots count as 0 lots.
+
+    Parameters:
+    -previous_lots: dict of carpark number to available lots
+    -lots: dict of carpark number to available lots
+
+    Returns:
+    -dict of carpark number to its new available lots, for the changed carparks only
+    """
+    changed = {no: count for no, count in lots.items() if previous_lots.get(no) != count}
+    changed.update((no, 0) for no in previous_lots if no not in lots)
+    return changed
+
+
+class Snapshot:
+    """
+    An immutable view of carpark availability at one point in time.
+    changed holds the lots that changed since the previous version (see changed_lots),
+    or None for the first snapshot or one built outside AvailabilityCache.
+    """
+
+    __slots__ = ("version", "lots", "capacity", "updated_at", "fetched_at", "changed")
+
+    def __init__(self, version, lots, capacity, updated_at, fetched_at, changed=None):
+        self.version = version
+        self.lots = lots
+        self.capacity = capacity
+        self.updated_at = updated_at
+        self.fetched_at = fetched_at
+        self.changed = changed
+
+    def age(self):
+        """Returns the number of seconds since this snapshot was fetched."""
+        return time.time() - self.fetched_at
+
+
+class _Flight:
+    """An upstream fetch in progress, shared by every caller that asked for it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.snapshot = None
+        self.error = None
+
+
+class AvailabilityCache:
+    """
+    Holds the latest availability snapshot and refreshes it from the upstream API.
+    """
+
+    def __init__(self, fetch=fetch_json, interval=REFRESH_INTERVAL):
+        self.fetch = fetch
+        self.interval = interval
+        self.snapshot = None
+        self.fetch_count = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._flight = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def on_snapshot(self, listener):
+        """
+        Registers listener(previous, snapshot) to be called whenever a new version is published.
+        previous is None for the first snapshot.
+
+        Parameters:
+        -listener: callable
+        """
+        self._listeners.append(listener)
+
+    def refresh(self):
+        """
+        Fetches the upstream data and publishes it as the current snapshot.
+        If a refresh is already in flight, waits for it and returns its result instead.
+
+        Returns:
+        -Snapshot
+        """
+        with self._lock:
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.snapshot
+
+        try:
+            self.fetch_count += 1
+            flight.snapshot = self._publish(*aggregate(self.fetch()))
+            return flight.snapshot
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flight = None
+            flight.done.set()
+
+    def _publish(self, lots, capacity, updated_at):
+        previous = self.snapshot
+
+        if previous is not None and previous.lots == lots and previous.capacity == capacity:
+            # nothing changed, keep the version so clients' cached copies stay valid
+            snapshot = Snapshot(previous.version, previous.lots, previous.capacity, updated_at, time.time(),
+                                previous.changed)
+            self.snapshot = snapshot
+            return snapshot
+
+        version = 1 if previous is None else previous.version + 1
+        # compared once here, for every listener
+        changed = None if previous is None else changed_lots(previous.lots, lots)
+        snapshot = Snapshot(version, lots, capacity, updated_at, time.time(), changed)
+        self.snapshot = snapshot
+
+        for listener in self._listeners:
+            try:
+                listener(previous, snapshot)
+            except Exception as e:
+                print(f"Error in availability listener: {e}")
+
+        return snapshot
+
+    def current(self, max_age=None):
+        """
+        Returns the current snapshot, refreshing it first if there is none yet or it is
+        older than max_age seconds. A stale snapshot is returned if the refresh fails.
+
+        Parameters:
+        -max_age: float
+
+        Returns:
+        -Snapshot, or None if no snapshot could be fetched
+        """
+        snapshot = self.snapshot
+        if snapshot is not None and (max_age is None or snapshot.age() <= max_age):
+            return snapshot
+
+        try:
+            return self.refresh()
+        except Exception as e:
+            print(f"Error fetching carpark availability: {e}")
+            return self.snapshot
+
+    def start(self):
+        """
+        Starts the background refresher thread, if it is not already running.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="availability-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background refresher thread.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing carpark availability: {e}")
+            self._stop.wait(self.interval)
@@ -0,0 +1,569 @@
+"""
+Carpark Catalogue
+
+Loads the HDB carpark information CSV once, when the server starts, into a
+column-oriented in-memory catalogue so clients no longer need to download,
+parse and re-project it on every page load.
+
+Columns are kept in parallel arrays indexed by carpark position:
+- numeric columns (coordinates, gantry height, decks) are stored in `array`s
+  (or memoryviews of the compiled catalogue, see below).
+- categorical columns (carpark type, parking system, parking flags) are
+  dictionary-encoded, ie. an `array` of small codes plus a list of distinct values.
+- carpark numbers and addresses are plain lists of strings.
+
+The SVY21 (EPSG:3414) x/y coordinates are converted to WGS84 latitude and
+longitude in a single batched pass over the coordinate columns, using the
+same projection parameters as `CoordinateConverter.js`.
+
+Compiled catalogue:
+`python carpark_catalogue.py` compiles the CSV into a binary file (COMPILED_PATH)
+of fixed-width columns: coordinates already in WGS84, the categorical codes and
+parking flags, and string ids into one interned string table holding the carpark
+numbers, addresses and category values. `load_catalogue` memory-maps it and uses
+the numeric columns in place, so nothing is parsed or re-projected at startup,
+and every worker process shares the same pages. The file records a hash of the
+CSV it was built from; if the CSV has changed since, or the file is missing,
+the catalogue is loaded from the CSV instead.
+"""
+
+import argparse
+import csv
+import hashlib
+import io
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from spatial_index import GridIndex
+
+CSV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "..", "..", "public", "HDBCarparkInformation.csv")
+
+# EPSG:3414 (SVY21) transverse mercator parameters, on the WGS84 ellipsoid
+SEMI_MAJOR_AXIS = 6378137.0
+FLATTENING = 1 / 298.257223563
+ORIGIN_LAT = 1.36666666666667
+ORIGIN_LNG = 103.833333333333
+SCALE_FACTOR = 1.0
+FALSE_EASTING = 28001.642
+FALSE_NORTHING = 38744.572
+
+CATEGORICAL_COLUMNS = (
+    "car_park_type",
+    "type_of_parking_system",
+    "short_term_parking",
+    "free_parking",
+    "night_parking",
+    "car_park_basement",
+)
+
+# parking flag bits, see CarparkCatalogue.flags
+FREE_PARKING = 1
+NIGHT_PARKING = 2
+SHORT_TERM_PARKING = 4
+
+COMPILED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "carpark_catalogue.bin")
+
+# compiled catalogue layout: this header, then each column starting on an 8 byte boundary:
+# x, y, lat, lng, gantry_height (d), decks (i), carpark_no and address string ids (I),
+# the code column of each of CATEGORICAL_COLUMNS (B), flags (B), the distinct values
+# of each categorical column as a count followed by string ids (I), the end offset
+# of each string in the string table (I), and the UTF-8 string table itself.
+COMPILED_MAGIC = b"PKCATLOG"
+COMPILED_VERSION = 1
+# magic, version, byte order (1 = little endian), carparks, strings, category value ids, CSV hash
+COMPILED_HEADER = struct.Struct("<8sIIIII16s")
+COMPILED_NUMERIC_COLUMNS = (("x", "d"), ("y", "d"), ("lat", "d"), ("lng", "d"), ("gantry_height", "d"), ("decks", "i"))
+
+
+def _meridian_arc(phi, e2):
+    """Returns the meridional arc length from the equator to latitude phi (radians)."""
+    e4 = e2 * e2
+    e6 = e4 * e2
+    return SEMI_MAJOR_AXIS * (
+        (1 - e2 / 4 - 3 * e4 / 64 - 5 * e6 / 256) * phi
+        - (3 * e2 / 8 + 3 * e4 / 32 + 45 * e6 / 1024) * math.sin(2 * phi)
+        + (15 * e4 / 256 + 45 * e6 / 1024) * math.sin(4 * phi)
+        - (35 * e6 / 3072) * math.sin(6 * phi)
+    )
+
+
+def svy21_to_wgs84(xs, ys):
+    """
+    Converts columns of SVY21 (EPSG:3414) eastings and northings to WGS84.
+    Uses the inverse transverse mercator series (Snyder, USGS PP 1395), with every
+    constant hoisted out of the loop so each point costs only a few trig calls.
+
+    Parameters:
+    -xs: sequence of float (eastings)
+    -ys: sequence of float (northings)
+
+    Returns:
+    -(lats, lngs): tuple of array('d')
+    """
+    a = SEMI_MAJOR_AXIS
+    k0 = SCALE_FACTOR
+    e2 = 2 * FLATTENING - FLATTENING ** 2
+    e4 = e2 * e2
+    e6 = e4 * e2
+    ep2 = e2 / (1 - e2)
+    sqrt_1_e2 = math.sqrt(1 - e2)
+    e1 = (1 - sqrt_1_e2) / (1 + sqrt_1_e2)
+
+    m0 = _meridian_arc(math.radians(ORIGIN_LAT), e2)
+    mu_divisor = a * (1 - e2 / 4 - 3 * e4 / 64 - 5 * e6 / 256)
+    c2 = 3 * e1 / 2 - 27 * e1 ** 3 / 32
+    c4 = 21 * e1 ** 2 / 16 - 55 * e1 ** 4 / 32
+    c6 = 151 * e1 ** 3 / 96
+    c8 = 1097 * e1 ** 4 / 512
+    lng0 = math.radians(ORIGIN_LNG)
+
+    sin, cos, tan, sqrt, degrees = math.sin, math.cos, math.tan, math.sqrt, math.degrees
+    lats = array("d", bytes(8 * len(xs)))
+    lngs = array("d", bytes(8 * len(xs)))
+
+    for i in range(len(xs)):
+        mu = (m0 + (ys[i] - FALSE_NORTHING) / k0) / mu_divisor
+        phi1 = mu + c2 * sin(2 * mu) + c4 * sin(4 * mu) + c6 * sin(6 * mu) + c8 * sin(8 * mu)
+
+        sin_phi1 = sin(phi1)
+        cos_phi1 = cos(phi1)
+        tan_phi1 = tan(phi1)
+        w = 1 - e2 * sin_phi1 * sin_phi1
+        c1 = ep2 * cos_phi1 * cos_phi1
+        t1 = tan_phi1 * tan_phi1
+        n1 = a / sqrt(w)
+        r1 = a * (1 - e2) / (w * sqrt(w))
+        d = (xs[i] - FALSE_EASTING) / (n1 * k0)
+        d2 = d * d
+
+        lats[i] = degrees(phi1 - (n1 * tan_phi1 / r1) * d2 * (
+            1 / 2
+            - (5 + 3 * t1 + 10 * c1 - 4 * c1 * c1 - 9 * ep2) * d2 / 24
+            + (61 + 90 * t1 + 298 * c1 + 45 * t1 * t1 - 252 * ep2 - 3 * c1 * c1) * d2 * d2 / 720
+        ))
+        lngs[i] = degrees(lng0 + d * (
+            1
+            - (1 + 2 * t1 + c1) * d2 / 6
+            + (5 - 2 * c1 + 28 * t1 - 3 * c1 * c1 + 8 * ep2 + 24 * t1 * t1) * d2 * d2 / 120
+        ) / cos_phi1)
+
+    return lats, lngs
+
+
+def wgs84_to_svy21(lat, lng):
+    """
+    Converts a single WGS84 latitude and longitude to SVY21 (EPSG:3414) easting and northing.
+    Uses the forward transverse mercator series, the inverse of svy21_to_wgs84.
+
+    Parameters:
+    -lat: float
+    -lng: float
+
+    Returns:
+    -(x, y): tuple of float
+    """
+    a = SEMI_MAJOR_AXIS
+    k0 = SCALE_FACTOR
+    e2 = 2 * FLATTENING - FLATTENING ** 2
+    ep2 = e2 / (1 - e2)
+
+    phi = math.radians(lat)
+    sin_phi = math.sin(phi)
+    cos_phi = math.cos(phi)
+    tan_phi = math.tan(phi)
+
+    n = a / math.sqrt(1 - e2 * sin_phi * sin_phi)
+    t = tan_phi * tan_phi
+    c = ep2 * cos_phi * cos_phi
+    A = (math.radians(lng) - math.radians(ORIGIN_LNG)) * cos_phi
+    m = _meridian_arc(phi, e2)
+    m0 = _meridian_arc(math.radians(ORIGIN_LAT), e2)
+
+    x = FALSE_EASTING + k0 * n * (
+        A
+        + (1 - t + c) * A ** 3 / 6
+        + (5 - 18 * t + t * t + 72 * c - 58 * ep2) * A ** 5 / 120
+    )
+    y = FALSE_NORTHING + k0 * (m - m0 + n * tan_phi * (
+        A * A / 2
+        + (5 - t + 9 * c + 4 * c * c) * A ** 4 / 24
+        + (61 - 58 * t + t * t + 600 * c - 330 * ep2) * A ** 6 / 720
+    ))
+    return x, y
+
+
+def _parse_float(value, default=None):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _parking_flags(row):
+    """Encodes the free, night and short-term parking columns of a CSV row as flag bits."""
+    flags = 0
+    if (row.get("free_parking") or "NO") != "NO":
+        flags |= FREE_PARKING
+    if row.get("night_parking") == "YES":
+        flags |= NIGHT_PARKING
+    if (row.get("short_term_parking") or "NO") != "NO":
+        flags |= SHORT_TERM_PARKING
+    return flags
+
+
+class CarparkCatalogue:
+    """
+    Column-oriented, read-only store of every carpark in the HDB carpark CSV.
+    Carparks are addressed by their position (0..len-1) in the catalogue.
+    """
+
+    def __init__(self, rows):
+        rows = [row for row in rows
+                if _parse_float(row.get("x_coord")) is not None
+                and _parse_float(row.get("y_coord")) is not None]
+
+        self.carpark_no = [row["car_park_no"] for row in rows]
+        self.address = [row.get("address") or "N/A" for row in rows]
+        self.x = array("d", (float(row["x_coord"]) for row in rows))
+        self.y = array("d", (float(row["y_coord"]) for row in rows))
+        self.gantry_height = array("d", (_parse_float(row.get("gantry_height"), 0.0) for row in rows))
+        self.decks = array("i", (int(_parse_float(row.get("car_park_decks"), 0)) for row in rows))
+
+        # dictionary-encoded categorical columns: name -> (codes, distinct values)
+        self.categories = {}
+        for column in CATEGORICAL_COLUMNS:
+            values = []
+            lookup = {}
+            codes = array("B")
+            for row in rows:
+                value = row.get(column) or "N/A"
+                if value not in lookup:
+                    lookup[value] = len(values)
+                    values.append(value)
+                codes.append(lookup[value])
+            self.categories[column] = (codes, values)
+
+        # parking flags, as bits for search
+        self.flags = array("B", (_parking_flags(row) for row in rows))
+
+        self.lat, self.lng = svy21_to_wgs84(self.x, self.y)
+        self._build_indexes()
+
+    def _build_indexes(self):
+        # bitmask for search: one bit per distinct carpark type
+        self.type_bits = array("Q", (1 << code for code in self.categories["car_park_type"][0]))
+        self.position = {no: i for i, no in enumerate(self.carpark_no)}
+        self.index = GridIndex(self.x, self.y)
+        self._records = None
+
+    def __len__(self):
+        return len(self.carpark_no)
+
+    def category(self, column, i):
+        """
+        Returns the decoded value of a categorical column for the carpark at position i.
+
+        Parameters:
+        -column: str
+        -i: int
+
+        Returns:
+        -str
+        """
+        codes, values = self.categories[column]
+        return values[codes[i]]
+
+    def type_mask(self, types):
+        """
+        Returns the bitmask matching any of the given carpark types.
+        Unknown types are ignored.
+
+        Parameters:
+        -types: iterable of str
+
+        Returns:
+        -int
+        """
+        values = self.categories["car_park_type"][1]
+        mask = 0
+        for carpark_type in types:
+            if carpark_type in values:
+                mask |= 1 << values.index(carpark_type)
+        return mask
+
+    def record(self, i):
+        """
+        Returns the normalized record of the carpark at position i, using the same
+        field names as the frontend's carpark objects.
+
+        Parameters:
+        -i: int
+
+        Returns:
+        -dict
+        """
+        return {
+            "carparkNumber": self.carpark_no[i],
+            "address": self.address[i],
+            "lat": self.lat[i],
+            "lng": self.lng[i],
+            "carparkType": self.category("car_park_type", i),
+            "gantryHeight": self.gantry_height[i],
+            "parkingSystem": self.category("type_of_parking_system", i),
+            "shortTermParking": self.category("short_term_parking", i),
+            "freeParking": self.category("free_parking", i),
+            "nightParking": self.category("night_parking", i),
+            "decks": self.decks[i],
+            "basement": self.category("car_park_basement", i),
+        }
+
+    def records(self):
+        """
+        Returns the normalized records of every carpark.
+        The list is built once and shared, so callers must not modify it.
+
+        Returns:
+        -list[dict]
+        """
+        if self._records is None:
+            self._records = [self.record(i) for i in range(len(self))]
+        return self._records
+
+    def find(self, carpark_no):
+        """
+        Returns the position of a carpark in the catalogue, or None if it is unknown.
+
+        Parameters:
+        -carpark_no: str
+
+        Returns:
+        -int
+        """
+        return self.position.get(carpark_no)
+
+    def nearby(self, lat, lng, radius=None, k=None):
+        """
+        Finds carparks near a point, nearest first.
+        With only radius, returns every carpark within radius km. With k, returns
+        at most the k nearest carparks, limited to radius km if it is also given.
+
+        Parameters:
+        -lat: float
+        -lng: float
+        -radius: float (km)
+        -k: int
+
+        Returns:
+        -list of (distance in km, position)
+        """
+        x, y = wgs84_to_svy21(lat, lng)
+        radius_m = None if radius is None else radius * 1000
+
+        if k is None:
+            matches = self.index.within(x, y, radius_m)
+        else:
+            matches = self.index.nearest(x, y, k, radius_m)
+
+        return [(d / 1000, i) for d, i in matches]
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def source_digest(data):
+    """Returns the hash of a CSV's bytes that a compiled catalogue is checked against."""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def compile_catalogue(catalogue, digest, path=COMPILED_PATH):
+    """
+    Writes a catalogue to a compiled catalogue file, replacing it atomically, so
+    processes that have the old file mapped keep using it safely.
+
+    Parameters:
+    -catalogue: CarparkCatalogue
+    -digest: bytes, source_digest of the CSV it was loaded from
+    -path: str
+    """
+    strings = []
+    ids = {}
+
+    def intern(value):
+        string_id = ids.get(value)
+        if string_id is None:
+            string_id = ids[value] = len(strings)
+            strings.append(value)
+        return string_id
+
+    columns = [array(code, getattr(catalogue, name)) for name, code in COMPILED_NUMERIC_COLUMNS]
+    columns.append(array("I", (intern(no) for no in catalogue.carpark_no)))
+    columns.append(array("I", (intern(address) for address in catalogue.address)))
+    columns.extend(array("B", catalogue.categories[column][0]) for column in CATEGORICAL_COLUMNS)
+    columns.append(array("B", catalogue.flags))
+
+    category_values = array("I")
+    for column in CATEGORICAL_COLUMNS:
+        values = catalogue.categories[column][1]
+        category_values.append(len(values))
+        category_values.extend(intern(value) for value in values)
+    columns.append(category_values)
+
+    encoded = [value.encode("utf-8") for value in strings]
+    ends = array("I")
+    end = 0
+    for data in encoded:
+        end += len(data)
+        ends.append(end)
+    columns.append(ends)
+    columns.append(b"".join(encoded))
+
+    header = COMPILED_HEADER.pack(COMPILED_MAGIC, COMPILED_VERSION, 1 if sys.byteorder == "little" else 2,
+                                  len(catalogue), len(strings), len(category_values), digest)
+    with open(path + ".tmp", "wb") as f:
+        f.write(header)
+        offset = len(header)
+        for column in columns:
+            f.write(bytes(_align(offset) - offset))
+            data = column if isinstance(column, bytes) else column.tobytes()
+            f.write(data)
+            offset = _align(offset) + len(data)
+    os.replace(path + ".tmp", path)
+
+
+def load_compiled(path=COMPILED_PATH, digest=None):
+    """
+    Memory-maps a compiled catalogue file. Numeric and code columns are read-only
+    memoryviews into the mapping; strings are decoded into lists.
+
+    Parameters:
+    -path: str
+    -digest: bytes, only accept a file compiled from the CSV with this source_digest
+
+    Returns:
+    -CarparkCatalogue, or None if the file is missing, of another version, compiled from another CSV,
+     or truncated or corrupt
+    """
+    try:
+        with open(path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    try:
+        catalogue = _read_compiled(mapping, digest)
+    except (struct.error, TypeError, ValueError, IndexError, OverflowError, UnicodeDecodeError) as e:
+        print(f"Ignoring corrupt compiled catalogue {path}: {e}")
+        catalogue = None
+
+    if catalogue is None:
+        try:
+            mapping.close()
+        except BufferError:
+            # a view into the mapping is still referenced; it is unmapped once that is collected
+            pass
+    return catalogue
+
+
+def _read_compiled(mapping, digest):
+    """
+    Reads the catalogue in a compiled file's mapping, or returns None if it is of another
+    version or compiled from another CSV. Raises ValueError (or struct.error, IndexError, ...)
+    if the file is truncated or corrupt.
+    """
+    if len(mapping) < COMPILED_HEADER.size:
+        raise ValueError(f"{len(mapping)} bytes is shorter than the header")
+
+    magic, version, byteorder, count, string_count, category_size, source = COMPILED_HEADER.unpack_from(mapping)
+    if (magic != COMPILED_MAGIC or version != COMPILED_VERSION
+            or byteorder != (1 if sys.byteorder == "little" else 2)
+            or (digest is not None and source != digest)):
+        return None
+
+    view = memoryview(mapping)
+    offset = COMPILED_HEADER.size
+
+    def column(code, length):
+        nonlocal offset
+        start = _align(offset)
+        offset = start + length * struct.calcsize(code)
+        if offset > len(mapping):
+            raise ValueError(f"column ends at byte {offset}, past the end of the file ({len(mapping)} bytes)")
+        return view[start:offset].cast(code)
+
+    catalogue = CarparkCatalogue.__new__(CarparkCatalogue)
+    for name, code in COMPILED_NUMERIC_COLUMNS:
+        setattr(catalogue, name, column(code, count))
+    carpark_ids = column("I", count)
+    address_ids = column("I", count)
+    codes = [column("B", count) for _ in CATEGORICAL_COLUMNS]
+    catalogue.flags = column("B", count)
+    category_values = column("I", category_size)
+    ends = column("I", string_count)
+    table = column("B", ends[-1] if string_count else 0).tobytes()
+
+    strings = []
+    start = 0
+    for end in ends:
+        strings.append(table[start:end].decode("utf-8"))
+        start = end
+
+    catalogue.carpark_no = [strings[i] for i in carpark_ids]
+    catalogue.address = [strings[i] for i in address_ids]
+    catalogue.categories = {}
+    i = 0
+    for column_name, column_codes in zip(CATEGORICAL_COLUMNS, codes):
+        size = category_values[i]
+        catalogue.categories[column_name] = (column_codes, [strings[j] for j in category_values[i + 1:i + 1 + size]])
+        i += 1 + size
+
+    catalogue._build_indexes()
+    catalogue._mapping = mapping
+    return catalogue
+
+
+def load_catalogue(path=CSV_PATH, compiled_path=COMPILED_PATH):
+    """
+    Loads the catalogue of the carpark CSV at path: from the compiled catalogue at
+    compiled_path if it was compiled from the CSV as it is now, else from the CSV itself.
+
+    Parameters:
+    -path: str
+    -compiled_path: str, or None to always read the CSV
+
+    Returns:
+    -CarparkCatalogue
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if compiled_path is not None:
+        catalogue = load_compiled(compiled_path, source_digest(data))
+        if catalogue is not None:
+            return catalogue
+        if os.path.exists(compiled_path):
+            print(f"{compiled_path} is out of date, loading {path} instead "
+                  f"(run `python carpark_catalogue.py` to recompile it)")
+
+    return CarparkCatalogue(csv.DictReader(io.StringIO(data.decode("utf-8"), newline="")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compiles the carpark CSV into a memory-mappable catalogue file.")
+    parser.add_argument("--csv", default=CSV_PATH)
+    parser.add_argument("--output", default=COMPILED_PATH)
+    args = parser.parse_args()
+
+    with open(args.csv, "rb") as f:
+        data = f.read()
+    catalogue = CarparkCatalogue(csv.DictReader(io.StringIO(data.decode("utf-8"), newline="")))
+    compile_catalogue(catalogue, source_digest(data), args.output)
+    print(f"Compiled {len(catalogue)} carparks from {args.csv} to {args.output} ({os.path.getsize(args.output)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
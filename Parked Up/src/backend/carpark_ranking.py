@@ -0,0 +1,109 @@
+"""
+Carpark Ranking
+
+Ranks the carparks around a destination by how good a place they are to park,
+rather than by distance alone, so an empty carpark 300m away can beat a nearly
+full one next door.
+
+Every carpark within the search radius is scored between 0 and 1, as a weighted
+sum of:
+- distance: 1 at the destination, falling linearly to 0 at the radius,
+- available lots: lots / (lots + LOTS_HALF_SCORE), so the first free lots count
+  the most, and a carpark with no free lots (or unknown availability) scores 0,
+- carpark type: 1 for the preferred types (or for every type, if none are given), else 0.
+Carparks whose gantry is lower than the vehicle are left out. A gantry height
+of 0 means the carpark has no height limit.
+
+Only the best k carparks are kept, in a heap of at most k entries, instead of
+sorting every candidate. Many destinations can be ranked in one call, sharing
+the lots column and type scores, which only depend on the request.
+"""
+
+import heapq
+
+# relative importance of each part of the score, used unless a request gives its own
+DEFAULT_WEIGHTS = {"distance": 0.5, "lots": 0.4, "type": 0.1}
+
+# number of available lots at which the lots part of the score is 0.5
+LOTS_HALF_SCORE = 10
+
+
+class CarparkRanker:
+    """
+    Ranks the carparks of a CarparkSearch's catalogue near destinations,
+    using the lot counts of the latest availability snapshot.
+    """
+
+    def __init__(self, search):
+        self.search = search
+        self.catalogue = search.catalogue
+
+    def type_scores(self, types):
+        """
+        Returns the type part of the score for each carpark type code.
+
+        Parameters:
+        -types: iterable of preferred carpark type names, or None for no preference
+
+        Returns:
+        -list[float]
+        """
+        values = self.catalogue.categories["car_park_type"][1]
+        if types is None:
+            return [1.0] * len(values)
+        types = set(types)
+        return [1.0 if value in types else 0.0 for value in values]
+
+    def rank(self, snapshot, destinations, k=5, radius=1.0, vehicle_height=0.0, types=None, weights=None):
+        """
+        Finds the best k carparks within radius of each destination.
+
+        Parameters:
+        -snapshot: Snapshot (availability), or None
+        -destinations: list of (lat, lng)
+        -k: int
+        -radius: float (km), must be positive
+        -vehicle_height: float (m), 0 to ignore gantry heights
+        -types: iterable of preferred carpark type names, or None
+        -weights: dict of non-negative "distance", "lots" and "type" weights, defaulting to
+         DEFAULT_WEIGHTS; they are scaled to add up to 1
+
+        Returns:
+        -list, one per destination, of lists of (position, score, distance in km, lots), best first
+        """
+        catalogue = self.catalogue
+        lots = self.search.lots_column(snapshot)
+        gantry = catalogue.gantry_height
+        type_codes = catalogue.categories["car_park_type"][0]
+        type_scores = self.type_scores(types)
+
+        weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        total = sum(weights.values())
+        distance_weight = weights["distance"] / total
+        per_km = distance_weight / radius
+        lots_weight = weights["lots"] / total
+        type_weight = weights["type"] / total
+
+        results = []
+        for lat, lng in destinations:
+            # (score, -distance, position), so ties go to the nearer carpark
+            heap = []
+            for distance, i in catalogue.nearby(lat, lng, radius):
+                height = gantry[i]
+                if 0 < height < vehicle_height:
+                    continue
+
+                free = max(lots[i], 0)
+                score = (distance_weight - per_km * distance
+                         + lots_weight * free / (free + LOTS_HALF_SCORE)
+                         + type_weight * type_scores[type_codes[i]])
+
+                entry = (score, -distance, i)
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+
+            heap.sort(reverse=True)
+            results.append([(i, score, -negative_distance, lots[i]) for score, negative_distance, i in heap])
+        return results
@@ -0,0 +1,118 @@
+"""
+Carpark Search
+
+Evaluates the carpark list filters (distance, available lots, gantry height,
+carpark type and parking flags) on the backend, in one pass over the
+catalogue's column arrays.
+
+- Carpark types and parking flags are tested against precomputed bitmasks,
+  instead of comparing strings for every carpark.
+- Available lots are laid out as a column in catalogue order, rebuilt only when
+  the availability snapshot version changes.
+- A distance filter first narrows the candidates with the catalogue's spatial
+  index, so only nearby carparks are visited at all.
+- Only the requested page is ordered, using a bounded heap instead of a full sort.
+"""
+
+import heapq
+import threading
+from array import array
+
+SORT_KEYS = ("distance", "lots", "gantry", "carpark_no")
+
+
+class CarparkSearch:
+    """
+    Searches a CarparkCatalogue, using the lot counts of the latest availability snapshot.
+    """
+
+    def __init__(self, catalogue):
+        self.catalogue = catalogue
+        self._lock = threading.Lock()
+        self._lots = (None, array("i", bytes(4 * len(catalogue))))
+
+    def lots_column(self, snapshot):
+        """
+        Returns the available lots of every carpark in catalogue order,
+        with 0 for carparks missing from the snapshot (as the frontend does).
+
+        Parameters:
+        -snapshot: Snapshot, or None if availability is unknown
+
+        Returns:
+        -array('i')
+        """
+        version, column = self._lots
+        if snapshot is None or snapshot.version == version:
+            return column
+
+        with self._lock:
+            if self._lots[0] != snapshot.version:
+                lots = snapshot.lots
+                column = array("i", (lots.get(no, 0) for no in self.catalogue.carpark_no))
+                self._lots = (snapshot.version, column)
+            return self._lots[1]
+
+    def search(self, snapshot, lat=None, lng=None, radius=None, min_lots=0, min_gantry=0,
+               types=None, flags=0, sort="distance", descending=False, offset=0, limit=50):
+        """
+        Finds the carparks matching every filter, ordered and paged.
+
+        Parameters:
+        -snapshot: Snapshot (availability), or None
+        -lat, lng: float, the user's location, or None
+        -radius: float (km), only applies with a location
+        -min_lots: int
+        -min_gantry: float
+        -types: iterable of carpark type names, or None for any type
+        -flags: int, parking flag bits that must all be set
+        -sort: one of SORT_KEYS; distance falls back to carpark_no without a location
+        -descending: Boolean
+        -offset: int
+        -limit: int
+
+        Returns:
+        -(total, page): the number of matches, and a list of (position, distance in km or None, lots)
+        """
+        catalogue = self.catalogue
+        lots = self.lots_column(snapshot)
+        gantry = catalogue.gantry_height
+        type_bits = catalogue.type_bits
+        flag_bits = catalogue.flags
+        type_mask = None if types is None else catalogue.type_mask(types)
+
+        if lat is not None and lng is not None:
+            if radius is not None:
+                candidates = catalogue.nearby(lat, lng, radius)
+            else:
+                candidates = catalogue.nearby(lat, lng, k=len(catalogue))
+        else:
+            candidates = ((None, i) for i in range(len(catalogue)))
+
+        matches = []
+        for distance, i in candidates:
+            if (lots[i] >= min_lots
+                    and gantry[i] >= min_gantry
+                    and (type_mask is None or type_bits[i] & type_mask)
+                    and flag_bits[i] & flags == flags):
+                matches.append((distance, i))
+
+        total = len(matches)
+        wanted = offset + limit
+
+        if sort == "distance" and lat is not None and lng is not None:
+            # candidates from the spatial index are already nearest first
+            ordered = matches[::-1] if descending else matches
+            page = ordered[offset:wanted]
+        else:
+            if sort == "lots":
+                key = lambda match: lots[match[1]]
+            elif sort == "gantry":
+                key = lambda match: gantry[match[1]]
+            else:
+                key = lambda match: catalogue.carpark_no[match[1]]
+
+            select = heapq.nlargest if descending else heapq.nsmallest
+            page = select(wanted, matches, key=key)[offset:]
+
+        return total, [(i, distance, lots[i]) for distance, i in page]
@@ -0,0 +1,120 @@
+"""
+SQLite Connection Manager
+
+Keeps one long-lived sqlite3 connection per thread and database file, instead of
+opening a new connection for every query.
+
+Each connection is configured once when it is opened:
+- WAL journal mode, so readers are not blocked by a writer.
+- synchronous=NORMAL, which is safe under WAL and avoids an fsync per commit.
+- a larger page cache and memory-mapped I/O for the hot tables.
+- busy_timeout, so concurrent writers wait for the lock instead of failing.
+
+sqlite3 keeps a cache of compiled statements on every connection, keyed by the
+SQL text. Because the connections are long-lived, the queries in `acc_database`
+are only prepared once per thread and reused afterwards.
+
+A connection must not be used across fork(). Connections inherited by a forked
+child (eg. a server worker) are set aside unused, and the child opens its own.
+"""
+
+import os
+import sqlite3
+import threading
+
+# PRAGMA name and value, applied in order to every new connection
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("cache_size", -16000),      # negative value is in KiB, ie. ~16MB
+    ("mmap_size", 268435456),    # 256MB
+    ("busy_timeout", 5000),      # milliseconds
+    ("temp_store", "MEMORY"),
+)
+
+# number of compiled statements kept per connection
+STATEMENT_CACHE_SIZE = 256
+
+
+class ConnectionManager:
+    """
+    Hands out a long-lived connection for the calling thread.
+
+    Connections are never shared between threads. close_all() closes every
+    connection that has been handed out; threads will transparently reopen
+    a fresh connection on their next call to get().
+    """
+
+    def __init__(self, pragmas=PRAGMAS, cached_statements=STATEMENT_CACHE_SIZE):
+        self.pragmas = pragmas
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open_conns = []
+        self._inherited = []
+        self._generation = 0
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def get(self, path):
+        """
+        Returns the calling thread's connection to the database at path,
+        opening and configuring it on first use.
+
+        Parameters:
+        -path: str
+
+        Returns:
+        -sqlite3.Connection
+        """
+        local = self._local
+        if getattr(local, "generation", None) != self._generation:
+            local.conns = {}
+            local.generation = self._generation
+
+        conn = local.conns.get(path)
+        if conn is None:
+            conn = self._open(path)
+            local.conns[path] = conn
+        return conn
+
+    def _open(self, path):
+        # check_same_thread is disabled only so close_all() can close
+        # connections from another thread; each connection is still used
+        # by the thread that opened it
+        conn = sqlite3.connect(
+            path,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.row_factory = sqlite3.Row
+
+        for name, value in self.pragmas:
+            conn.execute(f"PRAGMA {name} = {value}")
+
+        with self._lock:
+            self._open_conns.append(conn)
+        return conn
+
+    def close_all(self):
+        """
+        Closes every connection opened by this manager.
+        """
+        with self._lock:
+            conns, self._open_conns = self._open_conns, []
+            self._generation += 1
+
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def _after_fork(self):
+        # the parent still owns these connections: keep them referenced so they are
+        # never closed (or used) from the child, and open fresh ones on demand
+        self._lock = threading.Lock()
+        self._inherited.extend(self._open_conns)
+        self._open_conns = []
+        self._generation += 1
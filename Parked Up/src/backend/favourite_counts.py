@@ -0,0 +1,44 @@
+"""
+Favourite Counts
+
+Recounts how many users favourited each carpark, for /carparks/popular and
+/carparks/<carpark_no>/favourites, from the Favourites table.
+
+The counts in FavouriteCounts are kept up to date by triggers on Favourites (see
+migration 3 in `migrations.py`), so every write through `acc_database` or
+`bulk_transfer.py` updates them in the same transaction. They can only drift if
+Favourites is changed in a way that skips the triggers, eg. by hand with
+REPLACE or with the triggers dropped. This rebuilds them from scratch, in one
+transaction, and reports how many carparks had a wrong count.
+
+The memory store (see `acc_store.py`) counts its favourites again whenever it
+loads a snapshot, so it needs no rebuild.
+
+Usage (from src/backend):
+    python favourite_counts.py [--db PATH]
+"""
+
+import argparse
+import time
+
+import acc_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=acc_database.dbpath)
+    args = parser.parse_args()
+
+    acc_database.dbpath = args.db
+    acc_database.init_db()
+
+    started = time.perf_counter()
+    drifted = acc_database.rebuild_favourite_counts()
+    print(f"Recounted favourites in {time.perf_counter() - started:.2f}s; "
+          f"{drifted} carparks had a wrong count")
+
+    acc_database.connections.close_all()
+
+
+if __name__ == "__main__":
+    main()
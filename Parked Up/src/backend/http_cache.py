@@ -0,0 +1,222 @@
+"""
+HTTP Response Caching
+
+Conditional GET and compression for the large, mostly unchanging read routes.
+
+- Every cached body gets a strong ETag, a hash of its bytes, so every worker process
+  gives the same ETag for the same data. A strong ETag must differ between the
+  content-codings of a body, so its compressed forms get the coding appended, eg.
+  "<hash>-gzip". A request whose If-None-Match names any form of the body (or whose
+  If-Modified-Since shows it already has the data) is answered with 304 Not Modified.
+- Bodies above MIN_COMPRESS_SIZE are compressed with brotli, if the `brotli` package
+  is installed and the client accepts it, or else gzip.
+- Versioned bodies (eg. the catalogue, an availability snapshot) are serialized,
+  hashed and compressed once per version and then served from memory.
+"""
+
+import email.utils
+import gzip
+import hashlib
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# bodies smaller than this are sent uncompressed; compressing them saves little
+MIN_COMPRESS_SIZE = 1024
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# the content-codings bodies may be compressed with
+ENCODINGS = ("br", "gzip")
+
+
+def make_etag(body):
+    """
+    Returns a strong ETag for body.
+
+    Parameters:
+    -body: bytes
+
+    Returns:
+    -str
+    """
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def http_date(timestamp):
+    """Formats a unix timestamp as an HTTP date, eg. for Last-Modified."""
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+
+def choose_encoding(accept_encoding):
+    """
+    Picks the compression to use for a client's Accept-Encoding header.
+
+    Parameters:
+    -accept_encoding: str
+
+    Returns:
+    -"br", "gzip", or None to send the body uncompressed
+    """
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, *params = part.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(coding.strip().lower())
+
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding):
+    """
+    Compresses body with the given encoding ("br" or "gzip").
+
+    Parameters:
+    -body: bytes
+    -encoding: str
+
+    Returns:
+    -bytes
+    """
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # mtime=0 keeps the output identical for identical input
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def is_fresh(headers, etag, last_modified=None):
+    """
+    Checks whether a client's cached copy, described by its conditional request headers,
+    is still current, in which case it should be sent 304 Not Modified.
+
+    Parameters:
+    -headers: mapping of request headers
+    -etag: str, or list of str for a body with several forms, any of which matches
+    -last_modified: float (unix seconds), or None
+
+    Returns:
+    -Boolean
+    """
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match is not None:
+        # If-Modified-Since is ignored when If-None-Match is present
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        etags = (etag,) if isinstance(etag, str) else etag
+        return "*" in tags or not tags.isdisjoint(etags)
+
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(last_modified) <= since
+
+    return False
+
+
+class EncodedBody:
+    """
+    A response body with its ETag, and its compressed forms, each made on first use.
+    """
+
+    def __init__(self, body, last_modified=None):
+        self.body = body
+        self.etag = make_etag(body)
+        self.last_modified = last_modified
+        self._encoded = {}
+
+    def content_coding(self, encoding):
+        """
+        Returns the content-coding the body is sent with when the client accepts encoding:
+        None for bodies below MIN_COMPRESS_SIZE, which are sent as they are.
+        """
+        if encoding is None or len(self.body) < MIN_COMPRESS_SIZE:
+            return None
+        return encoding
+
+    def etag_for(self, encoding):
+        """
+        Returns the ETag of the body sent with a content-coding (see content_coding), eg. "<hash>-gzip".
+
+        Parameters:
+        -encoding: str, or None for the plain body
+
+        Returns:
+        -str
+        """
+        if encoding is None:
+            return self.etag
+        return self.etag[:-1] + "-" + encoding + '"'
+
+    def etags(self):
+        """Returns the ETags of every form of the body, which all show the client has the current data."""
+        return [self.etag] + [self.etag_for(encoding) for encoding in ENCODINGS]
+
+    def encoded(self, encoding):
+        """
+        Returns the body compressed with encoding, or the plain body for None.
+
+        Parameters:
+        -encoding: str, or None
+
+        Returns:
+        -bytes
+        """
+        encoding = self.content_coding(encoding)
+        if encoding is None:
+            return self.body
+        data = self._encoded.get(encoding)
+        if data is None:
+            # two threads may both compress the first time; either result is the same
+            data = self._encoded[encoding] = compress(self.body, encoding)
+        return data
+
+
+class BodyCache:
+    """
+    Holds the latest EncodedBody of each key, eg. one per route, rebuilt only when its version changes.
+    """
+
+    def __init__(self):
+        self._entries = {}  # key -> (version, EncodedBody)
+        self._lock = threading.Lock()
+
+    def get(self, key, version, build, last_modified=None):
+        """
+        Returns the EncodedBody of key at version, calling build() to serialize it if needed.
+
+        Parameters:
+        -key: hashable
+        -version: hashable, changes whenever the data does
+        -build: callable returning bytes
+        -last_modified: float (unix seconds), or None
+
+        Returns:
+        -EncodedBody
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                entry = self._entries[key] = (version, EncodedBody(build(), last_modified))
+            return entry[1]
@@ -0,0 +1,118 @@
+"""
+LRU Cache
+
+A bounded, thread-safe, in-process cache with least-recently-used eviction and
+a time-to-live on every entry, used to keep hot database reads off the disk.
+
+Reads go through `get_or_load`, which only stores a freshly loaded value if no
+invalidation happened while it was being loaded. This stops a slow reader from
+putting back a value that a concurrent write has just invalidated.
+
+Each worker process has its own cache, so the TTL also bounds how long a
+process can serve a value changed through another process.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Maps keys to values, holding at most maxsize entries for at most ttl seconds each.
+    None is a valid cached value (eg. "no such account").
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, enabled=True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expiry time, value)
+        self._lock = threading.Lock()
+        self._epoch = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_load(self, key, loader, cacheable=lambda value: True):
+        """
+        Returns the cached value for key, or calls loader() on a miss and caches its result
+        if cacheable(result) is True.
+
+        Parameters:
+        -key: hashable
+        -loader: callable
+        -cacheable: callable
+
+        Returns:
+        -the cached or loaded value
+        """
+        if not self.enabled:
+            return loader()
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            epoch = self._epoch
+
+        value = loader()
+        if not cacheable(value):
+            return value
+
+        with self._lock:
+            # a write invalidated the cache while we were loading, so the value may be stale
+            if self._epoch != epoch:
+                return value
+
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, *keys):
+        """
+        Removes keys from the cache. Call after every write that changes their values.
+
+        Parameters:
+        -keys: hashable
+        """
+        with self._lock:
+            self._epoch += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Removes every entry from the cache.
+        """
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the size and hit/miss counters of the cache.
+
+        Returns:
+        -dict
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,334 @@
+"""
+Metrics
+
+Histograms and counters for the server, rendered in the Prometheus text format
+for the /metrics route.
+
+Recording is cheap enough to leave on in production: an observation is a bisect
+over the bucket bounds and two additions under a per-histogram lock, with no
+allocation once a label combination has been seen, about a microsecond each.
+Set METRICS_ENABLED=0 to turn recording off, eg. to measure its overhead with
+`python -m benchmarks.acc_database_ops`.
+
+Time spent in SQLite and in JSON serialization is also added up per request, on
+the request's thread, so the request histograms can split a slow request into
+database, serialization and everything else.
+
+Each process records its own metrics. With several worker processes, each one
+periodically writes a snapshot to a shared directory (METRICS_DIR), and /metrics
+adds up the snapshots of every worker, so a scrape sees the whole server no
+matter which worker answers it.
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+enabled = os.environ.get("METRICS_ENABLED", "1") != "0"
+
+# upper bounds of the latency buckets, in seconds: 100us to 10s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# upper bounds of the row count buckets
+ROW_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# seconds between the snapshots written to METRICS_DIR
+FLUSH_INTERVAL = 5
+
+
+class Histogram:
+    """
+    Counts observations into buckets with fixed upper bounds, plus their sum,
+    separately for every combination of label values.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [count per bucket..., count above the last bucket, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """
+        Records one observation.
+
+        Parameters:
+        -value: float
+        -label_values: str, one per label
+        """
+        if not enabled:
+            return
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            return [[list(key), list(values)] for key, values in self._series.items()]
+
+
+class Counter:
+    """
+    A total that only goes up, separately for every combination of label values.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._series = {}  # label values -> [total]
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        if not enabled:
+            return
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0]
+            series[0] += amount
+
+    def samples(self):
+        with self._lock:
+            return [[list(key), list(values)] for key, values in self._series.items()]
+
+
+class Collected:
+    """
+    Values read from elsewhere (eg. cache statistics) each time metrics are collected.
+    collect() returns a dict of label values (tuple) to the current value.
+    """
+
+    def __init__(self, name, kind, help, labels, collect):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def samples(self):
+        return [[list(key), [value]] for key, value in self.collect().items()]
+
+
+class Registry:
+    """
+    The metrics of one process.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def collected(self, name, kind, help, labels, collect):
+        return self._add(Collected(name, kind, help, labels, collect))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        """
+        Returns the current value of every metric as JSON-serializable data.
+
+        Returns:
+        -dict of metric name to its kind, help, labels, buckets and samples
+        """
+        return {
+            metric.name: {
+                "kind": metric.kind,
+                "help": metric.help,
+                "labels": list(metric.labels),
+                "buckets": list(getattr(metric, "buckets", ())),
+                "samples": metric.samples(),
+            }
+            for metric in self.metrics
+        }
+
+    def write(self, directory):
+        """
+        Writes this process's snapshot to directory, replacing its previous one.
+
+        Parameters:
+        -directory: str
+        """
+        path = snapshot_path(directory, os.getpid())
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    def render(self, directory=None):
+        """
+        Returns every metric in the Prometheus text format, added up over
+        the snapshots in directory if one is given.
+
+        Parameters:
+        -directory: str, or None for this process only
+
+        Returns:
+        -str
+        """
+        if directory is None:
+            return render(self.snapshot())
+
+        self.write(directory)
+        snapshots = []
+        for name in os.listdir(directory):
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(directory, name)) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    # the worker exited or is replacing its snapshot
+                    continue
+        return render(merge(snapshots))
+
+    def start_flushing(self, directory, interval=FLUSH_INTERVAL):
+        """
+        Writes this process's snapshot to directory every interval seconds, from a daemon thread.
+
+        Parameters:
+        -directory: str
+        -interval: float
+        """
+        def run():
+            while True:
+                try:
+                    self.write(directory)
+                except OSError as e:
+                    print(f"Error writing metrics: {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=run, name="metrics-flush", daemon=True).start()
+
+
+def snapshot_path(directory, pid):
+    return os.path.join(directory, f"metrics-{pid}.json")
+
+
+def merge(snapshots):
+    """
+    Adds up the samples of several snapshots, by metric and label values.
+
+    Parameters:
+    -snapshots: list of dict (from Registry.snapshot)
+
+    Returns:
+    -dict
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, dict(metric, samples={}))
+            for key, values in metric["samples"]:
+                key = tuple(key)
+                total = target["samples"].get(key)
+                if total is None:
+                    target["samples"][key] = list(values)
+                else:
+                    for i, value in enumerate(values):
+                        total[i] += value
+
+    for metric in merged.values():
+        metric["samples"] = [[list(key), values] for key, values in metric["samples"].items()]
+    return merged
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(snapshot):
+    """
+    Formats a snapshot in the Prometheus text exposition format.
+
+    Parameters:
+    -snapshot: dict (from Registry.snapshot or merge)
+
+    Returns:
+    -str
+    """
+    lines = []
+    for name, metric in snapshot.items():
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        labels = metric["labels"]
+
+        for key, values in sorted(metric["samples"]):
+            if metric["kind"] != "histogram":
+                lines.append(f"{name}{_labels(labels, key)} {_number(values[0])}")
+                continue
+
+            cumulative = 0
+            for bound, count in zip(metric["buckets"], values):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_labels(labels, key, le)} {cumulative}")
+            cumulative += values[-2]
+            le = 'le="+Inf"'
+            lines.append(f"{name}_bucket{_labels(labels, key, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels, key)} {_number(values[-1])}")
+            lines.append(f"{name}_count{_labels(labels, key)} {cumulative}")
+
+    return "\n".join(lines) + "\n"
+
+
+# time spent in SQLite and JSON serialization by the current request, per thread
+_request = threading.local()
+
+
+def start_request():
+    """Starts adding up the SQL and JSON time of the request on this thread."""
+    _request.times = {"sql": 0.0, "json": 0.0}
+
+
+def add_request_time(part, seconds):
+    """
+    Adds seconds to the part ("sql" or "json") of the request on this thread, if any.
+    """
+    times = getattr(_request, "times", None)
+    if times is not None:
+        times[part] += seconds
+
+
+def finish_request():
+    """
+    Stops adding up time for the request on this thread.
+
+    Returns:
+    -(sql seconds, json seconds)
+    """
+    times = getattr(_request, "times", None)
+    _request.times = None
+    return (0.0, 0.0) if times is None else (times["sql"], times["json"])
+
+
+registry = Registry()
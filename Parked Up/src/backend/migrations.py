@@ -0,0 +1,257 @@
+"""
+Schema Migrations for acc_database
+
+Keeps the schema of the account database up to date in place. Every migration
+has a version number, and the version a database file is at is stored in
+SQLite's `PRAGMA user_version` (0 for a database that has never been migrated).
+
+Pending migrations are applied in order, each in its own transaction together
+with the version bump, so a failed migration leaves the database at the last
+good version.
+
+To add a migration, append a new entry to MIGRATIONS with the next version
+number. Never edit a migration that has already been released.
+
+Usage:
+    python migrations.py [path/to/acc_database.db]
+"""
+
+import sqlite3
+import sys
+
+MIGRATIONS = [
+    (
+        1,
+        "create Accounts and Favourites tables",
+        [
+            '''
+            CREATE TABLE IF NOT EXISTS "Accounts" (
+                "username"	TEXT NOT NULL,
+                "email"	TEXT NOT NULL UNIQUE,
+                "phone_no"	INTEGER NOT NULL UNIQUE,
+                "password"	TEXT NOT NULL
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS "Favourites" (
+                "user_email"	TEXT,
+                "carpark_no"	TEXT,
+                FOREIGN KEY("user_email") REFERENCES "Accounts"("email")
+            )
+            ''',
+        ],
+    ),
+    (
+        2,
+        "key Favourites on (user_email, carpark_no), dropping duplicate rows",
+        [
+            # clustered on the composite key, so lookups by user_email are
+            # a range scan of the table itself
+            '''
+            CREATE TABLE "Favourites_v2" (
+                "user_email"	TEXT NOT NULL,
+                "carpark_no"	TEXT NOT NULL,
+                PRIMARY KEY("user_email", "carpark_no"),
+                FOREIGN KEY("user_email") REFERENCES "Accounts"("email")
+            ) WITHOUT ROWID
+            ''',
+            '''
+            INSERT OR IGNORE INTO "Favourites_v2" ("user_email", "carpark_no")
+            SELECT "user_email", "carpark_no" FROM "Favourites"
+            WHERE "user_email" IS NOT NULL AND "carpark_no" IS NOT NULL
+            ''',
+            'DROP TABLE "Favourites"',
+            'ALTER TABLE "Favourites_v2" RENAME TO "Favourites"',
+            # covering index for lookups by carpark
+            '''
+            CREATE INDEX IF NOT EXISTS "idx_favourites_carpark_no"
+            ON "Favourites" ("carpark_no", "user_email")
+            ''',
+        ],
+    ),
+    (
+        3,
+        "count favourites per carpark in FavouriteCounts, kept up to date by triggers",
+        [
+            # only carparks with at least one favourite have a row
+            '''
+            CREATE TABLE "FavouriteCounts" (
+                "carpark_no"	TEXT NOT NULL PRIMARY KEY,
+                "favourites"	INTEGER NOT NULL
+            ) WITHOUT ROWID
+            ''',
+            # the most favourited carparks are the first entries of the index
+            '''
+            CREATE INDEX "idx_favourite_counts_favourites"
+            ON "FavouriteCounts" ("favourites" DESC, "carpark_no")
+            ''',
+            '''
+            INSERT INTO "FavouriteCounts" ("carpark_no", "favourites")
+            SELECT "carpark_no", COUNT(*) FROM "Favourites"
+            GROUP BY "carpark_no"
+            ''',
+            # triggers do not fire for rows removed by REPLACE conflict resolution,
+            # so favourites must be deleted explicitly rather than replaced
+            '''
+            CREATE TRIGGER "favourites_count_insert" AFTER INSERT ON "Favourites"
+            BEGIN
+                INSERT INTO "FavouriteCounts" ("carpark_no", "favourites") VALUES (NEW."carpark_no", 1)
+                ON CONFLICT ("carpark_no") DO UPDATE SET "favourites" = "favourites" + 1;
+            END
+            ''',
+            '''
+            CREATE TRIGGER "favourites_count_delete" AFTER DELETE ON "Favourites"
+            BEGIN
+                UPDATE "FavouriteCounts" SET "favourites" = "favourites" - 1
+                WHERE "carpark_no" = OLD."carpark_no";
+                DELETE FROM "FavouriteCounts"
+                WHERE "carpark_no" = OLD."carpark_no" AND "favourites" <= 0;
+            END
+            ''',
+            '''
+            CREATE TRIGGER "favourites_count_update" AFTER UPDATE OF "carpark_no" ON "Favourites"
+            WHEN OLD."carpark_no" IS NOT NEW."carpark_no"
+            BEGIN
+                UPDATE "FavouriteCounts" SET "favourites" = "favourites" - 1
+                WHERE "carpark_no" = OLD."carpark_no";
+                DELETE FROM "FavouriteCounts"
+                WHERE "carpark_no" = OLD."carpark_no" AND "favourites" <= 0;
+                INSERT INTO "FavouriteCounts" ("carpark_no", "favourites") VALUES (NEW."carpark_no", 1)
+                ON CONFLICT ("carpark_no") DO UPDATE SET "favourites" = "favourites" + 1;
+            END
+            ''',
+        ],
+    ),
+    (
+        4,
+        "create AlertSubscriptions, with a version bumped by every change",
+        [
+            '''
+            CREATE TABLE "AlertSubscriptions" (
+                "id"	INTEGER PRIMARY KEY,
+                "user_email"	TEXT NOT NULL,
+                "carpark_no"	TEXT NOT NULL,
+                "direction"	TEXT NOT NULL CHECK ("direction" IN ('above', 'below')),
+                "lots"	INTEGER NOT NULL,
+                UNIQUE("user_email", "carpark_no", "direction", "lots")
+            )
+            ''',
+            # a single row, so the alert evaluator can tell cheaply whether to reload the subscriptions
+            'CREATE TABLE "AlertVersion" ("version" INTEGER NOT NULL)',
+            'INSERT INTO "AlertVersion" ("version") VALUES (0)',
+            '''
+            CREATE TRIGGER "alert_subscriptions_insert" AFTER INSERT ON "AlertSubscriptions"
+            BEGIN
+                UPDATE "AlertVersion" SET "version" = "version" + 1;
+            END
+            ''',
+            '''
+            CREATE TRIGGER "alert_subscriptions_update" AFTER UPDATE ON "AlertSubscriptions"
+            BEGIN
+                UPDATE "AlertVersion" SET "version" = "version" + 1;
+            END
+            ''',
+            '''
+            CREATE TRIGGER "alert_subscriptions_delete" AFTER DELETE ON "AlertSubscriptions"
+            BEGIN
+                UPDATE "AlertVersion" SET "version" = "version" + 1;
+            END
+            ''',
+        ],
+    ),
+    (
+        5,
+        "create SessionRevocations, so every worker process rejects revoked session tokens",
+        [
+            '''
+            CREATE TABLE "SessionRevocations" (
+                "email"	TEXT NOT NULL PRIMARY KEY,
+                "revoked_at"	REAL NOT NULL
+            ) WITHOUT ROWID
+            ''',
+        ],
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    """
+    Returns the schema version of the database.
+
+    Parameters:
+    -conn: sqlite3.Connection
+
+    Returns:
+    -int
+    """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def describe(version):
+    """
+    Returns the description of a migration.
+
+    Parameters:
+    -version: int
+
+    Returns:
+    -str
+    """
+    for v, description, _ in MIGRATIONS:
+        if v == version:
+            return description
+    return None
+
+
+def migrate(conn, target=LATEST_VERSION):
+    """
+    Applies all pending migrations up to and including target.
+    Returns the list of versions that were applied.
+
+    Parameters:
+    -conn: sqlite3.Connection
+    -target: int
+
+    Returns:
+    -applied: list
+    """
+    applied = []
+    current = get_version(conn)
+
+    for version, description, statements in MIGRATIONS:
+        if version <= current or version > target:
+            continue
+
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # another process may have applied it while this one waited for the write lock
+            if get_version(conn) >= version:
+                conn.commit()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+        applied.append(version)
+
+    return applied
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "./acc_database.db"
+
+    conn = sqlite3.connect(path)
+    try:
+        applied = migrate(conn)
+        for version in applied:
+            print(f"Applied migration {version}: {describe(version)}")
+        if not applied:
+            print(f"{path} is already at version {get_version(conn)}")
+    finally:
+        conn.close()
@@ -0,0 +1,119 @@
+"""
+Rate Limiting and Admission Control
+
+Keeps a single client from using up the server, and the server from queueing
+more writes than the account database can take.
+
+- TokenBuckets: a token bucket per key (eg. a client IP or an account's email).
+  Each request takes a token; tokens come back at `rate` per second, up to
+  `burst`. A request finding the bucket empty is refused, and told how long until
+  a token is back. Buckets are kept in least-recently-used order, and those idle
+  long enough to have refilled are dropped, since a full bucket is the same as
+  none. At most `max_keys` buckets are kept; past that the least recently used is
+  dropped even if it is not full, which can only let its key through sooner.
+- ConcurrencyLimit: a cap on how many requests of a kind run at once. Requests
+  over the cap are refused straight away rather than waiting, so the database
+  lock queue stays short and the client can retry later.
+
+Both are in-process: every worker process of `serve.py` has its own buckets and
+its own cap. The routes they apply to are configured in `server.py`.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+# buckets kept per TokenBuckets, about 100 bytes each
+MAX_KEYS = 100_000
+
+
+class TokenBuckets:
+    """
+    A token bucket per key, refilled at rate tokens per second up to burst tokens.
+    """
+
+    def __init__(self, rate, burst, max_keys=MAX_KEYS, clock=time.monotonic):
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate must be positive and burst at least 1")
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self.evictions = 0   # buckets dropped before they refilled
+        self._buckets = OrderedDict()  # key -> (tokens, time updated), least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key, tokens=1):
+        """
+        Takes tokens from key's bucket, if it has enough.
+
+        Parameters:
+        -key: hashable
+        -tokens: number of tokens the request costs
+
+        Returns:
+        -float, 0 if the tokens were taken, else the seconds until the bucket will have enough
+        """
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            available = self.burst if bucket is None else min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+
+            if available >= tokens:
+                available -= tokens
+                wait = 0.0
+            else:
+                wait = (tokens - available) / self.rate
+
+            self._buckets[key] = (available, now)
+            self._evict(now)
+        return wait
+
+    def _evict(self, now):
+        # call with the lock held
+        buckets = self._buckets
+        while buckets:
+            key, (available, updated) = next(iter(buckets.items()))
+            if available + (now - updated) * self.rate >= self.burst:
+                # refilled, so the same as no bucket
+                del buckets[key]
+            elif len(buckets) > self.max_keys:
+                del buckets[key]
+                self.evictions += 1
+            else:
+                break
+
+
+class ConcurrencyLimit:
+    """
+    Admits at most limit requests at a time, refusing the rest instead of queueing them.
+    """
+
+    def __init__(self, limit):
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        self.limit = limit
+        self.active = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Admits a request, if fewer than limit are running.
+
+        Returns:
+        -Boolean, True if admitted; the caller must then call release() when it is done
+        """
+        with self._lock:
+            if self.active >= self.limit:
+                self.rejected += 1
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
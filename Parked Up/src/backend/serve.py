@@ -0,0 +1,348 @@
+"""
+Production Server
+
+Serves the API with several worker processes, each handling requests on a fixed
+pool of threads, instead of the single-process Flask development server.
+
+The master process imports `server` once before forking, so migrations, the
+carpark catalogue, its indexes and the compiled validators are loaded a single
+time and shared copy-on-write by every worker. Each worker then starts its own
+availability poller and opens its own database connections. Only worker 0
+appends to the availability history, the others reading the same mapped file,
+and only worker 0 evaluates and sends availability alerts, so each is sent once.
+
+Signals (sent to the master):
+- HUP: graceful restart. A fresh set of workers is started, then the old ones
+  stop accepting connections and exit once their in-flight requests finish.
+- TERM / INT: graceful shutdown, with the same draining.
+- A worker that dies unexpectedly is replaced.
+
+Workers that have not finished draining after --graceful-timeout seconds are killed.
+
+With ACC_STORE=memory, accounts live in the worker process, so there must be a
+single worker. It loads the snapshot when it starts and writes one when it exits,
+and HUP stops the old worker before starting the new one, so no writes are lost
+in between (new connections wait in the listen backlog meanwhile). A worker that
+dies loses the writes made since the last periodic snapshot.
+
+A response can take over its connection through `environ["parked_up.detach"]`, so it
+stays open after the pool thread is done with it. /availability/stream uses this to
+keep event streams open without holding a thread each.
+
+Workers write their metrics to METRICS_DIR, so /metrics covers all of them; a
+temporary directory is used unless it is set.
+
+Set SESSION_SECRET in production; otherwise the secret generated by the master
+is shared by its workers but lost when the master restarts.
+
+With more than one worker, every worker must see every write straight away, so
+the per-process read caches of `acc_database` are turned off, and session
+revocations are recorded in the account database, where every worker checks
+them (see `session_tokens.py`).
+
+Usage (from src/backend):
+    python serve.py [--host 0.0.0.0] [--port 5000] [--workers N] [--threads N] [--graceful-timeout S]
+"""
+
+import argparse
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+import metrics
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+DEFAULT_THREADS = 8
+GRACEFUL_TIMEOUT = 30
+
+# seconds between checks of the workers and pending signals in the master
+POLL_INTERVAL = 0.2
+
+# a worker that exits sooner than this after starting is replaced only after a delay,
+# so a worker that cannot start does not make the master fork in a tight loop
+MIN_WORKER_LIFETIME = 1.0
+
+
+class RequestHandler(WSGIRequestHandler):
+    """
+    Closes the connection after every response. An idle keep-alive connection
+    would otherwise hold one of the worker's pool threads until the client leaves.
+    """
+
+    protocol_version = "HTTP/1.0"
+
+    def make_environ(self):
+        environ = super().make_environ()
+        environ["parked_up.detach"] = self.detach
+        return environ
+
+    def detach(self):
+        """
+        Takes the connection away from the server, so it is left open once the response is sent,
+        eg. to keep streaming events on it from another thread (see `availability_stream.py`).
+
+        Returns:
+        -socket.socket, which the caller must close
+        """
+        self.server.detached.add(self.request)
+        return self.request
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    Werkzeug WSGI server on an already listening socket, handling each connection
+    on a fixed pool of threads rather than a new thread per connection.
+    """
+
+    multithread = True
+
+    def __init__(self, sock, app, threads):
+        host, port = sock.getsockname()[:2]
+        super().__init__(host, port, app, handler=RequestHandler, fd=sock.fileno())
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="request")
+        self.detached = set()
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            if request in self.detached:
+                self.detached.discard(request)
+            else:
+                self.shutdown_request(request)
+
+
+def listen(host, port, backlog=2048):
+    """
+    Opens the listening socket shared by every worker.
+
+    Parameters:
+    -host: str
+    -port: int
+    -backlog: int
+
+    Returns:
+    -socket.socket
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def run_worker(server, sock, worker_id, threads):
+    """
+    Serves requests until the worker is sent SIGTERM, then finishes the requests in flight.
+    Runs in the forked worker process.
+    """
+    started = time.perf_counter()
+
+    # Ctrl-C reaches every process in the group; the master decides how to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    if not server.acc_database.store.shared:
+        # pick up the accounts saved by the worker this one replaces
+        server.acc_database.init_db()
+    app = server.create_app({"RECORD_HISTORY": worker_id == 0, "EVALUATE_ALERTS": worker_id == 0})
+    httpd = PooledWSGIServer(sock, app, threads)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return, so it cannot run on this thread
+        threading.Thread(target=httpd.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    print(f"Worker {worker_id} (pid {os.getpid()}) ready in {time.perf_counter() - started:.3f}s", flush=True)
+
+    httpd.serve_forever()
+
+    # stop writing history first, so a replacement worker 0 can take over straight away
+    server.availability.stop()
+    httpd.pool.shutdown(wait=True)
+    # stream clients reconnect to the other workers
+    server.stream.hub.stop()
+    server.history.close()
+    # sends the alerts already queued
+    server.alerts.delivery.stop()
+    # saves the memory store's snapshot
+    server.acc_database.store.close()
+
+
+class Master:
+    """
+    Forks the workers, replaces dead ones, and restarts or stops them on signals.
+    """
+
+    def __init__(self, server, sock, workers, threads, graceful_timeout, metrics_dir=None):
+        self.server = server
+        self.metrics_dir = metrics_dir
+        self.sock = sock
+        self.size = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.workers = {}   # pid -> (worker id, time started)
+        self.retiring = {}  # pid -> time by which it must have exited
+        self.restarting = False
+        self.stopping = False
+
+    def spawn(self, worker_id):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                run_worker(self.server, self.sock, worker_id, self.threads)
+                status = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)
+        self.workers[pid] = (worker_id, time.monotonic())
+
+    def retire(self, pids):
+        """Asks workers to finish their requests and exit."""
+        deadline = time.monotonic() + self.graceful_timeout
+        for pid in pids:
+            self.retiring[pid] = deadline
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def reap(self):
+        """Collects exited workers, replacing any that were not asked to exit."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            if self.metrics_dir:
+                # the worker's counters are gone with it
+                try:
+                    os.remove(metrics.snapshot_path(self.metrics_dir, pid))
+                except FileNotFoundError:
+                    pass
+
+            if self.retiring.pop(pid, None) is None and pid in self.workers:
+                worker_id, started = self.workers.pop(pid)
+                print(f"Worker {worker_id} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}, restarting it", flush=True)
+                if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                    time.sleep(MIN_WORKER_LIFETIME)
+                if not self.stopping:
+                    self.spawn(worker_id)
+
+    def kill_overdue(self):
+        now = time.monotonic()
+        for pid, deadline in self.retiring.items():
+            if deadline < now:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def run(self):
+        signal.signal(signal.SIGHUP, lambda signum, frame: setattr(self, "restarting", True))
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(self, "stopping", True))
+        signal.signal(signal.SIGINT, lambda signum, frame: setattr(self, "stopping", True))
+
+        for worker_id in range(self.size):
+            self.spawn(worker_id)
+
+        while not self.stopping:
+            if self.restarting:
+                self.restarting = False
+                print("Restarting workers", flush=True)
+                old, self.workers = list(self.workers), {}
+                if self.server.acc_database.store.shared:
+                    for worker_id in range(self.size):
+                        self.spawn(worker_id)
+                    self.retire(old)
+                else:
+                    # the old worker saves its account store on exit, and the new one loads it
+                    self.retire(old)
+                    self.wait_retired()
+                    for worker_id in range(self.size):
+                        self.spawn(worker_id)
+
+            self.reap()
+            self.kill_overdue()
+            time.sleep(POLL_INTERVAL)
+
+        print("Shutting down", flush=True)
+        self.retire(list(self.workers))
+        self.workers = {}
+        self.wait_retired()
+
+    def wait_retired(self):
+        """Waits for every retiring worker to exit, killing those that overrun."""
+        while self.retiring:
+            self.reap()
+            self.kill_overdue()
+            time.sleep(POLL_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.environ.get("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5000)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WORKERS", DEFAULT_WORKERS)))
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("THREADS", DEFAULT_THREADS)))
+    parser.add_argument("--graceful-timeout", type=float, default=GRACEFUL_TIMEOUT)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    sock = listen(args.host, args.port)
+
+    # let /metrics add up the metrics of every worker
+    metrics_dir = os.environ.get("METRICS_DIR")
+    created_metrics_dir = metrics_dir is None
+    if created_metrics_dir:
+        metrics_dir = os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="parked-up-metrics-")
+
+    # preload everything the workers share before forking them
+    import server
+    import acc_database
+    acc_database.connections.close_all()
+    if not acc_database.store.shared and args.workers > 1:
+        parser.error(f"ACC_STORE={server.app.config['ACC_STORE']} keeps accounts in each process, "
+                     f"so it needs --workers 1")
+    if args.workers > 1:
+        # a write through one worker cannot invalidate another worker's read caches,
+        # so every read goes to the shared database instead
+        acc_database.acc_cache.enabled = acc_database.favs_cache.enabled = False
+        # and a session revoked through one worker must be rejected by all of them
+        server.sessions.share_revocations(acc_database.revoke_sessions, acc_database.sessions_revoked_at)
+
+    phases = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in server.startup_timings.items())
+    print(f"Preloaded in {time.perf_counter() - started:.3f}s ({phases})", flush=True)
+    print(f"Listening on http://{args.host}:{args.port} with {args.workers} workers x {args.threads} threads", flush=True)
+
+    try:
+        Master(server, sock, args.workers, args.threads, args.graceful_timeout, metrics_dir).run()
+    finally:
+        if created_metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
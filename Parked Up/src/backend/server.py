@@ -20,7 +20,7 @@ Key Routes and Their Purpose:
 
 2. **POST /login**:
     - Authenticates a user using their email and password.
-    - If credentials are valid, it returns the user data.
+    - If credentials are valid, it returns the user data and a signed session token (see `session_tokens.py`).
     - Returns an error message if login fails due to invalid credentials.
 
 3. **GET /profile/<email>**:
@@ -29,7 +29,7 @@ Key Routes and Their Purpose:
 
 4. **DELETE /delete-account/<email>**:
     - Deletes the user account identified by the email.
-    - Deletes associated favourites before the account is removed.
+    - Deletes the account and its associated favourites in a single transaction.
     - Returns a success message or error message based on the result.
 
 5. **POST /update-profile**:
@@ -47,6 +47,127 @@ Key Routes and Their Purpose:
 8. **GET /favourites/<email>**:
     - Retrieves the list of carparks that the user has added to their favourites using their email.
     - Returns the list of favourites or an error message if no favourites are found.
+    - With `?expand=1`, each favourite is returned with its address, type, gantry height, coordinates
+      and current available lots, so the favourites page needs only this one request.
+
+9. **POST /favourites/batch**:
+    - Applies a list of `{"op": "add" | "remove", "carpark_no": ...}` operations to a user's favourites in one transaction.
+    - Returns the user's resulting list of favourites, so clients can sync many changes at once.
+
+10. **GET /carparks**:
+    - Returns every HDB carpark, with coordinates already converted to latitude and longitude.
+    - The carpark CSV is loaded and projected once at startup (see `carpark_catalogue.py`), or memory-mapped
+      from its compiled form if `python carpark_catalogue.py` has been run since the CSV last changed.
+
+11. **GET /carparks/nearby?lat=&lng=&radius=&k=**:
+    - Returns carparks near a point, sorted by distance (in km), using a spatial grid index.
+    - `radius` (km) limits the search distance and `k` limits the number of results; `k` defaults to 10 when no radius is given.
+
+12. **GET /availability**:
+    - Returns the number of available lots of every carpark, keyed by carpark number, with a snapshot version.
+    - Served from an in-memory snapshot that a background thread refreshes from data.gov.sg (see `carpark_availability.py`).
+
+13. **GET /history/<carpark_no>?start=&end=**:
+    - Returns the recorded available lots of a carpark between two unix timestamps (default: the last day).
+    - Every availability snapshot is appended to a memory-mapped history file (see `availability_history.py`).
+    - Carparks added to the catalogue later take one of the file's spare columns. Any that do not fit are
+      counted in /metrics (`availability_history_unrecorded_carparks`).
+
+14. **GET /history/<carpark_no>/aggregate?start=&end=&bucket=**:
+    - Returns the min/avg/max available lots of a carpark per time bucket (in seconds, default 3600).
+
+15. **GET /history/<carpark_no>/profile?start=&end=&bucket=&days=**:
+    - Returns the min/avg/max available lots of a carpark by time of day, e.g. "how full is it at 6pm on weekdays".
+    - `days` is `weekdays`, `weekends` or a comma separated list of days (0 = Monday); defaults to the last 28 days.
+
+16. **GET /carparks/search**:
+    - Filters carparks by distance (`lat`, `lng`, `radius`), `min_lots`, `min_gantry`, `types` (comma separated)
+      and the `free_parking`, `night_parking` and `short_term_parking` flags, in one pass over the catalogue columns.
+    - Results are ordered by `sort` (distance, lots, gantry or carpark_no) and `order` (asc or desc),
+      and paged with `page` and `page_size`.
+
+17. **GET /carparks/autocomplete?q=&k=**:
+    - Returns the top `k` (default 10) carparks whose address best matches a partially typed query.
+    - Backed by an inverted, prefix and trigram index over the addresses, built at startup (see `address_index.py`).
+
+18. **GET /stats/cache**:
+    - Returns the size and hit/miss counters of the account and favourites read caches.
+
+19. **GET /metrics**:
+    - Returns latency histograms per route (split into total, SQLite and JSON serialization time), per SQL query
+      and per transaction, rows per query, write lock waits and read cache counters, in the Prometheus text format.
+    - With several worker processes sharing `METRICS_DIR`, the metrics of every worker are added up (see `metrics.py`).
+
+20. **GET /carparks/rank?lat=&lng=&k=&radius=&vehicle_height=&types=**:
+    - Returns the best `k` (default 5) carparks within `radius` km (default 1) of a destination, scored on distance,
+      available lots and carpark type (`types` are preferred), leaving out gantries lower than `vehicle_height`.
+    - The parts of the score are weighted by `distance_weight`, `lots_weight` and `type_weight` (see `carpark_ranking.py`).
+
+21. **POST /carparks/rank/batch**:
+    - Ranks carparks near a list of `{"lat": ..., "lng": ...}` destinations in one request, eg. for fleet dispatch,
+      with the same options as `/carparks/rank` given in the JSON body. Returns one list of carparks per destination.
+
+22. **GET /availability/stream**:
+    - Streams availability as Server-Sent Events: a `snapshot` event with the lots of every carpark, then a `delta`
+      event with only the carparks whose lots changed, for every new snapshot (see `availability_stream.py`).
+    - A client reconnecting with `Last-Event-ID` (or `?last_event_id=`) is only sent the changes it missed.
+
+23. **GET /carparks/popular?n=&lat=&lng=&radius=**:
+    - Returns the `n` (default 10) carparks favourited by the most users, with their number of favourites,
+      overall, or within `radius` km (default 1) of `lat` and `lng` if they are given.
+
+24. **GET /carparks/<carpark_no>/favourites**:
+    - Returns how many users have favourited a carpark.
+
+25. **POST /alerts**:
+    - Subscribes a user to an alert for when a carpark's available lots go above or below a threshold,
+      eg. `{"email": ..., "carpark_no": ..., "direction": "below", "lots": 10}`. Returns the subscription.
+
+26. **GET /alerts/<email>**:
+    - Retrieves the user's alert subscriptions.
+
+27. **DELETE /alerts/<email>/<alert_id>**:
+    - Removes one of the user's alert subscriptions.
+
+Conditional Requests and Compression:
+-------------------------------------
+`/carparks`, `/availability`, `/profile/<email>` and `/favourites/<email>` send an `ETag` (a hash of the body,
+with `-gzip` or `-br` appended when it is compressed), and `/carparks` and `/availability` also send `Last-Modified`. A request with a matching `If-None-Match`
+(or a later `If-Modified-Since`) gets `304 Not Modified` and no body. The catalogue and availability bodies
+are serialized and compressed once per version (see `http_cache.py`). JSON responses over 1KB are compressed
+with brotli or gzip for clients that accept it.
+
+Session Tokens:
+---------------
+`/profile`, `/favourites`, `/add-favourite`, `/remove-favourite`, `/favourites/batch`, `/alerts`, `/update-profile`
+and `/delete-account` accept an `Authorization: Bearer <token>` header with the token issued by `/login`.
+The token is verified in memory, without a database lookup, and must belong to the account being accessed.
+Under `serve.py` with several workers, its revocation is also looked up in the account database, so that
+a token revoked through one worker is rejected by every worker.
+Requests without a token are still accepted unless `REQUIRE_SESSION_TOKENS=1` is set.
+
+Rate Limiting:
+--------------
+`/login`, `/signup`, `/update-profile`, `/delete-account` and the favourites and alerts write routes are rate limited
+with token buckets per client IP and per account email, configured in `RATE_LIMITS`. A client over its
+limit gets `429 Too Many Requests` with `Retry-After`. At most `MAX_CONCURRENT_WRITES` (default 4) write
+requests run at once in each worker process; further writes get `503` with `Retry-After` straight away,
+rather than queueing for the database's write lock (see `rate_limit.py`).
+
+Availability Alerts:
+--------------------
+Every new availability snapshot is checked against the alert subscriptions, looking only at the carparks whose
+lots changed, and at only the subscriptions whose threshold was crossed, through thresholds kept sorted per
+carpark (see `availability_alerts.py`). An alert fires when the lots cross the threshold, then not again for
+15 minutes. Fired alerts are queued and sent from a background thread; until push delivery exists, they are
+appended to `ALERTS_OUTBOX_PATH` as JSON lines. Only the process with `EVALUATE_ALERTS` set evaluates them.
+
+Running in Production:
+----------------------
+`python server.py` starts the single-process development server. In production, run `python serve.py`,
+which imports this module once, then forks worker processes that each serve requests on a pool of threads
+(see `serve.py`). Each worker configures the app through `create_app`. The time spent loading each part of
+this module is kept in `startup_timings`, and `python -m benchmarks.startup` tracks it.
 
 External Libraries Used:
 -------------------------
@@ -57,21 +178,386 @@ External Libraries Used:
 Database Operations:
 -------------------
 The server interacts with the database using the functions from the `acc_database` module, which handles:
-- User account creation and management (e.g., `find_acc`, `new_acc`, `update_details`, `delete_acc`).
+- User account creation and management (e.g., `find_acc`, `signup_acc`, `change_details`, `delete_acc`),
+  where compound operations run on one connection in a single transaction.
+- Read-through LRU caches in front of `find_acc` and `get_all_favs`, invalidated by every write.
 - Handling user favourites (e.g., `add_fav`, `delete_fav`, `get_all_favs`, `delete_all_favs`).
+- Favourite counts per carpark (`favourite_counts`, `most_favourited`), updated by every favourite write
+  rather than counted per request. `python favourite_counts.py` recounts them if they ever drift.
+- Availability alert subscriptions (`add_alert`, `delete_alert`, `get_alerts`), which move and go with the account.
+- Schema migrations, applied on startup through `init_db` (see `migrations.py`).
+- A choice of storage behind these functions, set with `ACC_STORE` (see `acc_store.py`): `sqlite`, the
+  database file (the default), or `memory`, dicts in the process snapshotted to `ACC_SNAPSHOT_PATH`
+  every `ACC_SNAPSHOT_SECONDS`, for a single process. `python store_conformance.py` checks both behave the same.
+- Bulk import and export of accounts and favourites in the database file as CSV or JSON Lines
+  (see `bulk_transfer.py`).
 
 """
 
-from flask import Flask, request, jsonify
+import atexit
+import heapq
+import math
+import os
+import secrets
+import time
+from contextlib import contextmanager
+from functools import partial
+
+from flask import Flask, Response, g, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import acc_database  # Import your database functions
+import acc_store
+import address_index
+import availability_alerts
+import availability_history
+import availability_stream
+import carpark_availability
+import carpark_catalogue
+import carpark_ranking
+import carpark_search
+import http_cache
+import metrics
+import rate_limit
+import session_tokens
+
+# seconds spent in each phase of loading this module, to track cold-start time
+startup_timings = {}
+_import_started = time.perf_counter()
+
+@contextmanager
+def startup_phase(name):
+    """records how long the enclosed block takes in startup_timings"""
+    start = time.perf_counter()
+    yield
+    startup_timings[name] = time.perf_counter() - start
 
 # Create a Flask application
 app = Flask(__name__)
+app.config.update(
+    # run the availability poller in this process
+    POLL_AVAILABILITY=True,
+    # append availability snapshots to the history file; only one process may do this
+    RECORD_HISTORY=True,
+    # check availability alerts against every snapshot and send them; only one process should do this
+    EVALUATE_ALERTS=True,
+    # directory shared by every worker process, so /metrics covers all of them
+    METRICS_DIR=os.environ.get("METRICS_DIR"),
+    # where accounts and favourites are kept: "sqlite" (the database file) or "memory" (see acc_store.py)
+    ACC_STORE=os.environ.get("ACC_STORE", "sqlite"),
+    # file the memory store is loaded from and snapshotted to, every ACC_SNAPSHOT_SECONDS
+    ACC_SNAPSHOT_PATH=os.environ.get("ACC_SNAPSHOT_PATH", "./acc_snapshot.json"),
+    ACC_SNAPSHOT_SECONDS=float(os.environ.get("ACC_SNAPSHOT_SECONDS", acc_store.SNAPSHOT_INTERVAL)),
+)
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, adding the time spent serializing responses to the request's metrics."""
+
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            metrics.add_request_time("json", time.perf_counter() - start)
+
+app.json = TimedJSONProvider(app)
+
+REQUEST_SECONDS = metrics.registry.histogram(
+    "http_request_duration_seconds", "Time spent handling a request.", ("method", "route", "status"))
+REQUEST_SQL_SECONDS = metrics.registry.histogram(
+    "http_request_sql_seconds", "Time spent in SQLite while handling a request.", ("method", "route"))
+REQUEST_JSON_SECONDS = metrics.registry.histogram(
+    "http_request_json_seconds", "Time spent serializing JSON while handling a request.", ("method", "route"))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.start_request()
+
+@app.after_request
+def record_request_time(response):
+    """
+    Records the latency of every request, by route pattern (eg. /profile/<email>) rather than by path.
+    """
+    started = g.get("request_started")
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        sql, json_time = metrics.finish_request()
+        REQUEST_SECONDS.observe(time.perf_counter() - started, request.method, route, str(response.status_code))
+        REQUEST_SQL_SECONDS.observe(sql, request.method, route)
+        REQUEST_JSON_SECONDS.observe(json_time, request.method, route)
+    return response
 
 # Enable CORS for all routes and methods, explicitly allowing frontend (localhost:3000)
 CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}})
 
+# Signed session tokens. Set SESSION_SECRET so tokens stay valid across restarts and processes.
+sessions = session_tokens.SessionTokens(
+    os.environ.get("SESSION_SECRET") or secrets.token_bytes(32),
+    ttl=int(os.environ.get("SESSION_TTL_SECONDS", session_tokens.DEFAULT_TTL)),
+)
+REQUIRE_SESSION_TOKENS = os.environ.get("REQUIRE_SESSION_TOKENS") == "1"
+
+# Pick the account store, then bring the database schema up to date (or load the snapshot)
+# before serving any requests
+if app.config["ACC_STORE"] == "memory":
+    acc_database.use_store(acc_store.MemoryStore(app.config["ACC_SNAPSHOT_PATH"]))
+elif app.config["ACC_STORE"] != "sqlite":
+    raise ValueError(f"ACC_STORE must be sqlite or memory, not {app.config['ACC_STORE']!r}")
+with startup_phase("migrations"):
+    acc_database.init_db()
+
+# Load the carpark catalogue once, so requests are served from memory
+with startup_phase("catalogue"):
+    catalogue = carpark_catalogue.load_catalogue()
+    catalogue_modified = os.path.getmtime(carpark_catalogue.CSV_PATH)
+with startup_phase("indexes"):
+    search_engine = carpark_search.CarparkSearch(catalogue)
+    ranker = carpark_ranking.CarparkRanker(search_engine)
+    addresses = address_index.AddressIndex(catalogue.address)
+
+# Poll carpark availability in the background and serve it from memory.
+# AVAILABILITY_URL can point at a file:// fixture or a stub server instead of data.gov.sg.
+availability = carpark_availability.AvailabilityCache(
+    fetch=partial(carpark_availability.fetch_json,
+                  os.environ.get("AVAILABILITY_URL", carpark_availability.AVAILABILITY_URL)),
+    interval=float(os.environ.get("AVAILABILITY_REFRESH_SECONDS", carpark_availability.REFRESH_INTERVAL)),
+)
+
+# Push the lots that change between snapshots to /availability/stream clients
+stream = availability_stream.AvailabilityStream()
+metrics.registry.collected(
+    "availability_stream_clients", "gauge", "Open /availability/stream connections.", (),
+    lambda: {(): len(stream.hub)})
+metrics.registry.collected(
+    "availability_stream_dropped_total", "counter", "Stream connections dropped for falling behind.", (),
+    lambda: {(): stream.hub.dropped})
+
+# Check the alert subscriptions against every new snapshot, sending the alerts that fire from a background thread.
+# Fired alerts are appended to ALERTS_OUTBOX_PATH, in place of push delivery.
+alerts = availability_alerts.AvailabilityAlerts(
+    acc_database.all_alerts,
+    acc_database.alerts_version,
+    availability_alerts.DeliveryQueue(
+        availability_alerts.OutboxSender(os.environ.get("ALERTS_OUTBOX_PATH", "./alerts_outbox.jsonl"))),
+)
+metrics.registry.collected(
+    "availability_alerts_fired_total", "counter", "Alerts whose threshold was crossed.", (),
+    lambda: {(): alerts.fired})
+metrics.registry.collected(
+    "availability_alerts_sent_total", "counter", "Fired alerts by what became of them.", ("result",),
+    lambda: {("delivered",): alerts.delivery.delivered, ("failed",): alerts.delivery.failed,
+             ("dropped",): alerts.delivery.dropped})
+metrics.registry.collected(
+    "availability_alerts_queued", "gauge", "Fired alerts waiting to be sent.", (),
+    lambda: {(): len(alerts.delivery)})
+metrics.registry.collected(
+    "availability_alert_subscriptions", "gauge", "Alert subscriptions being evaluated.", (),
+    lambda: {(): len(alerts.index)})
+
+# Record every availability snapshot for the history routes
+with startup_phase("history"):
+    history = availability_history.AvailabilityHistory(
+        os.environ.get("HISTORY_PATH", "./availability_history.bin"),
+        catalogue.carpark_no,
+    )
+metrics.registry.collected(
+    "availability_history_unrecorded_carparks", "gauge", "Carparks in snapshots with no room in the history file.", (),
+    lambda: {(): len(history.unrecorded)})
+
+startup_timings["total"] = time.perf_counter() - _import_started
+
+_services_started = False
+
+def create_app(config=None):
+    """
+    Returns the application, configured and ready to serve requests in this process.
+
+    Everything expensive (migrations, the catalogue and its indexes) is loaded when this
+    module is imported, so a server that imports it before forking workers shares that
+    state between them. Background threads cannot survive a fork, so the availability
+    poller is only started here, once per process.
+
+    Parameters:
+    -config: dict of app.config overrides, eg. {"RECORD_HISTORY": False}
+
+    Returns:
+    -Flask
+    """
+    global _services_started
+    if config:
+        app.config.update(config)
+
+    if not _services_started:
+        _services_started = True
+        availability.on_snapshot(stream.record)
+        stream.hub.start()
+        if app.config["RECORD_HISTORY"]:
+            availability.on_snapshot(history.record)
+        if app.config["EVALUATE_ALERTS"]:
+            alerts.delivery.start()
+            availability.on_snapshot(alerts.record)
+        if app.config["POLL_AVAILABILITY"]:
+            availability.start()
+        if app.config["METRICS_DIR"]:
+            metrics.registry.start_flushing(app.config["METRICS_DIR"])
+        if app.config["ACC_STORE"] == "memory":
+            acc_database.store.start_snapshots(app.config["ACC_SNAPSHOT_SECONDS"])
+
+    return app
+
+# serialized, hashed and compressed bodies of the versioned read routes
+response_cache = http_cache.BodyCache()
+
+def cached_response(encoded, private=False):
+    """
+    Builds the response for an EncodedBody: 304 Not Modified if the client's copy is current,
+    else the body, compressed if the client accepts it.
+    """
+    encoding = encoded.content_coding(http_cache.choose_encoding(request.headers.get("Accept-Encoding", "")))
+    headers = {
+        # each content-coding of the body has its own ETag
+        "ETag": encoded.etag_for(encoding),
+        # clients may keep the body, but must revalidate it before each use
+        "Cache-Control": "private, no-cache" if private else "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    if encoded.last_modified is not None:
+        headers["Last-Modified"] = http_cache.http_date(encoded.last_modified)
+
+    # a copy in any coding is still current
+    if http_cache.is_fresh(request.headers, encoded.etags(), encoded.last_modified):
+        return Response(status=304, headers=headers)
+
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(encoded.encoded(encoding), status=200, mimetype="application/json", headers=headers)
+
+def json_bytes(payload):
+    return app.json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+@app.after_request
+def compress_response(response):
+    """
+    Compresses other large JSON responses (eg. search results) for clients that accept it.
+    """
+    if (response.status_code == 200 and response.mimetype == "application/json"
+            and not response.is_streamed and "Content-Encoding" not in response.headers):
+        data = response.get_data()
+        if len(data) >= http_cache.MIN_COMPRESS_SIZE:
+            encoding = http_cache.choose_encoding(request.headers.get("Accept-Encoding", ""))
+            if encoding is not None:
+                response.set_data(http_cache.compress(data, encoding))
+                response.headers["Content-Encoding"] = encoding
+            response.vary.add("Accept-Encoding")
+    return response
+
+def check_session(email):
+    """
+    Verifies the request's session token, if any, against the account being accessed.
+
+    Returns:
+        - None if the request may proceed.
+        - an error response if the token is missing (when required), invalid, expired,
+          revoked, or belongs to another account.
+    """
+    header = request.headers.get("Authorization", "")
+    if not header.startswith("Bearer "):
+        if REQUIRE_SESSION_TOKENS:
+            return jsonify({"success": False, "message": "Login required!"}), 401
+        return None
+
+    token_email = sessions.verify(header[len("Bearer "):])
+    if token_email is None:
+        return jsonify({"success": False, "message": "Session is invalid or has expired!"}), 401
+    if token_email != email:
+        return jsonify({"success": False, "message": "Session does not belong to this account!"}), 403
+    return None
+
+# Token buckets per route, as (requests per second, burst), keyed by the client's IP and by the
+# email of the account the request is for. Routes are named by their view function. A request over
+# either limit gets 429 Too Many Requests with Retry-After. Set RATE_LIMITING=0 to turn them off.
+RATE_LIMITS = {
+    "login": {"ip": (2, 20), "email": (0.2, 10)},
+    "signup": {"ip": (0.1, 5)},
+    "update_profile": {"ip": (1, 10), "email": (0.1, 5)},
+    "delete_account": {"ip": (0.1, 5)},
+    "add_favourite": {"ip": (10, 50), "email": (5, 30)},
+    "remove_favourite": {"ip": (10, 50), "email": (5, 30)},
+    "batch_favourites": {"ip": (2, 20), "email": (1, 10)},
+    "add_alert": {"ip": (5, 30), "email": (1, 10)},
+    "delete_alert": {"ip": (10, 50), "email": (5, 30)},
+}
+RATE_LIMITING = os.environ.get("RATE_LIMITING", "1") != "0"
+rate_limiters = {
+    (route, key): rate_limit.TokenBuckets(rate, burst)
+    for route, limits in RATE_LIMITS.items()
+    for key, (rate, burst) in limits.items()
+}
+
+# Routes that write to the account database. At most MAX_CONCURRENT_WRITES of them run at once in
+# each worker; others get 503 with Retry-After, instead of queueing for the database's write lock.
+WRITE_ROUTES = {"signup", "update_profile", "delete_account", "add_favourite", "remove_favourite", "batch_favourites",
+                "add_alert", "delete_alert"}
+write_slots = rate_limit.ConcurrencyLimit(int(os.environ.get("MAX_CONCURRENT_WRITES", 4)))
+
+REJECTED_REQUESTS = metrics.registry.counter(
+    "http_requests_rejected_total", "Requests refused by rate limits or the write concurrency cap.",
+    ("route", "reason"))
+metrics.registry.collected(
+    "http_writes_in_progress", "gauge", "Write requests running in this process.", (),
+    lambda: {(): write_slots.active})
+
+def _request_email():
+    """the email of the account a request is for, from the URL or the JSON body, or None"""
+    email = (request.view_args or {}).get("email")
+    if email is None:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            email = data.get("old_email") or data.get("email")
+    return email if isinstance(email, str) else None
+
+def _retry_later(message, status, wait):
+    response = jsonify({"success": False, "message": message})
+    response.headers["Retry-After"] = str(max(1, math.ceil(wait)))
+    return response, status
+
+@app.before_request
+def admit_request():
+    """
+    Refuses requests over their route's rate limits, and writes over the concurrency cap,
+    before they reach the database.
+
+    Returns:
+        - None if the request may proceed.
+        - 429 (rate limited) or 503 (too many writes) with Retry-After otherwise.
+    """
+    if request.method == "OPTIONS":
+        return None
+
+    route = request.endpoint
+    if RATE_LIMITING and route in RATE_LIMITS:
+        for kind, key in (("ip", request.remote_addr), ("email", _request_email())):
+            buckets = rate_limiters.get((route, kind))
+            if buckets is None or key is None:
+                continue
+            wait = buckets.take(key)
+            if wait:
+                REJECTED_REQUESTS.inc(1, route, "rate_limit")
+                return _retry_later("Too many requests, please try again later!", 429, wait)
+
+    if route in WRITE_ROUTES:
+        if not write_slots.acquire():
+            REJECTED_REQUESTS.inc(1, route, "write_capacity")
+            return _retry_later("Server is busy, please try again later!", 503, 1)
+        g.write_slot = True
+    return None
+
+@app.teardown_request
+def release_write_slot(exc):
+    if g.pop("write_slot", False):
+        write_slots.release()
+
 @app.route("/signup", methods=["POST"])
 def signup():
     """
@@ -89,13 +575,13 @@ def signup():
     phone_no = data.get("phone_no")
     password = data.get("password")
 
-    # Check if user already exists
-    if acc_database.find_acc(email):
-        return jsonify({"success": False, "message": "Email already exists!"}), 400
+    # Create new user account, unless the email already exists
+    result = acc_database.signup_acc(username, email, phone_no, password)
 
-    # Create new user account
-    if acc_database.new_acc(username, email, phone_no, password):
+    if result == acc_database.OK:
         return jsonify({"success": True, "message": "Account created successfully!"}), 200
+    elif result == acc_database.EMAIL_IN_USE:
+        return jsonify({"success": False, "message": "Email already exists!"}), 400
     else:
         return jsonify({"success": False, "message": "Failed to create account!"}), 500
 
@@ -106,7 +592,7 @@ def login():
     Authenticates a user using their email and password.
 
     Returns:
-        - success message along with user data if login is successful.
+        - success message along with user data and a session token if login is successful.
         - error message if credentials are invalid.
     """
     data = request.get_json()
@@ -119,6 +605,7 @@ def login():
         return jsonify({
             'success': True,
             'user': user,  # Send the user object back
+            'token': sessions.issue(email),
         })
     else:
         return jsonify({'success': False, 'message': 'Invalid email or password'}), 401
@@ -133,9 +620,13 @@ def get_profile(email):
         - success message with user data if found.
         - error message if user not found.
     """
+    denied = check_session(email)
+    if denied:
+        return denied
+
     user_data = acc_database.find_acc(email)
     if user_data:
-        return jsonify({"success": True, "user": user_data}), 200
+        return cached_response(http_cache.EncodedBody(json_bytes({"success": True, "user": user_data})), private=True)
     else:
         return jsonify({"success": False, "message": "User not found."}), 404
 
@@ -149,16 +640,18 @@ def delete_account(email):
         - success message if the account is successfully deleted.
         - error message if user not found or deletion fails.
     """
-    user = acc_database.find_acc(email)
+    denied = check_session(email)
+    if denied:
+        return denied
 
-    if not user:
-        return jsonify({"success": False, "message": "User not found!"}), 404
+    # Delete account and favourites in one transaction
+    result = acc_database.delete_acc(email)
 
-    # Delete favourites first to avoid foreign key constraints
-    acc_database.delete_all_favs(email)
-
-    # Delete account
-    if acc_database.delete_acc(email):
+    if result is None:
+        return jsonify({"success": False, "message": "User not found!"}), 404
+    elif result:
+        # the account is gone, so reject its outstanding sessions
+        sessions.revoke(email)
         return jsonify({"success": True, "message": "Account deleted successfully!"}), 200
     else:
         return jsonify({"success": False, "message": "Failed to delete account!"}), 500
@@ -181,19 +674,9 @@ def update_profile():
     new_password = data.get("password")
     current_password = data.get("current_password")
 
-    # Check if old email exists
-    user = acc_database.find_acc(old_email)
-
-    if not user:
-        return jsonify({"success": False, "message": "User not found!"}), 404
-
-    # Verify if the current_password matches the stored password
-    if user["password"] != current_password:
-        return jsonify({"success": False, "message": "Current password is incorrect!"}), 401
-
-    # If email is changed, ensure the new email isn't already taken
-    if old_email != new_email and acc_database.find_acc(new_email):
-        return jsonify({"success": False, "message": "Email already in use!"}), 400
+    denied = check_session(old_email)
+    if denied:
+        return denied
 
     # Prepare updated data
     updated_data = {
@@ -203,14 +686,26 @@ def update_profile():
         "password": new_password if len(new_password) > 0 else current_password
     }
 
-    # Update in the database (Accounts table and Favourites table)
-    if acc_database.update_details(old_email, updated_data):
+    # Check the account and current password, then update the Accounts and Favourites
+    # tables, all in one transaction
+    result = acc_database.change_details(old_email, current_password, updated_data)
+
+    if result == acc_database.NOT_FOUND:
+        return jsonify({"success": False, "message": "User not found!"}), 404
+    elif result == acc_database.WRONG_PASSWORD:
+        return jsonify({"success": False, "message": "Current password is incorrect!"}), 401
+    elif result == acc_database.EMAIL_IN_USE:
+        return jsonify({"success": False, "message": "Email already in use!"}), 400
+    elif result == acc_database.OK:
+        # the email or password may have changed, so replace the account's sessions
+        sessions.revoke(old_email)
         return jsonify({
             "success": True,
             "message": "Profile updated successfully!",
             "email": new_email,
             "username": new_username,
-            "phone_no": new_phone_no
+            "phone_no": new_phone_no,
+            "token": sessions.issue(new_email)
         }), 200  # Successful update response
     else:
         return jsonify({"success": False, "message": "Failed to update profile!"}), 500
@@ -229,6 +724,10 @@ def add_favourite():
     email = data.get("email")
     carpark_no = data.get("carpark_no")
 
+    denied = check_session(email)
+    if denied:
+        return denied
+
     # Add to favourites table in database
     if acc_database.add_fav(email, carpark_no):
         return jsonify({"success": True, "message": "Carpark added to favourites!"}), 200
@@ -249,30 +748,678 @@ def remove_favourite():
     email = data.get("email")
     carpark_no = data.get("carpark_no")
 
+    denied = check_session(email)
+    if denied:
+        return denied
+
     # Remove from favourites table in database
     if acc_database.delete_fav(email, carpark_no):
         return jsonify({"success": True, "message": "Carpark removed from favourites!"}), 200
     else:
         return jsonify({"success": False, "message": "Failed to remove from favourites!"}), 500
 
+def _expand_favourites(carpark_nos):
+    """
+    Joins favourite carpark numbers with their catalogue records and current available lots,
+    through the catalogue's and the availability snapshot's keyed lookups.
+    Carparks missing from the catalogue only carry their number and lots.
+    """
+    records = catalogue.records()
+    snapshot = availability.current()
+
+    expanded = []
+    for carpark_no in carpark_nos:
+        i = catalogue.find(carpark_no)
+        record = {"carparkNumber": carpark_no} if i is None else dict(records[i])
+        record["availableLots"] = None if snapshot is None else snapshot.lots.get(carpark_no, 0)
+        expanded.append(record)
+    return expanded
+
 @app.route("/favourites/<email>", methods=["GET"])
 def get_favourites(email):
     """
     Get Favourites Route:
     Retrieves a list of carparks that the user has added to their favourites.
 
+    With ?expand=1, each favourite is joined with its carpark details and current available lots.
+
     Returns:
         - success message with the list of favourites.
         - error message if no favourites are found.
     """
+    denied = check_session(email)
+    if denied:
+        return denied
+
     favs = acc_database.get_all_favs(email)
     if favs is not None:
-        return jsonify({"success": True, "favourites": favs}), 200
+        if request.args.get("expand", "").lower() in ("1", "true", "yes"):
+            favs = _expand_favourites(favs)
+        return cached_response(http_cache.EncodedBody(json_bytes({"success": True, "favourites": favs})), private=True)
     else:
         return jsonify({"success": False, "message": "No favourites found!"}), 404
 
+# largest number of operations accepted by /favourites/batch
+MAX_BATCH_OPERATIONS = 1000
+
+@app.route("/favourites/batch", methods=["POST"])
+def batch_favourites():
+    """
+    Batch Favourites Route:
+    Adds and removes several carparks from the user's favourites list in a single transaction.
+
+    Returns:
+        - success message with the user's resulting list of favourites.
+        - error message if the operations are invalid or could not be applied.
+    """
+    data = request.json
+    email = data.get("email")
+    operations = data.get("operations")
+
+    if not email or not isinstance(operations, list) or len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({"success": False, "message": f"email and a list of at most {MAX_BATCH_OPERATIONS} operations are required!"}), 400
+    if not all(isinstance(operation, dict) for operation in operations):
+        return jsonify({"success": False, "message": "Invalid favourite operations!"}), 400
+
+    denied = check_session(email)
+    if denied:
+        return denied
+
+    favs = acc_database.apply_fav_changes(email, operations)
+    if favs is False:
+        return jsonify({"success": False, "message": "Failed to update favourites!"}), 500
+
+    return jsonify({"success": True, "favourites": favs}), 200
+
+@app.route("/carparks", methods=["GET"])
+def get_carparks():
+    """
+    Get Carparks Route:
+    Retrieves every carpark in the catalogue, with WGS84 coordinates.
+
+    Returns:
+        - success message with the list of carparks.
+    """
+    encoded = response_cache.get(
+        "carparks", None, lambda: json_bytes({"success": True, "carparks": catalogue.records()}),
+        last_modified=catalogue_modified,
+    )
+    return cached_response(encoded)
+
+def _valid_location(lat, lng):
+    """checks that lat and lng are finite and on the earth; nan and infinity would break the grid index"""
+    return math.isfinite(lat) and math.isfinite(lng) and -90 <= lat <= 90 and -180 <= lng <= 180
+
+@app.route("/carparks/nearby", methods=["GET"])
+def get_nearby_carparks():
+    """
+    Get Nearby Carparks Route:
+    Retrieves the carparks nearest to the given latitude and longitude.
+
+    Returns:
+        - success message with the list of carparks, each with its distance in km, nearest first.
+        - error message if the query parameters are missing or invalid.
+    """
+    lat = request.args.get("lat", type=float)
+    lng = request.args.get("lng", type=float)
+    radius = request.args.get("radius", type=float)
+    k = request.args.get("k", type=int)
+
+    if lat is None or lng is None:
+        return jsonify({"success": False, "message": "lat and lng are required!"}), 400
+    if not _valid_location(lat, lng):
+        return jsonify({"success": False, "message": "lat and lng must be a valid location!"}), 400
+    if (radius is not None and (not math.isfinite(radius) or radius < 0)) or (k is not None and k < 1):
+        return jsonify({"success": False, "message": "radius and k must be positive!"}), 400
+
+    if radius is None and k is None:
+        k = 10
+
+    records = catalogue.records()
+    carparks = [dict(records[i], distance=distance) for distance, i in catalogue.nearby(lat, lng, radius, k)]
+    return jsonify({"success": True, "carparks": carparks}), 200
+
+@app.route("/availability", methods=["GET"])
+def get_availability():
+    """
+    Get Availability Route:
+    Retrieves the latest number of available lots of every carpark.
+
+    Returns:
+        - success message with the availability snapshot (version, upstream timestamp and lots by carpark number).
+        - error message if availability could not be fetched.
+    """
+    # the background thread keeps the snapshot fresh; only refresh here if it has fallen behind
+    snapshot = availability.current(max_age=2 * availability.interval)
+    if snapshot is None:
+        return jsonify({"success": False, "message": "Carpark availability is unavailable!"}), 503
+
+    encoded = response_cache.get(
+        "availability", (snapshot.version, snapshot.updated_at),
+        lambda: json_bytes({
+            "success": True,
+            "version": snapshot.version,
+            "updated_at": snapshot.updated_at,
+            "availability": snapshot.lots,
+        }),
+        last_modified=snapshot.fetched_at,
+    )
+    return cached_response(encoded)
+
+@app.route("/availability/stream", methods=["GET"])
+def stream_availability():
+    """
+    Availability Stream Route:
+    Streams availability as Server-Sent Events: the lots of every carpark, or the changes a client
+    missed since the event id in Last-Event-ID (or ?last_event_id=), then the changes of each new snapshot.
+
+    Returns:
+        - an event stream of `snapshot` and `delta` events.
+        - error message if the server has no room for another stream.
+    """
+    if stream.hub.full():
+        return jsonify({"success": False, "message": "Too many open streams, try again later!"}), 503
+
+    # makes sure there is a snapshot, as /availability does
+    availability.current(max_age=2 * availability.interval)
+
+    since = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    # serve.py lets the response hand its connection over to the stream's hub
+    detach = request.environ.get("parked_up.detach") if request.method == "GET" else None
+    return Response(
+        availability_stream.EventStream(stream, since, detach),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# largest page a client can request from /carparks/search
+MAX_PAGE_SIZE = 500
+
+@app.route("/carparks/search", methods=["GET"])
+def search_carparks():
+    """
+    Search Carparks Route:
+    Retrieves the carparks matching the list view filters, ordered and paged.
+
+    Returns:
+        - success message with the total number of matches and the requested page of carparks,
+          each with its available lots and distance in km (null without a location).
+        - error message if the query parameters are invalid.
+    """
+    args = request.args
+    lat = args.get("lat", type=float)
+    lng = args.get("lng", type=float)
+    radius = args.get("radius", type=float)
+    sort = args.get("sort", "distance")
+    order = args.get("order", "asc")
+    page = args.get("page", default=1, type=int)
+    page_size = args.get("page_size", default=50, type=int)
+    # an empty selection (eg. ?types=) means any type
+    types = [name.strip() for name in args.get("types", "").split(",") if name.strip()] or None
+
+    if sort not in carpark_search.SORT_KEYS or order not in ("asc", "desc"):
+        return jsonify({"success": False, "message": "Invalid sort order!"}), 400
+    if page < 1 or page_size < 1 or page_size > MAX_PAGE_SIZE:
+        return jsonify({"success": False, "message": f"page must be positive and page_size between 1 and {MAX_PAGE_SIZE}!"}), 400
+    if lat is not None and lng is not None and not _valid_location(lat, lng):
+        return jsonify({"success": False, "message": "lat and lng must be a valid location!"}), 400
+    if radius is not None and not math.isfinite(radius):
+        return jsonify({"success": False, "message": "radius must be a finite number!"}), 400
+
+    flags = 0
+    for name, bit in (("free_parking", carpark_catalogue.FREE_PARKING),
+                      ("night_parking", carpark_catalogue.NIGHT_PARKING),
+                      ("short_term_parking", carpark_catalogue.SHORT_TERM_PARKING)):
+        if args.get(name, "").lower() in ("1", "true", "yes"):
+            flags |= bit
+
+    total, matches = search_engine.search(
+        availability.current(),
+        lat=lat,
+        lng=lng,
+        radius=radius,
+        min_lots=args.get("min_lots", default=0, type=int),
+        min_gantry=args.get("min_gantry", default=0, type=float),
+        types=types,
+        flags=flags,
+        sort=sort,
+        descending=order == "desc",
+        offset=(page - 1) * page_size,
+        limit=page_size,
+    )
+
+    records = catalogue.records()
+    carparks = [dict(records[i], availableLots=lots, distance=distance) for i, distance, lots in matches]
+    return jsonify({
+        "success": True,
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "carparks": carparks,
+    }), 200
+
+# largest number of suggestions a client can request from /carparks/autocomplete
+MAX_SUGGESTIONS = 50
+
+@app.route("/carparks/autocomplete", methods=["GET"])
+def autocomplete_carparks():
+    """
+    Autocomplete Carparks Route:
+    Suggests carparks whose address matches a partially typed query, tolerating small typos.
+
+    Returns:
+        - success message with the best matching carparks, best first, each with its match score.
+        - error message if k is invalid.
+    """
+    query = request.args.get("q", "")
+    k = request.args.get("k", default=10, type=int)
+
+    if k < 1 or k > MAX_SUGGESTIONS:
+        return jsonify({"success": False, "message": f"k must be between 1 and {MAX_SUGGESTIONS}!"}), 400
+
+    records = catalogue.records()
+    carparks = [dict(records[i], score=score) for i, score in addresses.search(query, k)]
+    return jsonify({"success": True, "carparks": carparks}), 200
+
+# largest k and radius (km) a client can request from the ranking routes
+MAX_RANK_K = 50
+MAX_RANK_RADIUS = 5.0
+# most destinations in one /carparks/rank/batch request
+MAX_RANK_DESTINATIONS = 200
+
+def _number(values, name, default=None):
+    """reads a number from request args or a JSON body; returns None if it is not a finite number"""
+    value = values.get(name, default)
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+def _ranking_options(values):
+    """
+    Reads the options shared by the ranking routes from request args or a JSON body.
+
+    Returns:
+    -(options, None): keyword arguments for CarparkRanker.rank
+    -(None, error response) if an option is invalid
+    """
+    k = _number(values, "k", 5)
+    radius = _number(values, "radius", 1.0)
+    vehicle_height = _number(values, "vehicle_height", 0.0)
+    weights = {name: _number(values, f"{name}_weight", default)
+               for name, default in carpark_ranking.DEFAULT_WEIGHTS.items()}
+
+    if k is None or not k.is_integer() or not 1 <= k <= MAX_RANK_K:
+        return None, (jsonify({"success": False, "message": f"k must be between 1 and {MAX_RANK_K}!"}), 400)
+    if radius is None or not 0 < radius <= MAX_RANK_RADIUS:
+        return None, (jsonify({"success": False, "message": f"radius must be more than 0 and at most {MAX_RANK_RADIUS}!"}), 400)
+    if vehicle_height is None or vehicle_height < 0:
+        return None, (jsonify({"success": False, "message": "vehicle_height must not be negative!"}), 400)
+    if any(weight is None or weight < 0 for weight in weights.values()) or sum(weights.values()) <= 0:
+        return None, (jsonify({"success": False, "message": "Weights must not be negative, and not all 0!"}), 400)
+
+    types = values.get("types")
+    if isinstance(types, str):
+        # as in /carparks/search, an empty selection means no preference
+        types = [name.strip() for name in types.split(",") if name.strip()] or None
+    elif types is not None and not isinstance(types, list):
+        return None, (jsonify({"success": False, "message": "types must be a list of carpark types!"}), 400)
+
+    return {"k": int(k), "radius": radius, "vehicle_height": vehicle_height,
+            "types": types, "weights": weights}, None
+
+def _ranked_carparks(ranked):
+    records = catalogue.records()
+    return [dict(records[i], availableLots=lots, distance=distance, score=score)
+            for i, score, distance, lots in ranked]
+
+@app.route("/carparks/rank", methods=["GET"])
+def rank_carparks():
+    """
+    Rank Carparks Route:
+    Retrieves the best carparks to park at near a destination, scored on distance,
+    available lots and carpark type, leaving out carparks too low for the vehicle.
+
+    Returns:
+        - success message with the top k carparks, best first, each with its score,
+          available lots and distance in km.
+        - error message if the query parameters are missing or invalid.
+    """
+    lat = _number(request.args, "lat")
+    lng = _number(request.args, "lng")
+    if lat is None or lng is None:
+        return jsonify({"success": False, "message": "lat and lng are required!"}), 400
+    if not _valid_location(lat, lng):
+        return jsonify({"success": False, "message": "lat and lng must be a valid location!"}), 400
+
+    options, error = _ranking_options(request.args)
+    if error:
+        return error
+
+    ranked = ranker.rank(availability.current(), [(lat, lng)], **options)[0]
+    return jsonify({"success": True, "carparks": _ranked_carparks(ranked)}), 200
+
+@app.route("/carparks/rank/batch", methods=["POST"])
+def rank_carparks_batch():
+    """
+    Batch Rank Carparks Route:
+    Ranks the carparks near many destinations at once, eg. one per vehicle of a fleet,
+    with the same options as the single destination route.
+
+    Returns:
+        - success message with one list of carparks per destination, in the same order.
+        - error message if the destinations or options are invalid.
+    """
+    data = request.json
+    destinations = data.get("destinations") if isinstance(data, dict) else None
+
+    if not isinstance(destinations, list) or not 1 <= len(destinations) <= MAX_RANK_DESTINATIONS:
+        return jsonify({"success": False, "message": f"A list of 1 to {MAX_RANK_DESTINATIONS} destinations is required!"}), 400
+
+    points = []
+    for destination in destinations:
+        lat = _number(destination, "lat") if isinstance(destination, dict) else None
+        lng = _number(destination, "lng") if isinstance(destination, dict) else None
+        if lat is None or lng is None or not _valid_location(lat, lng):
+            return jsonify({"success": False, "message": "Every destination needs a lat and lng!"}), 400
+        points.append((lat, lng))
+
+    options, error = _ranking_options(data)
+    if error:
+        return error
+
+    results = ranker.rank(availability.current(), points, **options)
+    return jsonify({"success": True, "results": [_ranked_carparks(ranked) for ranked in results]}), 200
+
+# most carparks /carparks/popular returns, and the largest radius (km) it searches
+MAX_POPULAR = 50
+MAX_POPULAR_RADIUS = 5.0
+
+@app.route("/carparks/popular", methods=["GET"])
+def get_popular_carparks():
+    """
+    Popular Carparks Route:
+    Retrieves the carparks favourited by the most users, overall, or within `radius` km
+    of `lat` and `lng` if they are given. Favourites are counted as they are added and removed,
+    so the counts are read, not computed, here.
+
+    Returns:
+        - success message with the top n carparks, most favourited first, each with its
+          number of favourites (and distance in km, near a point).
+        - error message if the query parameters are invalid.
+    """
+    n = request.args.get("n", default=10, type=int)
+    lat = request.args.get("lat", type=float)
+    lng = request.args.get("lng", type=float)
+    radius = request.args.get("radius", default=1.0, type=float)
+
+    if not 1 <= n <= MAX_POPULAR:
+        return jsonify({"success": False, "message": f"n must be between 1 and {MAX_POPULAR}!"}), 400
+    if (lat is None) != (lng is None):
+        return jsonify({"success": False, "message": "lat and lng must be given together!"}), 400
+    if lat is not None and not _valid_location(lat, lng):
+        return jsonify({"success": False, "message": "lat and lng must be a valid location!"}), 400
+    if not 0 < radius <= MAX_POPULAR_RADIUS:
+        return jsonify({"success": False, "message": f"radius must be more than 0 and at most {MAX_POPULAR_RADIUS}!"}), 400
+
+    records = catalogue.records()
+
+    if lat is None:
+        # the first n entries of the counts' index
+        top = acc_database.most_favourited(n)
+        if top is False:
+            return jsonify({"success": False, "message": "Failed to get popular carparks!"}), 500
+
+        carparks = []
+        for carpark_no, count in top:
+            i = catalogue.find(carpark_no)
+            record = {"carparkNumber": carpark_no} if i is None else dict(records[i])
+            record["favourites"] = count
+            carparks.append(record)
+        return jsonify({"success": True, "carparks": carparks}), 200
+
+    # the carparks in range come from the grid index, then one keyed lookup of their counts
+    nearby = catalogue.nearby(lat, lng, radius)
+    counts = acc_database.favourite_counts([catalogue.carpark_no[i] for _, i in nearby])
+    if counts is False:
+        return jsonify({"success": False, "message": "Failed to get popular carparks!"}), 500
+
+    # most favourited first, then nearest
+    top = heapq.nsmallest(n, ((-counts[catalogue.carpark_no[i]], distance, i)
+                              for distance, i in nearby if catalogue.carpark_no[i] in counts))
+    carparks = [dict(records[i], favourites=-negative_count, distance=distance)
+                for negative_count, distance, i in top]
+    return jsonify({"success": True, "carparks": carparks}), 200
+
+@app.route("/carparks/<carpark_no>/favourites", methods=["GET"])
+def get_carpark_favourites(carpark_no):
+    """
+    Carpark Favourites Route:
+    Retrieves how many users have favourited a carpark.
+
+    Returns:
+        - success message with the carpark's number of favourites.
+        - error message if the carpark is not in the catalogue.
+    """
+    if catalogue.find(carpark_no) is None:
+        return jsonify({"success": False, "message": "Carpark not found!"}), 404
+
+    counts = acc_database.favourite_counts([carpark_no])
+    if counts is False:
+        return jsonify({"success": False, "message": "Failed to get favourites!"}), 500
+
+    return jsonify({"success": True, "carpark_no": carpark_no, "favourites": counts.get(carpark_no, 0)}), 200
+
+# largest number of alert subscriptions an account may have
+MAX_ALERTS = 50
+
+@app.route("/alerts", methods=["POST"])
+def add_alert():
+    """
+    Add Alert Route:
+    Subscribes a user to an alert for when a carpark's available lots go above or below a threshold.
+    Subscribing again to the same alert returns the existing subscription.
+
+    Returns:
+        - success message with the subscription.
+        - error message if the alert is invalid, the account or carpark does not exist,
+          or the account already has MAX_ALERTS subscriptions.
+    """
+    data = request.json
+    email = data.get("email")
+    carpark_no = data.get("carpark_no")
+    direction = data.get("direction")
+    lots = data.get("lots")
+
+    if direction not in acc_store.ALERT_DIRECTIONS:
+        return jsonify({"success": False, "message": "direction must be above or below!"}), 400
+    if type(lots) is not int or lots < 0:
+        return jsonify({"success": False, "message": "lots must be a whole number, at least 0!"}), 400
+
+    denied = check_session(email)
+    if denied:
+        return denied
+
+    if not isinstance(email, str) or acc_database.find_acc(email) is None:
+        return jsonify({"success": False, "message": "Account not found!"}), 404
+    if not isinstance(carpark_no, str) or catalogue.find(carpark_no) is None:
+        return jsonify({"success": False, "message": "Carpark not found!"}), 404
+
+    existing = acc_database.get_alerts(email)
+    if existing is False:
+        return jsonify({"success": False, "message": "Failed to add alert!"}), 500
+    if len(existing) >= MAX_ALERTS:
+        return jsonify({"success": False, "message": f"At most {MAX_ALERTS} alerts are allowed!"}), 409
+
+    alert_id = acc_database.add_alert(email, carpark_no, direction, lots)
+    if alert_id is False:
+        return jsonify({"success": False, "message": "Failed to add alert!"}), 500
+
+    alert = {"id": alert_id, "carpark_no": carpark_no, "direction": direction, "lots": lots}
+    return jsonify({"success": True, "message": "Alert added!", "alert": alert}), 200
+
+@app.route("/alerts/<email>", methods=["GET"])
+def get_alerts(email):
+    """
+    Get Alerts Route:
+    Retrieves the user's alert subscriptions, oldest first.
+
+    Returns:
+        - success message with the list of alerts.
+        - error message if they could not be read.
+    """
+    denied = check_session(email)
+    if denied:
+        return denied
+
+    user_alerts = acc_database.get_alerts(email)
+    if user_alerts is False:
+        return jsonify({"success": False, "message": "Failed to get alerts!"}), 500
+
+    return jsonify({"success": True, "alerts": user_alerts}), 200
+
+@app.route("/alerts/<email>/<int:alert_id>", methods=["DELETE"])
+def delete_alert(email, alert_id):
+    """
+    Delete Alert Route:
+    Removes one of the user's alert subscriptions.
+
+    Returns:
+        - success message if the alert is removed.
+        - error message if the user has no such alert or removal fails.
+    """
+    denied = check_session(email)
+    if denied:
+        return denied
+
+    result = acc_database.delete_alert(email, alert_id)
+    if result is None:
+        return jsonify({"success": False, "message": "Alert not found!"}), 404
+    if not result:
+        return jsonify({"success": False, "message": "Failed to remove alert!"}), 500
+
+    return jsonify({"success": True, "message": "Alert removed!"}), 200
+
+def _history_range(default_days):
+    """
+    Reads the start and end unix timestamps of a history query,
+    defaulting to the last default_days days.
+    """
+    end = request.args.get("end", default=int(time.time()), type=int)
+    start = request.args.get("start", default=end - default_days * 86400, type=int)
+    return start, end
+
+@app.route("/history/<carpark_no>", methods=["GET"])
+def get_history(carpark_no):
+    """
+    Get Availability History Route:
+    Retrieves the recorded available lots of a carpark over a time range.
+
+    Returns:
+        - success message with a list of [timestamp, lots] points.
+        - error message if the carpark has no history.
+    """
+    start, end = _history_range(1)
+    points = history.series(carpark_no, start, end)
+    if points is None:
+        return jsonify({"success": False, "message": "No history for this carpark!"}), 404
+
+    return jsonify({"success": True, "carpark_no": carpark_no, "points": points}), 200
+
+@app.route("/history/<carpark_no>/aggregate", methods=["GET"])
+def get_history_aggregate(carpark_no):
+    """
+    Get Aggregated Availability History Route:
+    Retrieves the min/avg/max available lots of a carpark per time bucket.
+
+    Returns:
+        - success message with a list of buckets.
+        - error message if the bucket size is invalid or the carpark has no history.
+    """
+    start, end = _history_range(1)
+    bucket = request.args.get("bucket", default=3600, type=int)
+    if bucket <= 0:
+        return jsonify({"success": False, "message": "bucket must be positive!"}), 400
+
+    buckets = history.aggregate(carpark_no, start, end, bucket)
+    if buckets is None:
+        return jsonify({"success": False, "message": "No history for this carpark!"}), 404
+
+    return jsonify({"success": True, "carpark_no": carpark_no, "bucket": bucket, "buckets": buckets}), 200
+
+@app.route("/history/<carpark_no>/profile", methods=["GET"])
+def get_history_profile(carpark_no):
+    """
+    Get Availability Profile Route:
+    Retrieves the min/avg/max available lots of a carpark by time of day (Singapore time),
+    optionally only on some days of the week.
+
+    Returns:
+        - success message with a list of buckets, each starting at a number of seconds after midnight.
+        - error message if the parameters are invalid or the carpark has no history.
+    """
+    start, end = _history_range(28)
+    bucket = request.args.get("bucket", default=3600, type=int)
+    days_arg = request.args.get("days")
+
+    if bucket <= 0 or bucket > 86400:
+        return jsonify({"success": False, "message": "bucket must be between 1 and 86400 seconds!"}), 400
+
+    if days_arg is None:
+        days = None
+    elif days_arg == "weekdays":
+        days = availability_history.WEEKDAYS
+    elif days_arg == "weekends":
+        days = availability_history.WEEKENDS
+    else:
+        try:
+            days = {int(day) for day in days_arg.split(",")}
+        except ValueError:
+            return jsonify({"success": False, "message": "Invalid days!"}), 400
+
+    buckets = history.profile(carpark_no, start, end, bucket, days)
+    if buckets is None:
+        return jsonify({"success": False, "message": "No history for this carpark!"}), 404
+
+    return jsonify({"success": True, "carpark_no": carpark_no, "bucket": bucket, "buckets": buckets}), 200
+
+@app.route("/stats/cache", methods=["GET"])
+def get_cache_stats():
+    """
+    Get Cache Stats Route:
+    Retrieves the hit/miss counters of the account and favourites read caches.
+
+    Returns:
+        - success message with the stats of each cache.
+    """
+    return jsonify({"success": True, "caches": acc_database.cache_stats()}), 200
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Get Metrics Route:
+    Retrieves the server's latency histograms and counters for Prometheus to scrape.
+
+    Returns:
+        - the metrics in the Prometheus text format.
+    """
+    body = metrics.registry.render(app.config["METRICS_DIR"])
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     """
-    Starts the Flask server and runs it in debug mode.
+    Starts the Flask development server in debug mode.
+    Use serve.py to run the server in production.
     """
+    # the reloader runs this in a watching process, which restarts a child process that
+    # serves requests; only the child starts the services, so they never run twice
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        # save the memory store's latest writes on the way out
+        atexit.register(acc_database.store.close)
+        # and send the alerts already queued
+        atexit.register(alerts.delivery.stop)
+        create_app()
     app.run(debug=True)
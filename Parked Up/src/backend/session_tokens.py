@@ -0,0 +1,160 @@
+"""
+Session Tokens
+
+Signed, expiring tokens that carry a user's email, issued by /login, so that
+authenticated routes can check who is calling without a database lookup.
+
+A token is `<payload>.<signature>`, both base64url encoded:
+- payload: JSON with the email (`sub`), issue time (`iat`) and expiry (`exp`).
+- signature: HMAC-SHA256 of the encoded payload with the server's secret.
+
+Verification only needs the secret and a small in-memory revocation set. An
+account that is deleted or changes its email or password is revoked, which
+rejects every token issued for it before that moment. Revocations are dropped
+once they are older than the token lifetime, since every token they could
+reject has expired by then, so the set stays small.
+
+The revocation set is per process. When several processes serve requests (eg.
+`serve.py --workers 3`), share_revocations also records every revocation where
+they all see it (the account store), and verify checks it there as well, so a
+token revoked through one worker is rejected by all of them. Issue and revocation times
+are taken from one strictly increasing clock, to the microsecond, so a token
+issued after a revocation is never rejected by it, however coarse the system
+clock is.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# token lifetime in seconds
+DEFAULT_TTL = 24 * 3600
+
+
+def _encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class SessionTokens:
+    """
+    Issues and verifies session tokens signed with a secret key.
+    """
+
+    def __init__(self, secret, ttl=DEFAULT_TTL):
+        self.secret = secret if isinstance(secret, bytes) else secret.encode("utf-8")
+        self.ttl = ttl
+        self._revoked = OrderedDict()  # email -> time of revocation, oldest first
+        self._lock = threading.Lock()
+        self._last_stamp = 0  # microseconds, the last time handed out by _stamp
+        self._record = None   # record(email, revoked_at, expired_before), when revocations are shared
+        self._lookup = None   # lookup(email) -> time of revocation or None, when revocations are shared
+
+    def share_revocations(self, record, lookup):
+        """
+        Shares revocations with other processes through record and lookup, eg. acc_database.revoke_sessions
+        and acc_database.sessions_revoked_at. verify then looks up the token's email once per call.
+
+        Parameters:
+        -record: callable(email, revoked_at, expired_before)
+        -lookup: callable(email), returning the time email was revoked or None
+        """
+        self._record = record
+        self._lookup = lookup
+
+    def _sign(self, payload):
+        return _encode(hmac.new(self.secret, payload.encode("utf-8"), hashlib.sha256).digest())
+
+    def _stamp(self):
+        """returns the current time in seconds, later than every time it returned before"""
+        with self._lock:
+            self._last_stamp = max(time.time_ns() // 1000, self._last_stamp + 1)
+            # a float keeps every microsecond distinct for the next few centuries
+            return self._last_stamp / 1e6
+
+    def issue(self, email):
+        """
+        Issues a token for email, valid for ttl seconds.
+
+        Parameters:
+        -email: str
+
+        Returns:
+        -str
+        """
+        now = self._stamp()
+        payload = _encode(json.dumps({"sub": email, "iat": now, "exp": now + self.ttl}).encode("utf-8"))
+        return f"{payload}.{self._sign(payload)}"
+
+    def verify(self, token):
+        """
+        Checks a token's signature, expiry and revocation.
+        Returns the email the token was issued for, or None if it is not valid.
+
+        Parameters:
+        -token: str
+
+        Returns:
+        -str
+        """
+        payload, _, signature = token.partition(".")
+        # compared as bytes, as compare_digest raises TypeError for str with non-ASCII characters
+        if not signature or not hmac.compare_digest(signature.encode("utf-8"), self._sign(payload).encode("utf-8")):
+            return None
+
+        try:
+            claims = json.loads(_decode(payload))
+            email, issued, expires = claims["sub"], claims["iat"], claims["exp"]
+        except (ValueError, KeyError, TypeError):
+            return None
+
+        if expires < time.time():
+            return None
+
+        revoked = self._revoked.get(email)
+        if revoked is not None and issued <= revoked:
+            return None
+
+        if self._lookup is not None:
+            try:
+                revoked = self._lookup(email)
+            except Exception as e:
+                # a token that cannot be checked is not accepted
+                print(f"Error checking session revocation: {e}")
+                return None
+            if revoked is not None and issued <= revoked:
+                return None
+
+        return email
+
+    def revoke(self, email):
+        """
+        Rejects every token issued for email until now.
+
+        Parameters:
+        -email: str
+        """
+        now = self._stamp()
+        with self._lock:
+            self._revoked.pop(email, None)
+            self._revoked[email] = now
+
+            # forget revocations older than any token that could still be valid
+            while self._revoked:
+                oldest, revoked = next(iter(self._revoked.items()))
+                if revoked >= now - self.ttl:
+                    break
+                del self._revoked[oldest]
+
+        if self._record is not None:
+            try:
+                self._record(email, now, now - self.ttl)
+            except Exception as e:
+                print(f"Error sharing session revocation: {e}")
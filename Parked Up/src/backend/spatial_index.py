@@ -0,0 +1,154 @@
+"""
+Spatial Index for Carparks
+
+A uniform grid over projected (SVY21, metres) coordinates, used to answer
+"carparks within r km" and "k nearest carparks" queries without measuring the
+distance to every carpark.
+
+Points are bucketed into square cells. A query only visits the cells that can
+contain an answer:
+- radius queries visit the cells overlapping the bounding square of the circle.
+- k-nearest queries visit rings of cells around the query point, moving outwards
+  until no unvisited cell can be closer than the k-th best match found so far.
+
+SVY21 is a transverse mercator projection with a scale factor of 1 centred on
+Singapore, so euclidean distances on it are true ellipsoidal distances to well
+under 0.1%. They can differ from the frontend's spherical haversine distances
+by up to ~0.6%, which is the error of the spherical earth model at the equator.
+"""
+
+import heapq
+import math
+
+# average number of points per cell that the default cell size aims for
+TARGET_POINTS_PER_CELL = 4
+
+
+class GridIndex:
+    """
+    Uniform grid over a set of points given as parallel x and y columns (in metres).
+    Query results are lists of (distance in metres, position) sorted by distance.
+    """
+
+    def __init__(self, xs, ys, cell_size=None):
+        self.xs = xs
+        self.ys = ys
+
+        if len(xs):
+            min_x, max_x, min_y, max_y = min(xs), max(xs), min(ys), max(ys)
+        else:
+            min_x = max_x = min_y = max_y = 0.0
+
+        if cell_size is None:
+            area = max(max_x - min_x, 1.0) * max(max_y - min_y, 1.0)
+            cell_size = math.sqrt(area * TARGET_POINTS_PER_CELL / max(len(xs), 1))
+        self.cell_size = cell_size
+
+        self.cells = {}
+        for i in range(len(xs)):
+            self.cells.setdefault(self._cell(xs[i], ys[i]), []).append(i)
+
+        self.min_cell = self._cell(min_x, min_y)
+        self.max_cell = self._cell(max_x, max_y)
+
+    def __len__(self):
+        return len(self.xs)
+
+    def _cell(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def within(self, x, y, radius):
+        """
+        Returns every point within radius metres of (x, y), nearest first.
+
+        Parameters:
+        -x: float
+        -y: float
+        -radius: float
+
+        Returns:
+        -list of (distance, position)
+        """
+        xs, ys, cells = self.xs, self.ys, self.cells
+        min_cx, min_cy = self._cell(x - radius, y - radius)
+        max_cx, max_cy = self._cell(x + radius, y + radius)
+        radius_sq = radius * radius
+
+        matches = []
+        for cx in range(max(min_cx, self.min_cell[0]), min(max_cx, self.max_cell[0]) + 1):
+            for cy in range(max(min_cy, self.min_cell[1]), min(max_cy, self.max_cell[1]) + 1):
+                for i in cells.get((cx, cy), ()):
+                    dx = xs[i] - x
+                    dy = ys[i] - y
+                    d_sq = dx * dx + dy * dy
+                    if d_sq <= radius_sq:
+                        matches.append((d_sq, i))
+
+        matches.sort()
+        return [(math.sqrt(d_sq), i) for d_sq, i in matches]
+
+    def nearest(self, x, y, k, radius=None):
+        """
+        Returns the k points nearest to (x, y), nearest first,
+        optionally limited to those within radius metres.
+
+        Parameters:
+        -x: float
+        -y: float
+        -k: int
+        -radius: float
+
+        Returns:
+        -list of (distance, position)
+        """
+        if k <= 0:
+            return []
+
+        xs, ys, cells = self.xs, self.ys, self.cells
+        cx, cy = self._cell(x, y)
+        limit_sq = math.inf if radius is None else radius * radius
+
+        # rings beyond this distance (in cells) from the query cell are empty
+        max_ring = max(
+            abs(cx - self.min_cell[0]), abs(cx - self.max_cell[0]),
+            abs(cy - self.min_cell[1]), abs(cy - self.max_cell[1]),
+        )
+
+        # max-heap of the best k matches so far, as (-distance squared, position)
+        best = []
+        ring = 0
+        while ring <= max_ring:
+            for cell in _ring_cells(cx, cy, ring):
+                for i in cells.get(cell, ()):
+                    dx = xs[i] - x
+                    dy = ys[i] - y
+                    d_sq = dx * dx + dy * dy
+                    if d_sq > limit_sq:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-d_sq, i))
+                    elif d_sq < -best[0][0]:
+                        heapq.heapreplace(best, (-d_sq, i))
+
+            # every point in an unvisited ring is at least this far away
+            reach = ring * self.cell_size
+            reach_sq = reach * reach
+            if reach_sq > limit_sq or (len(best) == k and reach_sq >= -best[0][0]):
+                break
+            ring += 1
+
+        return [(math.sqrt(-neg_d_sq), i) for neg_d_sq, i in sorted(best, reverse=True)]
+
+
+def _ring_cells(cx, cy, ring):
+    """Yields the cells at a chebyshev distance of exactly ring from (cx, cy)."""
+    if ring == 0:
+        yield (cx, cy)
+        return
+
+    for dx in range(-ring, ring + 1):
+        yield (cx + dx, cy - ring)
+        yield (cx + dx, cy + ring)
+    for dy in range(-ring + 1, ring):
+        yield (cx - ring, cy + dy)
+        yield (cx + ring, cy + dy)
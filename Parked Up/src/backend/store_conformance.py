@@ -0,0 +1,396 @@
+"""
+Account Store Conformance Checks
+
+Runs the same checks against every account store (see `acc_store.py`), through the
+public functions of `acc_database`, so the server behaves the same whichever store
+it is configured with. Each check gets a new, empty store in a temporary directory,
+and can reopen it to check that its data is kept.
+
+Add a store to STORES to check it, and a check function to CHECKS for every
+behaviour the routes rely on.
+
+Usage (from src/backend):
+    python store_conformance.py [sqlite] [memory] [-v]
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import threading
+import traceback
+
+import acc_database
+import acc_store
+
+PASSWORD = "Passw0rd!"
+
+
+def sqlite_store(directory):
+    acc_database.dbpath = os.path.join(directory, "acc_database.db")
+    return acc_database.SQLiteStore()
+
+
+def memory_store(directory):
+    return acc_store.MemoryStore(os.path.join(directory, "accounts.json"))
+
+
+# name -> callable returning a store kept in the given directory
+STORES = {
+    "sqlite": sqlite_store,
+    "memory": memory_store,
+}
+
+
+def signup(email, phone_no="91234567", username="user"):
+    return acc_database.signup_acc(username, email, phone_no, PASSWORD)
+
+
+def record(email, phone_no="91234567", username="user", password=PASSWORD):
+    return {"username": username, "email": email, "phone_no": phone_no, "password": password}
+
+
+def check_signup_and_find(reopen):
+    assert signup("a@example.com", username="alice") == acc_database.OK
+    assert acc_database.find_acc("a@example.com") == {
+        "username": "alice", "email": "a@example.com", "phone_no": 91234567, "password": PASSWORD,
+    }
+    assert acc_database.find_acc("missing@example.com") is None
+
+    # the caller's copy is not the stored account
+    acc_database.find_acc("a@example.com")["username"] = "changed"
+    assert acc_database.find_acc("a@example.com")["username"] == "alice"
+
+
+def check_signup_conflicts(reopen):
+    assert signup("a@example.com") == acc_database.OK
+    assert signup("a@example.com", "81234567") == acc_database.EMAIL_IN_USE
+    assert signup("b@example.com") == acc_database.ERROR, "phone numbers are unique"
+    assert signup("not an email", "81234567") == acc_database.INVALID
+    assert acc_database.find_acc("b@example.com") is None
+
+    assert acc_database.new_acc("c", "c@example.com", "81234567", PASSWORD) is True
+    assert acc_database.new_acc("c", "c@example.com", "71234567", PASSWORD) is False
+    assert acc_database.new_acc("d", "d@example.com", "91234567", PASSWORD) is False
+
+
+def check_login(reopen):
+    signup("a@example.com")
+    assert acc_database.login("a@example.com", PASSWORD) is True
+    assert acc_database.login("a@example.com", "Wr0ng!pass") is False
+    assert acc_database.login("missing@example.com", PASSWORD) is False
+
+
+def check_change_details(reopen):
+    signup("a@example.com")
+    signup("b@example.com", "81234567")
+    acc_database.add_fav("a@example.com", "CP1")
+
+    change = acc_database.change_details
+    assert change("missing@example.com", PASSWORD, record("x@example.com")) == acc_database.NOT_FOUND
+    assert change("a@example.com", "Wr0ng!pass", record("x@example.com")) == acc_database.WRONG_PASSWORD
+    assert change("a@example.com", PASSWORD, record("x@example.com", "123")) == acc_database.INVALID
+    assert change("a@example.com", PASSWORD, record("b@example.com")) == acc_database.EMAIL_IN_USE
+    assert change("a@example.com", PASSWORD, record("a@example.com", "81234567")) == acc_database.ERROR
+    assert acc_database.find_acc("a@example.com")["phone_no"] == 91234567
+
+    # keeping the phone number, changing everything else
+    assert change("a@example.com", PASSWORD, record("x@example.com", username="xavier",
+                                                    password="N3w!passw")) == acc_database.OK
+    assert acc_database.find_acc("a@example.com") is None
+    assert acc_database.find_acc("x@example.com") == {
+        "username": "xavier", "email": "x@example.com", "phone_no": 91234567, "password": "N3w!passw",
+    }
+    assert acc_database.get_all_favs("a@example.com") is None
+    assert acc_database.get_all_favs("x@example.com") == ["CP1"]
+
+    # the old phone number is free again once changed
+    assert change("x@example.com", "N3w!passw", record("x@example.com", "71234567")) == acc_database.OK
+    assert signup("c@example.com", "91234567") == acc_database.OK
+
+
+def check_update_details(reopen):
+    signup("a@example.com")
+    signup("b@example.com", "81234567")
+
+    assert acc_database.update_details("missing@example.com", record("m@example.com", "71234567")) is False
+    assert acc_database.update_details("a@example.com", record("b@example.com")) is False
+    assert acc_database.update_details("a@example.com", record("a@example.com", "bad")) is False
+    assert acc_database.update_details("a@example.com", record("y@example.com", username="yan")) is True
+    assert acc_database.find_acc("y@example.com")["username"] == "yan"
+    assert acc_database.find_acc("a@example.com") is None
+
+
+def check_favourites(reopen):
+    email = "a@example.com"
+    assert acc_database.get_all_favs(email) is None
+
+    for carpark_no in ("CP3", "CP1", "CP2", "CP1"):
+        assert acc_database.add_fav(email, carpark_no) is True
+    assert acc_database.get_all_favs(email) == ["CP1", "CP2", "CP3"]
+
+    assert acc_database.delete_fav(email, "CP2") is True
+    assert acc_database.delete_fav(email, "CP9") is True
+    assert acc_database.get_all_favs(email) == ["CP1", "CP3"]
+
+    # favourites are per user
+    acc_database.add_fav("b@example.com", "CP1")
+    assert acc_database.delete_all_favs(email) is True
+    assert acc_database.get_all_favs(email) is None
+    assert acc_database.get_all_favs("b@example.com") == ["CP1"]
+
+
+def check_apply_fav_changes(reopen):
+    email = "a@example.com"
+    acc_database.add_fav(email, "CP1")
+    acc_database.add_fav(email, "CP2")
+
+    assert acc_database.apply_fav_changes(email, [
+        {"op": "add", "carpark_no": "CP4"},
+        {"op": "remove", "carpark_no": "CP1"},
+        {"op": "add", "carpark_no": "CP3"},
+        {"op": "remove", "carpark_no": "CP3"},
+        {"op": "remove", "carpark_no": "CP2"},
+        {"op": "add", "carpark_no": "CP2"},
+    ]) == ["CP2", "CP4"]
+    assert acc_database.get_all_favs(email) == ["CP2", "CP4"]
+
+    assert acc_database.apply_fav_changes(email, [{"op": "toggle", "carpark_no": "CP1"}]) is False
+    assert acc_database.apply_fav_changes(email, [{"op": "remove", "carpark_no": c} for c in ("CP2", "CP4")]) == []
+    assert acc_database.get_all_favs(email) is None
+
+
+def check_update_fav_email(reopen):
+    acc_database.add_fav("a@example.com", "CP1")
+    acc_database.add_fav("a@example.com", "CP2")
+    acc_database.add_fav("b@example.com", "CP2")
+    acc_database.add_fav("b@example.com", "CP3")
+
+    assert acc_database.update_fav_email("a@example.com", "b@example.com") is True
+    assert acc_database.get_all_favs("a@example.com") is None
+    assert acc_database.get_all_favs("b@example.com") == ["CP1", "CP2", "CP3"]
+
+
+def check_delete_acc(reopen):
+    signup("a@example.com")
+    signup("b@example.com", "81234567")
+    acc_database.add_fav("a@example.com", "CP1")
+    acc_database.add_fav("b@example.com", "CP1")
+
+    assert acc_database.delete_acc("a@example.com") is True
+    assert acc_database.delete_acc("a@example.com") is None
+    assert acc_database.find_acc("a@example.com") is None
+    assert acc_database.get_all_favs("a@example.com") is None
+    assert acc_database.get_all_favs("b@example.com") == ["CP1"]
+
+    # the email and phone number can be used again
+    assert signup("a@example.com") == acc_database.OK
+
+
+def check_reopen(reopen):
+    signup("a@example.com", username="alice")
+    signup("b@example.com", "81234567")
+    acc_database.add_fav("a@example.com", "CP1")
+    acc_database.add_fav("a@example.com", "CP2")
+    acc_database.delete_acc("b@example.com")
+
+    reopen()
+    assert acc_database.find_acc("a@example.com") == {
+        "username": "alice", "email": "a@example.com", "phone_no": 91234567, "password": PASSWORD,
+    }
+    assert acc_database.find_acc("b@example.com") is None
+    assert acc_database.get_all_favs("a@example.com") == ["CP1", "CP2"]
+    assert signup("c@example.com") == acc_database.ERROR, "phone numbers stay unique"
+    assert signup("b@example.com", "81234567") == acc_database.OK
+
+
+def check_session_revocations(reopen):
+    assert acc_database.sessions_revoked_at("a@example.com") is None
+    acc_database.revoke_sessions("a@example.com", 100.0, 0.0)
+    acc_database.revoke_sessions("a@example.com", 50.0, 0.0)
+    acc_database.revoke_sessions("b@example.com", 120.0, 0.0)
+    assert acc_database.sessions_revoked_at("a@example.com") == 100.0, "an older revocation does not replace a newer one"
+
+    # revocations made before expired_before are forgotten
+    acc_database.revoke_sessions("c@example.com", 300.0, 110.0)
+    assert acc_database.sessions_revoked_at("a@example.com") is None
+    assert acc_database.sessions_revoked_at("b@example.com") == 120.0
+    assert acc_database.sessions_revoked_at("c@example.com") == 300.0
+
+
+def check_concurrent_signups(reopen):
+    results = []
+    barrier = threading.Barrier(8)
+
+    def run(n):
+        barrier.wait()
+        results.append(signup("a@example.com", str(81234560 + n)))
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == [acc_database.EMAIL_IN_USE] * 7 + [acc_database.OK], results
+
+
+def check_favourite_counts(reopen):
+    signup("a@example.com")
+    acc_database.add_fav("a@example.com", "CP1")
+    acc_database.add_fav("a@example.com", "CP1")
+    acc_database.add_fav("a@example.com", "CP2")
+    for email in ("b@example.com", "c@example.com"):
+        acc_database.apply_fav_changes(email, [{"op": "add", "carpark_no": c} for c in ("CP2", "CP3")])
+    acc_database.delete_fav("b@example.com", "CP3")
+    acc_database.delete_fav("b@example.com", "CP9")
+
+    assert acc_database.most_favourited(10) == [("CP2", 3), ("CP1", 1), ("CP3", 1)]
+    assert acc_database.most_favourited(1) == [("CP2", 3)]
+    assert acc_database.favourite_counts(["CP1", "CP3", "CP9"]) == {"CP1": 1, "CP3": 1}
+
+    # a carpark favourited under both emails counts once after they merge
+    assert acc_database.change_details("a@example.com", PASSWORD, record("c@example.com")) == acc_database.OK
+    assert acc_database.favourite_counts(["CP1", "CP2", "CP3"]) == {"CP1": 1, "CP2": 2, "CP3": 1}
+    acc_database.update_fav_email("b@example.com", "c@example.com")
+    assert acc_database.favourite_counts(["CP2"]) == {"CP2": 1}
+
+    acc_database.apply_fav_changes("c@example.com", [{"op": "remove", "carpark_no": "CP3"},
+                                                     {"op": "add", "carpark_no": "CP4"}])
+    assert acc_database.most_favourited(10) == [("CP1", 1), ("CP2", 1), ("CP4", 1)]
+
+    assert acc_database.delete_acc("c@example.com") is True
+    assert acc_database.most_favourited(10) == []
+
+    acc_database.add_fav("d@example.com", "CP5")
+    acc_database.delete_all_favs("d@example.com")
+    acc_database.add_fav("e@example.com", "CP6")
+    assert acc_database.rebuild_favourite_counts() == 0
+
+    reopen()
+    assert acc_database.most_favourited(10) == [("CP6", 1)]
+
+
+def check_alerts(reopen):
+    signup("a@example.com")
+    signup("b@example.com", "81234567")
+    version = acc_database.alerts_version()
+    first = acc_database.add_alert("a@example.com", "CP1", "below", 10)
+    second = acc_database.add_alert("a@example.com", "CP1", "above", 50)
+    assert first is not False and second is not False and first != second
+    assert acc_database.add_alert("a@example.com", "CP1", "below", 10) == first, "subscribing again is a no-op"
+    assert acc_database.add_alert("a@example.com", "CP1", "sideways", 10) is False
+    assert acc_database.add_alert("a@example.com", "CP1", "below", -1) is False
+    assert acc_database.alerts_version() != version
+    acc_database.add_alert("b@example.com", "CP2", "below", 5)
+
+    assert acc_database.get_alerts("a@example.com") == [
+        {"id": first, "carpark_no": "CP1", "direction": "below", "lots": 10},
+        {"id": second, "carpark_no": "CP1", "direction": "above", "lots": 50},
+    ]
+    assert acc_database.get_alerts("missing@example.com") == []
+    assert acc_database.delete_alert("b@example.com", first) is None, "only the owner can delete"
+    assert acc_database.delete_alert("a@example.com", second) is True
+    assert acc_database.delete_alert("a@example.com", second) is None
+
+    # alerts move with the email, and one both emails have is kept once
+    acc_database.add_alert("b@example.com", "CP1", "below", 10)
+    version = acc_database.alerts_version()
+    assert acc_database.change_details("b@example.com", PASSWORD, record("c@example.com", "81234567")) == acc_database.OK
+    assert acc_database.alerts_version() != version
+    assert acc_database.get_alerts("b@example.com") == []
+    assert [(a["carpark_no"], a["lots"]) for a in acc_database.get_alerts("c@example.com")] == [("CP2", 5), ("CP1", 10)]
+
+    reopen()
+    version, alerts = acc_database.all_alerts()
+    assert version == acc_database.alerts_version()
+    assert sorted(alerts)[0] == (first, "a@example.com", "CP1", "below", 10)
+    assert sorted(alert[1:] for alert in alerts) == [
+        ("a@example.com", "CP1", "below", 10), ("c@example.com", "CP1", "below", 10), ("c@example.com", "CP2", "below", 5),
+    ]
+    assert acc_database.add_alert("a@example.com", "CP3", "above", 1) not in {alert[0] for alert in alerts}, \
+        "ids are not reused"
+
+    assert acc_database.delete_acc("c@example.com") is True
+    assert acc_database.get_alerts("c@example.com") == []
+    assert len(acc_database.all_alerts()[1]) == 2
+
+
+CHECKS = [
+    check_signup_and_find,
+    check_signup_conflicts,
+    check_login,
+    check_change_details,
+    check_update_details,
+    check_favourites,
+    check_apply_fav_changes,
+    check_update_fav_email,
+    check_favourite_counts,
+    check_alerts,
+    check_delete_acc,
+    check_reopen,
+    check_session_revocations,
+    check_concurrent_signups,
+]
+
+
+def run_checks(name, make_store, verbose=False):
+    """
+    Runs every check against a store.
+
+    Returns:
+    -list of (check name, traceback) for the checks that failed
+    """
+    failures = []
+    for check in CHECKS:
+        with tempfile.TemporaryDirectory() as directory:
+            def reopen():
+                acc_database.store.close()
+                acc_database.use_store(make_store(directory))
+                acc_database.init_db()
+
+            acc_database.use_store(make_store(directory))
+            try:
+                # the account functions report every update on stdout
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    acc_database.init_db()
+                    check(reopen)
+            except Exception:
+                failures.append((check.__name__, traceback.format_exc()))
+            finally:
+                acc_database.store.close()
+
+        if verbose:
+            status = "FAIL" if failures and failures[-1][0] == check.__name__ else "ok"
+            print(f"{name:>8} {check.__name__:<28} {status}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("stores", nargs="*", help=f"any of {', '.join(STORES)} (default: every store)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="list every check")
+    args = parser.parse_args()
+    unknown = set(args.stores) - set(STORES)
+    if unknown:
+        parser.error(f"unknown stores: {', '.join(sorted(unknown))}")
+
+    original_store, original_dbpath = acc_database.store, acc_database.dbpath
+    failed = False
+    try:
+        for name in args.stores or STORES:
+            failures = run_checks(name, STORES[name], args.verbose)
+            for check_name, trace in failures:
+                print(f"{name}: {check_name} failed\n{trace}")
+            print(f"{name}: {len(CHECKS) - len(failures)} of {len(CHECKS)} checks passed")
+            failed = failed or bool(failures)
+    finally:
+        acc_database.dbpath = original_dbpath
+        acc_database.use_store(original_store)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()